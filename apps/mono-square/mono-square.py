@@ -1,16 +1,19 @@
 #!/usr/bin/env nmigen
 
-from nmigen import Cat, Elaboratable, Module, Signal, unsigned
+from nmigen import Cat, DomainRenamer, Elaboratable, Module, Signal, unsigned
 from nmigen.build import Attrs, Pins, Resource, Subsignal
 from nmigen_boards.icebreaker import ICEBreakerPlatform
 from nmigen_boards.resources import UARTResource
 
 from nmigen_lib import HexDisplay, OneShot, PLL
-from nmigen_lib.pipe import Pipeline
-from nmigen_lib.pipe.uart import P_UARTRx
+from nmigen_lib.pipe import AsyncPipeFIFO, PipeGraph, PipeSpec
+from nmigen_lib.pipe.uart import P_OversamplingUARTRx
 
-from synth import ChannelPair, Gate, P_I2STx, MIDIDecoder, MonoPriority
-from synth import Oscillator, SynthConfig, stereo_sample_spec
+from synth import ChannelPair, GateToLevel, P_I2STx, MIDIDecoder
+from synth import MonoPriority, Oscillator, SynthConfig, VCA
+from synth import stereo_sample_spec
+from synth.loader import ControlPort
+from synth.osc import TUNING_BYTES, TUNING_TABLE
 
 
 class Top(Elaboratable):
@@ -29,11 +32,12 @@ class Top(Elaboratable):
         clk_freq_mhz = cfg.clk_freq / 1_000_000
 
         uart_baud = 31250
-        uart_divisor = int(cfg.clk_freq // uart_baud)
+        ctl_baud = 3_000_000
         status_duration = int(0.05 * cfg.clk_freq)
 
         clk_pin = platform.request(platform.default_clk, dir='-')
         midi_uart_pins = platform.request('uart', 1)
+        ctl_uart_pins = platform.request('uart', 0)
         bad_led = platform.request('led_r', 0)
         good_led = platform.request('led_g', 0)
         seg7_pins = platform.request('seg7')
@@ -45,13 +49,26 @@ class Top(Elaboratable):
         m.submodules.pll = pll = PLL(
             freq_in_mhz=clk_in_freq_mhz,
             freq_out_mhz=clk_freq_mhz,
+            ref_domain_name='midi',
+        )
+        # The MIDI UART runs from the 12 MHz reference clock.
+        uart_rx = P_OversamplingUARTRx(clk_freq=clk_in_freq, baud=uart_baud)
+        m.submodules.uart_rx = DomainRenamer('midi')(uart_rx)
+        m.submodules.midi_fifo = midi_fifo = AsyncPipeFIFO(
+            PipeSpec(8),
+            w_domain='midi',
+        )
+        m.submodules.ctl = ctl = ControlPort(
+            cfg.clk_freq,
+            baud=ctl_baud,
+            tables={TUNING_TABLE: TUNING_BYTES},
         )
-        m.submodules.uart_rx = uart_rx = P_UARTRx(divisor=uart_divisor)
         m.submodules.midi = midi_decode = MIDIDecoder()
-        m.submodules.pri = pri = MonoPriority()
+        m.submodules.pri = pri = MonoPriority(use_velocity=True)
         m.submodules.osc = osc = Oscillator(cfg)
         m.submodules.pair = pair = ChannelPair(cfg.osc_depth)
-        m.submodules.gate = gate = Gate(stereo_sample_spec(cfg.osc_depth))
+        m.submodules.level = level = GateToLevel()
+        m.submodules.vca = vca = VCA(stereo_sample_spec(cfg.osc_depth))
         m.submodules.i2s_tx = i2s_tx = P_I2STx(cfg)
         m.submodules.recv_status = recv_status = OneShot(status_duration)
         m.submodules.err_status = err_status = OneShot(status_duration)
@@ -63,13 +80,32 @@ class Top(Elaboratable):
         m.domains += pll.domain # This switches the default clk domain
                                 # to the PLL-generated domain for Top
                                 # and all submodules.
+        m.domains += pll.ref_domain
 
         # connect modules with pipes.
-        m.submodules.event_pipe = Pipeline([uart_rx, midi_decode, pri, osc])
-        m.submodules.gate_pipe = Pipeline([pri, gate])
-        m.submodules.pulse_pipe = Pipeline([osc.pulse_out, pair.left_in])
-        m.submodules.saw_pipe = Pipeline([osc.saw_out, pair.right_in])
-        m.submodules.sample_pipe = Pipeline([pair, gate, i2s_tx])
+        pipes = PipeGraph(clk_freq=cfg.clk_freq)
+        pipes.add('uart_rx', uart_rx, rate=uart_baud / 10)
+        pipes.add('midi_fifo', midi_fifo)
+        pipes.add('ctl', ctl)
+        pipes.add('midi', midi_decode)
+        pipes.add('pri', pri)
+        pipes.add('osc', osc)
+        pipes.add('pair', pair)
+        pipes.add('level', level)
+        pipes.add('vca', vca)
+        pipes.add('i2s_tx', i2s_tx)
+        pipes.connect('uart_rx.rx_out', 'midi_fifo.fifo_in')
+        pipes.connect('midi_fifo.fifo_out', 'midi.serial_in')
+        pipes.connect('midi.note_msg_out', 'pri.note_in')
+        pipes.connect('pri.voice_note_out', 'osc.note_in', control=True)
+        pipes.connect('pri.voice_gate_out', 'level.gate_outlet')
+        pipes.connect('level.level_inlet', 'vca.level_outlet', control=True)
+        pipes.connect('osc.pulse_out', 'pair.left_in')
+        pipes.connect('osc.saw_out', 'pair.right_in')
+        pipes.connect('pair.stereo_out', 'vca.signal_outlet')
+        pipes.connect('vca.signal_inlet', 'i2s_tx.sample_outlet')
+        pipes.connect('ctl.write_out', 'osc.tune_in', control=True)
+        m.submodules.pipes = pipes
 
         note_valid = midi_decode.note_msg_out.o_valid
         note_on = midi_decode.note_msg_out.o_data.onoff
@@ -78,6 +114,8 @@ class Top(Elaboratable):
             # Connect external pins.
             pll.clk_pin.eq(clk_pin),
             uart_rx.rx_pin.eq(midi_uart_pins.rx),
+            ctl.rx_pin.eq(ctl_uart_pins.rx),
+            ctl_uart_pins.tx.eq(ctl.tx_pin),
             i2s_pins.eq(i2s_tx.tx_i2s),
 
             # Good LED flickers when Note On received.
@@ -12,7 +12,7 @@ else:
     from .oneshot import OneShot
     from .pll import PLL
     from .timer import Timer
-    from .uart import UART, UARTTx, UARTRx
+    from .uart import OversamplingUARTRx, UART, UARTTx, UARTRx
     from .seven_segment.hex_display import HexDisplay
     from .seven_segment.driver import Seg7Record
 
@@ -24,6 +24,7 @@ else:
         'I2SOut',
         'Mul',
         'OneShot',
+        'OversamplingUARTRx',
         'PLL',
         'Seg7Record',
         'Timer',
@@ -1,11 +1,43 @@
-from .spec import DATA_SIZE, START_STOP, PipeSpec
+from .spec import CREDIT, DATA_SIZE, START_STOP, PipeSpec
+from .desc import StageTiming
 from .endpoint import UnconnectedPipeEnd
 from .pipeline import Pipeline
+from .graph import PipeGraph
+from .fifo import AsyncPipeFIFO
+from .skid import SkidBuffer
+from .syncfifo import PipeFIFO
+from .analyze import PipelineAnalyzer
+from .monitor import PipeMonitor
+from .combine import Broadcast, RoundRobinMerge, Zip
+from .serdes import Deserializer, Serializer
+from .credit import CreditDelay, CreditReceiver, CreditSender
+from .simple import (LogicAndHandshakeStage, LogicStage, SimplePipeline,
+                     SimpleStage)
 
 __all__ = [
     'PipeSpec',
     'UnconnectedPipeEnd',
     'Pipeline',
+    'PipeGraph',
+    'AsyncPipeFIFO',
+    'SkidBuffer',
+    'PipeFIFO',
+    'SimpleStage',
+    'LogicStage',
+    'LogicAndHandshakeStage',
+    'SimplePipeline',
+    'StageTiming',
+    'PipelineAnalyzer',
+    'PipeMonitor',
+    'Broadcast',
+    'Zip',
+    'RoundRobinMerge',
+    'Serializer',
+    'Deserializer',
+    'CreditSender',
+    'CreditReceiver',
+    'CreditDelay',
     'DATA_SIZE',
     'START_STOP',
+    'CREDIT',
 ]
@@ -0,0 +1,325 @@
+#!/usr/bin/env nmigen
+
+from math import ceil
+
+from nmigen import Const, Elaboratable, Module, Signal
+from nmigen.back.pysim import Passive, Settle
+
+from nmigen_lib.util import Main
+
+from nmigen_lib.pipe.desc import StageTiming
+from nmigen_lib.pipe.endpoint import PipeInlet
+from nmigen_lib.pipe.pipeline import best_match, find_inlets, find_outlets
+from nmigen_lib.pipe.spec import PipeSpec
+
+
+def _timing(stage):
+    return getattr(stage, 'pipe_timing', None)
+
+
+def _handshake(end):
+    # (valid, ready) seen from either end of a connection.  Credit
+    # pipes are always ready.
+    if end._spec.credit:
+        valid = end.o_valid if isinstance(end, PipeInlet) else end.i_valid
+        return (valid, Const(1))
+    if isinstance(end, PipeInlet):
+        return (end.o_valid, end.i_ready)
+    return (end.i_valid, end.o_ready)
+
+
+class _Probe:
+
+    # Transfers and stalls on one pipe end.
+    def __init__(self, end):
+        self.valid, self.ready = _handshake(end)
+        self.transfers = []     # clock of each transfer
+        self.stalls = 0         # clocks with valid & ~ready
+
+
+class PipelineAnalyzer:
+
+    """Throughput and latency of a Pipeline.
+
+       Give it a Pipeline or a sequence of stages in Pipeline order.
+       The static analysis uses each stage's `pipe_timing`
+       (see StageTiming).  Stages without one are assumed to keep up
+       and add no latency.
+
+       For measurements, call `attach(sim)` before the simulation
+       runs.  Every pipe end between and around the stages is
+       watched on every clock.  Afterward, `table()` shows, for each
+       stage, the declared interval and latency, the measured
+       interval, latency and stall ratio, and `summary()` names the
+       stage that limits throughput and the total latency.
+
+       The stall ratio is the fraction of clocks that the stage had
+       an output ready but the next stage would not take it.
+    """
+
+    def __init__(self, pipeline, clk_freq=None):
+        self.stages = list(getattr(pipeline, 'seq', pipeline))
+        self.clk_freq = clk_freq
+        self.names = []
+        for (i, stage) in enumerate(self.stages):
+            name = type(stage).__name__
+            if sum(type(s).__name__ == name for s in self.stages) > 1:
+                name += f'[{i}]'
+            self.names.append(name)
+
+        # ends[k] is (stage k's input end, stage k's output end).
+        links = [
+            best_match(find_outlets(snk), find_inlets(src))
+            for (src, snk) in zip(self.stages, self.stages[1:])
+        ]
+        first_in = find_outlets(self.stages[0])
+        last_out = find_inlets(self.stages[-1])
+        ins = [first_in[0] if first_in else None] + [o for (o, i) in links]
+        outs = [i for (o, i) in links] + [last_out[0] if last_out else None]
+        self.ends = list(zip(ins, outs))
+        self._probes = {}
+        self.clocks = 0
+
+    # Static analysis
+
+    def static(self):
+        """Per-stage (interval, latency, max rate, limiting stage index).
+
+           Rate is in outputs per clock.
+        """
+        rows = []
+        rate = None
+        limiter = None
+        for (k, stage) in enumerate(self.stages):
+            t = _timing(stage)
+            if t is None:
+                rows.append((None, None, rate, limiter))
+                continue
+            own = 1 / t.interval
+            if t.ratio == 0 or rate is None:
+                in_rate = own if t.ratio == 0 else None
+            else:
+                in_rate = rate / t.ratio
+            if in_rate is None or own < in_rate:
+                (rate, limiter) = (own, k)
+            else:
+                rate = in_rate
+            rows.append((t.interval, t.latency, rate, limiter))
+        return rows
+
+    # Simulation
+
+    def attach(self, sim, domain='sync'):
+        """Add a passive process that watches the pipes to `sim`."""
+        for end in (e for pair in self.ends for e in pair if e is not None):
+            self._probes[id(end)] = _Probe(end)
+        probes = list(self._probes.values())
+
+        def monitor():
+            yield Passive()
+            while True:
+                yield Settle()
+                for p in probes:
+                    valid = yield p.valid
+                    ready = yield p.ready
+                    if valid and ready:
+                        p.transfers.append(self.clocks)
+                    elif valid:
+                        p.stalls += 1
+                self.clocks += 1
+                yield
+        sim.sync_process(monitor, domain=domain)
+        return self
+
+    def measured(self):
+        """Per-stage (outputs, interval, latency, stall ratio).
+
+           Entries are None when there isn't enough to measure.
+        """
+        rows = []
+        for (stage, (i_end, o_end)) in zip(self.stages, self.ends):
+            i_p = self._probes.get(id(i_end))
+            o_p = self._probes.get(id(o_end))
+            if o_p is None or not o_p.transfers:
+                rows.append((0, None, None, None))
+                continue
+            outs = o_p.transfers
+            interval = None
+            if len(outs) > 1:
+                interval = (outs[-1] - outs[0]) / (len(outs) - 1)
+            latency = None
+            if i_p is not None and i_p.transfers:
+                ins = i_p.transfers
+                t = _timing(stage)
+                if t is not None:
+                    ratio = t.ratio
+                else:
+                    ratio = max(1, round(len(ins) / len(outs)))
+                lats = [
+                    out - ins[ceil((j + 1) * ratio) - 1]
+                    for (j, out) in enumerate(outs)
+                    if ratio and ceil((j + 1) * ratio) <= len(ins)
+                ]
+                if lats:
+                    latency = sum(lats) / len(lats)
+            stall = o_p.stalls / self.clocks if self.clocks else None
+            rows.append((len(outs), interval, latency, stall))
+        return rows
+
+    # Reports
+
+    def table(self):
+        """A text table of static and measured timing."""
+        def fmt(x, spec):
+            return '-' if x is None else format(x, spec)
+        static = self.static()
+        measured = self.measured() if self._probes else [(None,) * 4] * len(
+            self.stages
+        )
+        w = max(len('stage'), *(len(n) for n in self.names))
+        lines = [
+            f'{"stage":<{w}}  {"interval":>8} {"latency":>8}  '
+            f'| {"outputs":>7} {"interval":>9} {"latency":>9} {"stall":>6}',
+            f'{"":<{w}}  {"declared":>8} {"declared":>8}  '
+            f'| {"":>7} {"measured":>9} {"measured":>9} {"ratio":>6}',
+        ]
+        for (name, s, meas) in zip(self.names, static, measured):
+            (ii, lat, _, _) = s
+            (n, m_ii, m_lat, stall) = meas
+            lines.append(
+                f'{name:<{w}}  {fmt(ii, ">8")} {fmt(lat, ">8")}  '
+                f'| {fmt(n, ">7")} {fmt(m_ii, ">9.2f")} '
+                f'{fmt(m_lat, ">9.2f")} {fmt(stall, ">6.1%")}'
+            )
+        return '\n'.join(lines)
+
+    def summary(self):
+        """The critical path: what limits throughput, and total latency."""
+        static = self.static()
+        lines = []
+        (_, _, rate, limiter) = static[-1]
+        if limiter is None:
+            lines.append('throughput: no stage declares its timing')
+        else:
+            per_clock = f'1 output per {1 / rate:,.4g} clocks'
+            if self.clk_freq:
+                per_clock += f' ({rate * self.clk_freq:,.0f} per second)'
+            lines.append(
+                f'throughput: {per_clock}, '
+                f'limited by {self.names[limiter]}'
+            )
+        latency = sum(s[1] for s in static if s[1] is not None)
+        lines.append(f'latency:    {latency} clocks declared')
+        if self._probes:
+            measured = self.measured()
+            lats = [m[2] for m in measured]
+            if all(lat is not None for lat in lats):
+                lines.append(f'            {sum(lats):,.4g} clocks measured')
+            stalls = [(m[3] or 0, k) for (k, m) in enumerate(measured)]
+            (worst, k) = max(stalls)
+            if worst:
+                lines.append(
+                    f'stalls:     worst after {self.names[k]} ({worst:.1%}),'
+                    f' so the bottleneck is downstream of it'
+                )
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    from nmigen_lib.pipe.pipeline import Pipeline
+    from nmigen_lib.pipe.skid import SkidBuffer
+
+    class Pacer(Elaboratable):
+
+        # Pass one word every `interval` clocks.
+        def __init__(self, spec, interval):
+            self.interval = interval
+            self.pipe_timing = StageTiming(interval, 1)
+            self.pacer_in = spec.outlet()
+            self.pacer_out = spec.inlet()
+
+        def elaborate(self, platform):
+            m = Module()
+            count = Signal(range(self.interval))
+            with m.If(count != 0):
+                m.d.sync += count.eq(count - 1)
+            m.d.comb += self.pacer_in.o_ready.eq(
+                (count == 0) & (~self.pacer_out.o_valid
+                                | self.pacer_out.i_ready)
+            )
+            with m.If(self.pacer_in.received()):
+                m.d.sync += [
+                    self.pacer_out.o_data.eq(self.pacer_in.i_data),
+                    self.pacer_out.o_valid.eq(True),
+                    count.eq(self.interval - 1),
+                ]
+            with m.Elif(self.pacer_out.sent()):
+                m.d.sync += self.pacer_out.o_valid.eq(False)
+            return m
+
+    spec = PipeSpec(8)
+    stages = [SkidBuffer(spec), SkidBuffer(spec), Pacer(spec, 3),
+              SkidBuffer(spec)]
+    design = Pipeline(stages)
+    stages[0].skid_in.leave_unconnected()
+    stages[-1].skid_out.leave_unconnected()
+    analyzer = PipelineAnalyzer(design, clk_freq=1_000_000)
+
+    static = analyzer.static()
+    assert static[-1][2:] == (1 / 3, 2), static
+
+    # Workaround nMigen issue #280
+    m = Module()
+    m.submodules.design = design
+    m.submodules += stages
+    i_valid = Signal()
+    i_data = Signal(8)
+    i_ready = Signal()
+    m.d.comb += [
+        stages[0].skid_in.i_valid.eq(i_valid),
+        stages[0].skid_in.i_data.eq(i_data),
+        stages[-1].skid_out.i_ready.eq(i_ready),
+    ]
+
+    N = 30
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+        analyzer.attach(sim)
+
+        @sim.sync_process
+        def writer():
+            for i in range(N):
+                yield i_data.eq(i)
+                yield i_valid.eq(True)
+                yield Settle()
+                while not (yield stages[0].skid_in.received()):
+                    yield
+                    yield Settle()
+                yield
+            yield i_valid.eq(False)
+
+        @sim.sync_process
+        def reader():
+            yield i_ready.eq(True)
+            for i in range(N):
+                yield Settle()
+                while not (yield stages[-1].skid_out.sent()):
+                    yield
+                    yield Settle()
+                assert (yield stages[-1].skid_out.o_data) == i
+                yield
+
+    print(analyzer.table())
+    print(analyzer.summary())
+    measured = analyzer.measured()
+    assert [m[0] for m in measured] == [N] * 4
+    # Everything runs at the Pacer's rate.  The first skid buffer
+    # gets a little ahead at the start.
+    assert all(abs(m[1] - 3) < 0.2 for m in measured), measured
+    # The last skid buffer is never stalled; it takes a word and
+    # passes it on the next clock.
+    assert measured[3][2:] == (1, 0), measured
+    # The skid buffers ahead of the Pacer wait two clocks of three.
+    assert measured[1][3] > 0.5, measured
+    assert 'limited by Pacer' in analyzer.summary()
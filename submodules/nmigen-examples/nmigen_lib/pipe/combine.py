@@ -0,0 +1,382 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Cat, Elaboratable, Module, Mux, Signal
+from nmigen.back.pysim import Settle
+
+from nmigen_lib.util import Main
+
+from nmigen_lib.pipe.fifo import _payload
+from nmigen_lib.pipe.spec import PipeSpec, START_STOP
+from nmigen_lib.pipe.syncfifo import PipeFIFO
+
+
+# Fan-out and fan-in.
+#
+# Each combinator can put a PipeFIFO `depth` words deep on each of
+# its branches, so one slow branch doesn't hold up the others until
+# its FIFO fills.  With `depth=0`, there are no FIFOs.
+
+
+class Broadcast(Elaboratable):
+
+    """Send each word from `data_in` to all of `data_out[0..n-1]`.
+
+       A word is taken from `data_in` once every branch has taken
+       it, not necessarily on the same clock.  A branch that has its
+       copy does not get it again.  Valid does not depend on ready,
+       and when all branches are ready, one word passes per clock.
+    """
+
+    def __init__(self, spec, n, depth=0):
+        self.spec = spec
+        self.n = n
+        self.data_in = spec.outlet()
+        self._fifos = []
+        self._fork = []
+        self.data_out = []
+        for i in range(n):
+            fork = spec.inlet()
+            self._fork.append(fork)
+            if depth:
+                fifo = PipeFIFO(spec, depth)
+                self._fifos.append(fifo)
+                self.data_out.append(fifo.fifo_out)
+            else:
+                self.data_out.append(fork)
+
+    def elaborate(self, platform):
+        d_in = self.data_in
+        m = Module()
+        for (i, fifo) in enumerate(self._fifos):
+            m.submodules[f'fifo_{i}'] = fifo
+            m.d.comb += self._fork[i].flow_to(fifo.fifo_in)
+
+        # done[i]: branch i already has the current word.
+        done = Signal(self.n)
+        taken = Cat(f.sent() | done[i] for (i, f) in enumerate(self._fork))
+        m.d.comb += d_in.o_ready.eq(taken.all())
+        payload = _payload(d_in, self.spec)
+        for (i, f) in enumerate(self._fork):
+            m.d.comb += [
+                f.o_valid.eq(d_in.i_valid & ~done[i]),
+                _payload(f, self.spec).eq(payload),
+            ]
+        with m.If(d_in.received()):
+            m.d.sync += done.eq(0)
+        with m.Else():
+            m.d.sync += done.eq(taken)
+        return m
+
+
+class Zip(Elaboratable):
+
+    """Join one word from each input into one output word.
+
+       `fields` is a sequence of (name, PipeSpec) pairs.  Each one
+       becomes an outlet named `<name>_in`.  `data_out`'s data is a
+       record with a field of the same name for each input.  If
+       every input is START_STOP, so is the output, and its start
+       and stop come from the first input.
+
+       Words are taken from all inputs on the same clock, when all
+       are valid and the output is ready.  One word per clock.
+    """
+
+    def __init__(self, fields, depth=0):
+        self.fields = list(fields)
+        specs = [spec for (name, spec) in self.fields]
+        flags = START_STOP if all(s.start_stop for s in specs) else 0
+        self.out_spec = PipeSpec(
+            tuple((name, spec.dsol) for (name, spec) in self.fields),
+            flags=flags,
+        )
+        self._fifos = []
+        self._join = []
+        for (name, spec) in self.fields:
+            join = spec.outlet()
+            self._join.append(join)
+            if depth:
+                fifo = PipeFIFO(spec, depth)
+                self._fifos.append(fifo)
+                setattr(self, f'{name}_in', fifo.fifo_in)
+            else:
+                setattr(self, f'{name}_in', join)
+        self.data_out = self.out_spec.inlet()
+
+    def elaborate(self, platform):
+        d_out = self.data_out
+        m = Module()
+        for (i, fifo) in enumerate(self._fifos):
+            m.submodules[f'fifo_{i}'] = fifo
+            m.d.comb += self._join[i].flow_from(fifo.fifo_out)
+
+        all_valid = Signal()
+        m.d.comb += [
+            all_valid.eq(Cat(j.i_valid for j in self._join).all()),
+            d_out.o_valid.eq(all_valid),
+        ]
+        for ((name, spec), j) in zip(self.fields, self._join):
+            m.d.comb += [
+                d_out.o_data[name].eq(j.i_data),
+                j.o_ready.eq(all_valid & d_out.i_ready),
+            ]
+        if self.out_spec.start_stop:
+            m.d.comb += [
+                d_out.o_start.eq(self._join[0].i_start),
+                d_out.o_stop.eq(self._join[0].i_stop),
+            ]
+        return m
+
+
+class RoundRobinMerge(Elaboratable):
+
+    """Merge words from `data_in[0..n-1]` into `data_out`.
+
+       Inputs take turns.  After input i sends a word, the next
+       valid input after i goes next, so a busy input can't starve
+       the others.  Once an input's word is offered, it stays
+       offered until it's taken.  If the spec is START_STOP, an input
+       keeps its turn from start through stop, so packets are not
+       interleaved.
+
+       One word per clock.
+    """
+
+    def __init__(self, spec, n, depth=0):
+        self.spec = spec
+        self.n = n
+        self._fifos = []
+        self._merge = []
+        self.data_in = []
+        for i in range(n):
+            merge = spec.outlet()
+            self._merge.append(merge)
+            if depth:
+                fifo = PipeFIFO(spec, depth)
+                self._fifos.append(fifo)
+                self.data_in.append(fifo.fifo_in)
+            else:
+                self.data_in.append(merge)
+        self.data_out = spec.inlet()
+
+    def elaborate(self, platform):
+        n = self.n
+        ins = self._merge
+        d_out = self.data_out
+        m = Module()
+        for (i, fifo) in enumerate(self._fifos):
+            m.submodules[f'fifo_{i}'] = fifo
+            m.d.comb += ins[i].flow_from(fifo.fifo_out)
+
+        last = Signal(range(n), reset=n - 1)    # last input served
+        hold = Signal()                         # keep the current grant
+        held = Signal(range(n))
+        pick = Signal(range(n))
+        grant = Signal(range(n))
+
+        # Pick the first valid input after `last`.
+        with m.Switch(last):
+            for l in range(n):
+                with m.Case(l):
+                    order = [(l + k) % n for k in range(1, n + 1)]
+                    m.d.comb += pick.eq(order[-1])
+                    for i in reversed(order):
+                        with m.If(ins[i].i_valid):
+                            m.d.comb += pick.eq(i)
+        m.d.comb += grant.eq(Mux(hold, held, pick))
+
+        out_payload = _payload(d_out, self.spec)
+        with m.Switch(grant):
+            for (i, inp) in enumerate(ins):
+                with m.Case(i):
+                    m.d.comb += [
+                        d_out.o_valid.eq(inp.i_valid),
+                        out_payload.eq(_payload(inp, self.spec)),
+                        inp.o_ready.eq(d_out.i_ready),
+                    ]
+
+        in_packet = Signal()
+        if self.spec.start_stop:
+            m.d.comb += in_packet.eq(~d_out.o_stop)
+        with m.If(d_out.sent()):
+            m.d.sync += [
+                last.eq(grant),
+                hold.eq(in_packet),
+                held.eq(grant),
+            ]
+        with m.Elif(d_out.o_valid):
+            m.d.sync += [
+                hold.eq(True),
+                held.eq(grant),
+            ]
+        return m
+
+
+if __name__ == '__main__':
+    from nmigen_lib.pipe.monitor import PipeMonitor
+
+    spec = PipeSpec(8, flags=START_STOP)
+    bcast = Broadcast(spec, 3)
+    bcast_b = Broadcast(spec, 2, depth=4)
+    zip_ = Zip((('a', spec), ('b', PipeSpec(4, flags=START_STOP))))
+    merge = RoundRobinMerge(spec, 3)
+    merge_b = RoundRobinMerge(spec, 3)
+    designs = (bcast, bcast_b, zip_, merge, merge_b)
+    assert zip_.out_spec.start_stop
+
+    # Workaround nMigen issue #280
+    m = Module()
+    m.submodules += designs
+
+    # Every pipe end the test drives, and the test signals driving them.
+    def drive(end):
+        if hasattr(end, 'i_valid'):
+            sigs = {
+                'valid': Signal(name='valid'),
+                'data': Signal(len(end.i_data), name='data'),
+                'start': Signal(name='start'),
+                'stop': Signal(name='stop'),
+            }
+            end.leave_unconnected()
+            m.d.comb += [
+                end.i_valid.eq(sigs['valid']),
+                end.i_data.eq(sigs['data']),
+                end.i_start.eq(sigs['start']),
+                end.i_stop.eq(sigs['stop']),
+            ]
+        else:
+            sigs = {'ready': Signal(name='ready')}
+            end.leave_unconnected()
+            m.d.comb += end.i_ready.eq(sigs['ready'])
+        return (end, sigs)
+
+    srcs = {
+        'bcast': drive(bcast.data_in),
+        'bcast_b': drive(bcast_b.data_in),
+        'zip_a': drive(zip_.a_in),
+        'zip_b': drive(zip_.b_in),
+    }
+    for (i, end) in enumerate(merge.data_in):
+        srcs[f'merge_{i}'] = drive(end)
+    for (i, end) in enumerate(merge_b.data_in):
+        srcs[f'merge_b_{i}'] = drive(end)
+    snks = {
+        'zip': drive(zip_.data_out),
+        'merge': drive(merge.data_out),
+        'merge_b': drive(merge_b.data_out),
+    }
+    for (i, end) in enumerate(bcast.data_out):
+        snks[f'bcast_{i}'] = drive(end)
+    for (i, end) in enumerate(bcast_b.data_out):
+        snks[f'bcast_b_{i}'] = drive(end)
+
+    N = 60
+    words = [(i * 37 & 0xFF, i % 4 == 0, i % 4 == 3) for i in range(N)]
+    nibbles = [(i * 5 & 0xF, i % 4 == 0, i % 4 == 3) for i in range(N)]
+    # Merge sources send four-word packets tagged with their number.
+    packets = {
+        f'merge_{i}': [(i << 6 | j, j % 4 == 0, j % 4 == 3)
+                       for j in range(16)]
+        for i in range(3)
+    }
+    received = {name: [] for name in snks}
+
+    def source(name, seq, valid_pattern):
+        (end, sigs) = srcs[name]
+        def proc():
+            for (k, (data, start, stop)) in enumerate(seq):
+                yield sigs['data'].eq(data)
+                yield sigs['start'].eq(start)
+                yield sigs['stop'].eq(stop)
+                yield sigs['valid'].eq(valid_pattern(k))
+                yield Settle()
+                n = 0
+                while not (yield end.received()):
+                    yield
+                    yield sigs['valid'].eq(True)
+                    yield Settle()
+                    n += 1
+                    assert n < 2_000, f'{name}: stuck'
+                yield
+            yield sigs['valid'].eq(False)
+        return proc
+
+    def sink(name, ready_pattern, count):
+        (end, sigs) = snks[name]
+        def proc():
+            n = 0
+            while len(received[name]) < count:
+                yield sigs['ready'].eq(ready_pattern(n))
+                yield Settle()
+                if (yield end.sent()):
+                    received[name].append((
+                        (yield end.o_data),
+                        bool((yield end.o_start)),
+                        bool((yield end.o_stop)),
+                        n,
+                    ))
+                yield
+                n += 1
+                assert n < 2_000, f'{name}: stuck'
+            yield sigs['ready'].eq(False)
+        return proc
+
+    # Every output keeps the pipe protocol, and packets stay whole.
+    monitors = [
+        PipeMonitor(end, framing=True, name=name)
+        for (name, (end, sigs)) in snks.items()
+    ]
+    m.submodules += monitors
+
+    always = lambda k: True
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+        for monitor in monitors:
+            monitor.attach(sim)
+        sim.sync_process(source('bcast', words, lambda k: k % 5 != 2))
+        sim.sync_process(source('bcast_b', words, always))
+        sim.sync_process(source('zip_a', words, lambda k: k % 3 != 0))
+        sim.sync_process(source('zip_b', nibbles, lambda k: k % 4 != 1))
+        for (name, seq) in packets.items():
+            sim.sync_process(source(name, seq, always))
+            # Input 2 is late with the first word of each packet.
+            late = name == 'merge_2'
+            sim.sync_process(source(name.replace('merge', 'merge_b'), seq,
+                                    lambda k, late=late: not late or k % 4))
+        # Broadcast branches stall on different clocks.
+        sim.sync_process(sink('bcast_0', lambda n: n % 2 == 0, N))
+        sim.sync_process(sink('bcast_1', lambda n: n % 3 != 1, N))
+        sim.sync_process(sink('bcast_2', always, N))
+        # One buffered branch stalls for a long time at the start.
+        sim.sync_process(sink('bcast_b_0', lambda n: n > 30, N))
+        sim.sync_process(sink('bcast_b_1', always, N))
+        sim.sync_process(sink('zip', lambda n: n % 7 != 3, N))
+        sim.sync_process(sink('merge', always, 48))
+        sim.sync_process(sink('merge_b', lambda n: n % 3 != 1, 48))
+
+    def strip(recs):
+        return [r[:3] for r in recs]
+
+    for name in ('bcast_0', 'bcast_1', 'bcast_2', 'bcast_b_0', 'bcast_b_1'):
+        assert strip(received[name]) == words, name
+    # The unstalled buffered branch gets ahead by the FIFO depth and one
+    # more in the broadcast.
+    n_ahead = sum(r[3] <= 30 for r in received['bcast_b_1'])
+    assert n_ahead == 4 + 1, f'buffered branch got {n_ahead} words ahead'
+    assert strip(received['zip']) == [
+        (n << 8 | w, ws, wp)
+        for ((w, ws, wp), (n, ns, np)) in zip(words, nibbles)
+    ]
+    # Whole packets, in turn, one word per clock.
+    merged = received['merge']
+    owners = [data >> 6 for (data, start, stop, n) in merged]
+    assert owners == [i // 4 % 3 for i in range(48)], owners
+    assert [r[3] for r in merged] == list(range(48)), 'merge bubbles'
+    # Whole packets, nothing lost, even with stalls.
+    for recs in (merged, received['merge_b']):
+        for i in range(3):
+            mine = [r[:3] for r in recs if r[0] >> 6 == i]
+            assert mine == packets[f'merge_{i}']
+        owners = [r[0] >> 6 for r in recs]
+        assert all(len(set(owners[i:i + 4])) == 1 for i in range(0, 48, 4))
@@ -0,0 +1,289 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Cat, Elaboratable, Module, Signal
+from nmigen.back.pysim import Settle
+
+from nmigen_lib.util import Main
+
+from nmigen_lib.pipe.desc import StageTiming
+from nmigen_lib.pipe.fifo import _payload
+from nmigen_lib.pipe.spec import CREDIT, PipeSpec, START_STOP, _PipeSpec
+from nmigen_lib.pipe.syncfifo import PipeFIFO
+
+# Credit-based flow control.
+#
+# A ready/valid pipe needs ready to get back to the sender on the
+# same clock, so registering a long pipe costs a SkidBuffer per
+# register slice.  A credit pipe has no ready.  The sender starts
+# with one credit per word the receiver can buffer, spends one per
+# word, and gets one back each time the receiver passes a word on.
+# So both directions can be registered as deeply as needed.
+#
+#   CreditSender --> CreditDelay --> ... --> CreditReceiver
+#
+# The sender and receiver have ordinary ready/valid pipes on their
+# other sides.  Between them is a link with `credit_spec(spec)`.
+#
+# A word's slot is busy for the round trip, so the link moves one
+# word per clock if `credits >= round_trip(delay)`, where `delay` is
+# the number of register stages each way.  With fewer, it moves
+# `credits` words per round trip.
+
+
+def credit_spec(spec):
+    """The link spec for ready/valid pipe `spec`."""
+    return _PipeSpec(spec.flags | CREDIT, spec.dsol)
+
+
+def round_trip(delay, uses_bram=False):
+    """Clocks a credit takes to come back over a link.
+
+       `delay` is the register stages each way, and `uses_bram`
+       says whether the receiver's FIFO is in block RAM.
+    """
+    # Sender register, FIFO, credit register, count update.
+    return 2 * delay + (5 if uses_bram else 4)
+
+
+class CreditSender(Elaboratable):
+
+    """Send a ready/valid pipe over a credit link.
+
+       `data_in` has `spec`, and `credit_out` has `credit_spec(spec)`.
+       `credits` must match the CreditReceiver's.  Ready depends only
+       on the credit count, and `credit_out` is registered.
+    """
+
+    pipe_timing = StageTiming(interval=1, latency=1)
+
+    def __init__(self, spec, credits):
+        assert not spec.credit, 'CreditSender: spec is already CREDIT'
+        assert credits >= 2, f'CreditSender: credits = {credits} < 2'
+        self.spec = spec
+        self.link_spec = credit_spec(spec)
+        self.credits = credits
+        self.data_in = spec.outlet()
+        self.credit_out = self.link_spec.inlet()
+        self.count = Signal(range(credits + 1), reset=credits)
+
+    def elaborate(self, platform):
+        d_in = self.data_in
+        link = self.credit_out
+        count = self.count
+
+        m = Module()
+        m.d.comb += d_in.o_ready.eq(count != 0)
+        m.d.sync += [
+            _payload(link, self.link_spec).eq(_payload(d_in, self.spec)),
+            link.o_valid.eq(d_in.received()),
+            count.eq(count + link.i_credit - d_in.received()),
+        ]
+        return m
+
+
+class CreditReceiver(Elaboratable):
+
+    """Receive a credit link into a ready/valid pipe.
+
+       `credit_in` has `credit_spec(spec)`, and `data_out` has `spec`.
+       Words wait in a PipeFIFO `credits` deep.  Each word taken from
+       `data_out` sends a credit back, one clock later.
+
+       The sender never has more words in flight than the FIFO can
+       hold, so it never overflows.  If it does, the link is wired
+       wrong, and `overflow` is set and stays set.
+    """
+
+    def __init__(self, spec, credits, bram_threshold=None):
+        assert not spec.credit, 'CreditReceiver: spec is already CREDIT'
+        self.spec = spec
+        self.link_spec = credit_spec(spec)
+        self.credits = credits
+        kwargs = {}
+        if bram_threshold is not None:
+            kwargs['bram_threshold'] = bram_threshold
+        self._fifo = PipeFIFO(spec, depth=credits, **kwargs)
+        self._fifo.fifo_in.leave_unconnected()  # driven from credit_in
+        self.credit_in = self.link_spec.outlet()
+        self.data_out = self._fifo.fifo_out
+        self.overflow = Signal()
+
+    @property
+    def uses_bram(self):
+        return self._fifo.uses_bram
+
+    @property
+    def pipe_timing(self):
+        return self._fifo.pipe_timing
+
+    def elaborate(self, platform):
+        link = self.credit_in
+        fifo_in = self._fifo.fifo_in
+
+        m = Module()
+        m.submodules.fifo = self._fifo
+        m.d.comb += [
+            _payload(fifo_in, self.spec).eq(_payload(link, self.link_spec)),
+            fifo_in.i_valid.eq(link.i_valid),
+        ]
+        with m.If(link.i_valid & ~fifo_in.o_ready):
+            m.d.sync += self.overflow.eq(True)
+        m.d.sync += link.o_credit.eq(self.data_out.sent())
+        return m
+
+
+class CreditDelay(Elaboratable):
+
+    """Register a credit link `stages` deep in both directions.
+
+       `delay_in` and `delay_out` have the same CREDIT spec.  Use one
+       to cross a long way, or several to spread the registers out.
+    """
+
+    def __init__(self, link_spec, stages=1):
+        assert link_spec.credit, 'CreditDelay: link_spec needs CREDIT'
+        assert stages >= 1, f'CreditDelay: stages = {stages} < 1'
+        self.link_spec = link_spec
+        self.stages = stages
+        self.pipe_timing = StageTiming(interval=1, latency=stages)
+        self.delay_in = link_spec.outlet()
+        self.delay_out = link_spec.inlet()
+
+    def elaborate(self, platform):
+        d_in = self.delay_in
+        d_out = self.delay_out
+
+        m = Module()
+        down_in = Cat(_payload(d_in, self.link_spec), d_in.i_valid)
+        down_out = Cat(_payload(d_out, self.link_spec), d_out.o_valid)
+        down = [Signal.like(down_in, name=f'down_{i}')
+                for i in range(self.stages - 1)]
+        up = [Signal(name=f'up_{i}') for i in range(self.stages - 1)]
+        for (src, dst) in zip([down_in] + down, down + [down_out]):
+            m.d.sync += dst.eq(src)
+        for (src, dst) in zip([d_out.i_credit] + up, up + [d_in.o_credit]):
+            m.d.sync += dst.eq(src)
+        return m
+
+
+if __name__ == '__main__':
+    from nmigen_lib.pipe.monitor import PipeMonitor
+
+    spec = PipeSpec(8, flags=START_STOP)
+    D = 3
+    # (credits, bram_threshold) for each link.  The second link has
+    # too few credits; the third has its FIFO in block RAM.
+    links = {
+        'full': (round_trip(D), None),
+        'short': (round_trip(D) - 4, None),
+        'bram': (round_trip(D, uses_bram=True), 0),
+    }
+
+    # Workaround nMigen issue #280
+    m = Module()
+    chains = {}
+    monitors = []
+    for (name, (credits, bram_threshold)) in links.items():
+        tx = CreditSender(spec, credits)
+        delay = CreditDelay(tx.link_spec, stages=D)
+        rx = CreditReceiver(spec, credits, bram_threshold=bram_threshold)
+        assert rx.uses_bram == (name == 'bram')
+        m.submodules[f'{name}_tx'] = tx
+        m.submodules[f'{name}_delay'] = delay
+        m.submodules[f'{name}_rx'] = rx
+        m.d.comb += [
+            delay.delay_in.flow_from(tx.credit_out),
+            rx.credit_in.flow_from(delay.delay_out),
+        ]
+        sigs = {
+            'valid': Signal(name=f'{name}_valid'),
+            'data': Signal(8, name=f'{name}_data'),
+            'start': Signal(name=f'{name}_start'),
+            'stop': Signal(name=f'{name}_stop'),
+            'ready': Signal(name=f'{name}_ready'),
+        }
+        tx.data_in.leave_unconnected()
+        rx.data_out.leave_unconnected()
+        m.d.comb += [
+            tx.data_in.i_valid.eq(sigs['valid']),
+            tx.data_in.i_data.eq(sigs['data']),
+            tx.data_in.i_start.eq(sigs['start']),
+            tx.data_in.i_stop.eq(sigs['stop']),
+            rx.data_out.i_ready.eq(sigs['ready']),
+        ]
+        monitors.append(PipeMonitor(rx.data_out, framing=True, name=name))
+        monitors.append(PipeMonitor(tx.credit_out, framing=True,
+                                    name=f'{name} link'))
+        chains[name] = (tx, rx, sigs)
+    m.submodules += monitors
+
+    N = 100
+    words = [(i * 37 & 0xFF, i % 4 == 0, i % 4 == 3) for i in range(N)]
+    times = {name: [] for name in links}
+
+    def source(name):
+        (tx, rx, sigs) = chains[name]
+        def proc():
+            for (data, start, stop) in words:
+                yield sigs['data'].eq(data)
+                yield sigs['start'].eq(start)
+                yield sigs['stop'].eq(stop)
+                yield sigs['valid'].eq(True)
+                yield Settle()
+                n = 0
+                while not (yield tx.data_in.received()):
+                    yield
+                    yield Settle()
+                    n += 1
+                    assert n < 1_000, f'{name}: stuck'
+                yield
+            yield sigs['valid'].eq(False)
+        return proc
+
+    def sink(name):
+        (tx, rx, sigs) = chains[name]
+        def proc():
+            n = 0
+            received = []
+            while len(received) < N:
+                # Stall for a while in the middle.
+                yield sigs['ready'].eq(not 60 <= n < 80)
+                yield Settle()
+                if (yield rx.data_out.sent()):
+                    received.append((
+                        (yield rx.data_out.o_data),
+                        bool((yield rx.data_out.o_start)),
+                        bool((yield rx.data_out.o_stop)),
+                    ))
+                    times[name].append(n)
+                yield
+                n += 1
+                assert n < 2_000, f'{name}: stuck'
+            assert received == words, f'{name}: wrong words'
+            assert not (yield rx.overflow), f'{name}: overflow'
+        return proc
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+        for monitor in monitors:
+            monitor.attach(sim)
+        for name in links:
+            sim.sync_process(source(name))
+            sim.sync_process(sink(name))
+
+    def rate(t):
+        # Words per clock before the stall.
+        before = [n for n in t if n < 60]
+        return (len(before) - 1) / (before[-1] - before[0])
+
+    print({name: rate(t) for (name, t) in times.items()})
+    # Enough credits: one word per clock, even through three registers
+    # each way.  Too few: `credits` words per round trip.
+    assert rate(times['full']) == 1, times['full']
+    assert rate(times['bram']) == 1, times['bram']
+    short = rate(times['short'])
+    expected = links['short'][0] / round_trip(D)
+    assert abs(short - expected) < 0.05, (short, expected)
+    # The stall fills the receiver's FIFO and then stops the sender,
+    # and nothing is lost.
+    assert all(n >= 80 for n in times['full'][-10:])
@@ -15,3 +15,19 @@ class SignalDesc(NamedTuple):
     name: str
     shape: Union[Layout, Shape]
     direction: SignalDirection = SignalDirection.DOWNSTREAM
+
+
+class StageTiming(NamedTuple):
+    """How fast a pipe stage can run.
+
+         `interval`  clocks between outputs at full speed.
+         `latency`   clocks from the last input an output needs to
+                     that output.
+         `ratio`     inputs per output.  0 for a source, and a
+                     fraction for a stage that splits its inputs.
+
+       A stage declares its timing as a `pipe_timing` attribute.
+    """
+    interval: int
+    latency: int
+    ratio: int = 1
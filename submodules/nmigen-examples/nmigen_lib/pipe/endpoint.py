@@ -1,7 +1,7 @@
 from warnings import warn_explicit
 import sys
 
-from nmigen import Record, unsigned
+from nmigen import Const, Record, unsigned
 
 from .desc import SignalDesc, SignalDirection
 
@@ -22,19 +22,20 @@ class _PipeEnd(Record):
         super().__init__(layout, src_loc_at=src_loc_at + 1, **kwargs)
         self._spec = spec
         self._connected = False
+        # Just remember where the end was created.  The warning
+        # context is only built if the warning is issued.
         frame = sys._getframe(1 + src_loc_at)
-        self._creation_context = {
-            'filename': frame.f_code.co_filename,
-            'lineno': frame.f_lineno,
-            'source': self
-        }
+        self._creation_site = (frame.f_code.co_filename, frame.f_lineno)
 
     def __del__(self):
         if not self._connected and not _silence_warnings:
+            (filename, lineno) = self._creation_site
             warn_explicit(
                 f'{self.__class__.__name__} {self!r} was never connected',
                 UnconnectedPipeEnd,
-                **self._creation_context,
+                filename=filename,
+                lineno=lineno,
+                source=self,
             )
 
     def leave_unconnected(self):
@@ -89,10 +90,14 @@ class PipeInlet(_PipeEnd):
 
     def sent(self):
         """True when data is sent on the current clock."""
+        if self._spec.credit:
+            return self.o_valid
         return self.i_ready & self.o_valid
 
     def full(self):
         """True when receiver hasn't accepted last data."""
+        if self._spec.credit:
+            return Const(0)
         return self.o_valid & ~self.i_ready
 
     def flow_to(self, outlet):
@@ -100,7 +105,8 @@ class PipeInlet(_PipeEnd):
 
     def leave_unconnected(self):
         super().leave_unconnected()
-        self.i_ready.reset = 1      # Don't block senders
+        if not self._spec.credit:
+            self.i_ready.reset = 1  # Don't block senders
 
     prefices = {
         SignalDirection.UPSTREAM: 'i_',
@@ -112,6 +118,8 @@ class PipeOutlet(_PipeEnd):
 
     def received(self):
         """true when data is received on current clock."""
+        if self._spec.credit:
+            return self.i_valid
         return self.o_ready & self.i_valid
 
     def flow_from(self, inlet):
@@ -0,0 +1,130 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Cat, ClockDomain, Elaboratable, Module, Signal
+from nmigen.back.pysim import Settle
+from nmigen.lib.fifo import AsyncFIFO
+
+from nmigen_lib.util import Main, delay
+
+from nmigen_lib.pipe.spec import PipeSpec, START_STOP
+
+
+def _payload(end, spec):
+    # All the signals that travel with the data, packed into one Value.
+    return Cat(*(end._get_signal(desc) for desc in spec.payload_signals))
+
+
+class AsyncPipeFIFO(Elaboratable):
+
+    """Carry a pipe from one clock domain to another.
+
+       `fifo_in` is in the `w_domain` clock domain, and `fifo_out` is
+       in `r_domain`.  Both have the same PipeSpec, so the FIFO can be
+       dropped into a Pipeline anywhere.
+
+       The FIFO is nMigen's AsyncFIFO: a dual-port memory with
+       gray-coded read and write pointers passed between the domains
+       through synchronizers.  `depth` is rounded up to a power of 2.
+       A word takes two or three `r_domain` clocks to come out the
+       other side.
+    """
+
+    def __init__(self, spec, depth=8, w_domain='write', r_domain='sync'):
+        self.spec = spec
+        self.depth = depth
+        self.w_domain = w_domain
+        self.r_domain = r_domain
+        self.fifo_in = spec.outlet()
+        self.fifo_out = spec.inlet()
+
+    def elaborate(self, platform):
+        fifo_in = self.fifo_in
+        fifo_out = self.fifo_out
+        w_data = _payload(fifo_in, self.spec)
+        r_data = _payload(fifo_out, self.spec)
+
+        m = Module()
+        m.submodules.fifo = fifo = AsyncFIFO(
+            width=len(w_data),
+            depth=self.depth,
+            w_domain=self.w_domain,
+            r_domain=self.r_domain,
+        )
+        m.d.comb += [
+            fifo.w_data.eq(w_data),
+            fifo.w_en.eq(fifo_in.i_valid),
+            fifo_in.o_ready.eq(fifo.w_rdy),
+
+            r_data.eq(fifo.r_data),
+            fifo_out.o_valid.eq(fifo.r_rdy),
+            fifo.r_en.eq(fifo_out.i_ready),
+        ]
+        return m
+
+
+if __name__ == '__main__':
+    spec = PipeSpec(8, flags=START_STOP)
+    design = AsyncPipeFIFO(spec, depth=4)
+    design.fifo_in.leave_unconnected()
+    design.fifo_out.leave_unconnected()
+
+    # Workaround nMigen issue #280
+    m = Module()
+    m.domains.write = ClockDomain('write')
+    m.submodules.design = design
+    i_valid = Signal()
+    i_data = Signal(8)
+    i_start = Signal()
+    i_stop = Signal()
+    i_ready = Signal()
+    m.d.comb += [
+        design.fifo_in.i_valid.eq(i_valid),
+        design.fifo_in.i_data.eq(i_data),
+        design.fifo_in.i_start.eq(i_start),
+        design.fifo_in.i_stop.eq(i_stop),
+        design.fifo_out.i_ready.eq(i_ready),
+    ]
+
+    N = 40
+    words = [(i * 37 & 0xFF, i % 5 == 0, i % 5 == 4) for i in range(N)]
+    expected = list(words)
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+        # Write clock is slow, like 12 MHz against 48 MHz.
+        sim.add_clock(1e-6, domain='sync')
+        sim.add_clock(3.7e-6, domain='write')
+
+        def writer():
+            for (i, (data, start, stop)) in enumerate(words):
+                yield i_data.eq(data)
+                yield i_start.eq(start)
+                yield i_stop.eq(stop)
+                yield i_valid.eq(True)
+                yield Settle()
+                while not (yield design.fifo_in.received()):
+                    yield
+                    yield Settle()
+                yield
+                yield i_valid.eq(False)
+                yield from delay(i // 20)
+        sim.sync_process(writer, domain='write')
+
+        @sim.sync_process
+        def reader():
+            n = 0
+            while expected:
+                # Stall for a while so the FIFO fills up.
+                yield i_ready.eq(n % 50 > 30)
+                yield Settle()
+                n += 1
+                if (yield design.fifo_out.sent()):
+                    actual = (
+                        (yield design.fifo_out.o_data),
+                        bool((yield design.fifo_out.o_start)),
+                        bool((yield design.fifo_out.o_stop)),
+                    )
+                    exp = expected.pop(0)
+                    assert actual == exp, f'expected {exp}, got {actual}'
+                yield
+                assert n < 10_000, f'missing words {expected}'
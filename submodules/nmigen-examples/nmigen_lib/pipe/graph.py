@@ -0,0 +1,400 @@
+#!/usr/bin/env nmigen
+
+from collections import namedtuple
+
+from nmigen import Elaboratable, Module, Signal
+from nmigen.back.pysim import Settle
+
+from nmigen_lib.util import Main
+
+from nmigen_lib.pipe.endpoint import PipeInlet, PipeOutlet, _PipeEnd
+from nmigen_lib.pipe.skid import SkidBuffer
+from nmigen_lib.pipe.spec import PipeSpec
+
+
+_Edge = namedtuple('_Edge', 'source sink spec skid control')
+
+
+def _members(obj):
+    # (name, end) for each public pipe end of obj, including ends in
+    # list and tuple members.
+    for (name, value) in vars(obj).items():
+        if name.startswith('_'):
+            continue
+        if isinstance(value, _PipeEnd):
+            yield (name, value)
+        elif isinstance(value, (list, tuple)):
+            for (i, v) in enumerate(value):
+                if isinstance(v, _PipeEnd):
+                    yield (f'{name}[{i}]', v)
+
+
+def _node_name(end_name):
+    return end_name.split('.')[0]
+
+
+def _per_second(rate):
+    for (scale, prefix) in ((1e6, 'M'), (1e3, 'k')):
+        if rate >= scale:
+            return f'{rate / scale:.4g} {prefix}words/s'
+    return f'{rate:.4g} words/s'
+
+
+class PipeGraph(Elaboratable):
+
+    """Connect pipe ends by name.
+
+       Register each module with `add(name, module)`.  Its pipe ends,
+       the PipeInlets and PipeOutlets among its public members, are
+       then known as "name.member", or "name.member[i]" for lists
+       of ends.  `connect('osc.saw_out', 'pair.right_in')` connects
+       one inlet to one outlet, so modules with several ends of the
+       same spec are wired exactly as written.  Pipeline, in
+       contrast, guesses by spec.
+
+       Every end of every registered module must be connected exactly
+       once.  Connecting an end twice fails at once; an end that is
+       never connected fails when the graph is elaborated, unless it
+       was passed to `leave_unconnected`.  Connections are made in
+       the order given, so elaboration is deterministic.
+
+       The graph does not add its modules as submodules, only the
+       SkidBuffers from `connect(..., skid=True)`.
+
+       `to_dot()` draws the graph for Graphviz.  Each edge shows its
+       width and, where known, its maximum rate in words per second.
+       A module's rate is the `rate` given to `add`, or else comes
+       from its `pipe_timing` (see StageTiming) and the rates into it.
+       Timing needs `clk_freq`.  Pipes connected with `control=True`,
+       such as note or level changes into an audio stage, don't set
+       the rate of the module they feed.
+    """
+
+    def __init__(self, clk_freq=None):
+        self.clk_freq = clk_freq
+        self.nodes = {}         # name: module
+        self.edges = []
+        self._ends = {}         # 'node.member': end
+        self._names = {}        # id(end): 'node.member'
+        self._rates = {}        # declared rates
+        self._stmts = []
+        self._buffers = []
+
+    def add(self, name, node, rate=None):
+        """Register `node` as `name`.  Returns `node`.
+
+           `node` may also be a single pipe end, known as `name`.
+        """
+        assert name.isidentifier(), f'PipeGraph: bad node name {name!r}'
+        assert name not in self.nodes, f'PipeGraph: duplicate node {name!r}'
+        self.nodes[name] = node
+        if rate is not None:
+            self._rates[name] = rate
+        if isinstance(node, _PipeEnd):
+            ends = [(name, node)]
+        else:
+            ends = [
+                (f'{name}.{member}', end) for (member, end) in _members(node)
+            ]
+        for (end_name, end) in ends:
+            self._ends[end_name] = end
+            self._names.setdefault(id(end), end_name)
+        return node
+
+    def end(self, name):
+        """The pipe end called `name`."""
+        try:
+            return self._ends[name]
+        except KeyError:
+            node = _node_name(name)
+            known = [n for n in self._ends if _node_name(n) == node]
+            raise ValueError(
+                f'PipeGraph: no pipe end {name!r}'
+                + (f'; {node} has {", ".join(known)}' if known else '')
+            ) from None
+
+    def _lookup(self, end):
+        # (name, end) for an end or its name.
+        if isinstance(end, str):
+            return (end, self.end(end))
+        name = self._names.get(id(end))
+        assert name is not None, f'PipeGraph: {end!r} is not in the graph'
+        return (name, end)
+
+    def connect(self, source, sink, skid=False, control=False):
+        """Connect PipeInlet `source` to PipeOutlet `sink`.
+
+           Each is a pipe end or its name.  With `skid=True`, a
+           SkidBuffer goes between them.  With `control=True`, the
+           pipe carries occasional control words, and its rate is
+           left out of the sink's rate.
+        """
+        (src_name, src) = self._lookup(source)
+        (snk_name, snk) = self._lookup(sink)
+        assert isinstance(src, PipeInlet), (
+            f'PipeGraph: {src_name} is a {type(src).__name__}, not a PipeInlet'
+        )
+        assert isinstance(snk, PipeOutlet), (
+            f'PipeGraph: {snk_name} is a {type(snk).__name__}, '
+            f'not a PipeOutlet'
+        )
+        for (name, end) in ((src_name, src), (snk_name, snk)):
+            assert not end._connected, (
+                f'PipeGraph: {name} is already connected'
+            )
+        assert src._spec == snk._spec, (
+            f'PipeGraph: {src_name} and {snk_name} have different specs'
+        )
+        if skid:
+            buf = SkidBuffer(src._spec)
+            self._buffers.append(buf)
+            self._stmts += buf.skid_in.flow_from(src)
+            self._stmts += snk.flow_from(buf.skid_out)
+        else:
+            self._stmts += snk.flow_from(src)
+        self.edges.append(
+            _Edge(src_name, snk_name, src._spec, skid, control)
+        )
+
+    def leave_unconnected(self, *names):
+        """Mark the named ends as deliberately unconnected."""
+        for name in names:
+            self.end(name).leave_unconnected()
+
+    def unconnected(self):
+        """Names of the ends that are not connected."""
+        ends = {id(e): e for e in self._ends.values()}
+        return [
+            name
+            for (key, name) in self._names.items()
+            if not ends[key]._connected
+        ]
+
+    def check(self):
+        """Raise ValueError if any end is not connected."""
+        missing = self.unconnected()
+        if missing:
+            raise ValueError(
+                f'PipeGraph: unconnected pipe ends {", ".join(missing)}'
+            )
+
+    def elaborate(self, platform):
+        self.check()
+        m = Module()
+        for (i, buf) in enumerate(self._buffers):
+            m.submodules[f'skid_{i}'] = buf
+        m.d.comb += self._stmts
+        return m
+
+    # Rates and diagrams
+
+    def rates(self):
+        """Each node's maximum output rate in words per second.
+
+           None where unknown.  Where several pipes join, the slowest
+           one sets the rate, but control pipes don't count.
+        """
+        preds = {name: [] for name in self.nodes}
+        succs = {name: [] for name in self.nodes}
+        data_preds = {name: [] for name in self.nodes}
+        for e in self.edges:
+            (src, snk) = (_node_name(e.source), _node_name(e.sink))
+            preds[snk].append(src)
+            succs[src].append(snk)
+            if not e.control:
+                data_preds[snk].append(src)
+
+        # Visit in topological order.  Nodes on a cycle are left out
+        # and get no rate.
+        waiting = {name: len(p) for (name, p) in preds.items()}
+        ready = [name for (name, n) in waiting.items() if n == 0]
+        rates = {name: None for name in self.nodes}
+        while ready:
+            name = ready.pop(0)
+            in_rates = [rates[p] for p in data_preds[name]]
+            rates[name] = self._rate(name, in_rates)
+            for s in succs[name]:
+                waiting[s] -= 1
+                if waiting[s] == 0:
+                    ready.append(s)
+        return rates
+
+    def _rate(self, name, in_rates):
+        if name in self._rates:
+            return self._rates[name]
+        in_rate = None
+        if in_rates and None not in in_rates:
+            in_rate = min(in_rates)
+        timing = getattr(self.nodes[name], 'pipe_timing', None)
+        if timing is None:
+            return in_rate
+        own = None
+        if self.clk_freq:
+            own = self.clk_freq / timing.interval
+        if timing.ratio == 0 or in_rate is None:
+            return own
+        rate = in_rate / timing.ratio
+        return rate if own is None else min(rate, own)
+
+    def to_dot(self, name='pipes'):
+        """The graph in Graphviz DOT format."""
+        rates = self.rates()
+        lines = [
+            f'digraph {name} {{',
+            '    rankdir=LR;',
+            '    node [shape=box];',
+        ]
+        for (node_name, node) in self.nodes.items():
+            lines.append(
+                f'    {node_name} [label="{node_name}\\n'
+                f'{type(node).__name__}"];'
+            )
+        for e in self.edges:
+            (src, snk) = (_node_name(e.source), _node_name(e.sink))
+            label = [
+                f'{e.source.partition(".")[2] or src} -> '
+                f'{e.sink.partition(".")[2] or snk}',
+                f'{e.spec.data_width} bits'
+                + (' + start/stop' if e.spec.start_stop else ''),
+            ]
+            if rates[src] is not None:
+                label.append(f'<= {_per_second(rates[src])}')
+            if e.skid:
+                label.append('skid')
+            if e.control:
+                label.append('control')
+            label = '\\n'.join(label)
+            lines.append(f'    {src} -> {snk} [label="{label}"];')
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+
+if __name__ == '__main__':
+    from nmigen_lib.pipe.combine import Broadcast, Zip
+    from nmigen_lib.pipe.simple import LogicStage
+
+    word_spec = PipeSpec(16)
+    byte_spec = PipeSpec(8)
+
+    # Split each word into bytes, then swap them.  `lo` and `hi` have
+    # the same specs, as do the Zip's two inputs, so only the names
+    # say which goes where.
+    graph = PipeGraph(clk_freq=1_000_000)
+    fork = graph.add('fork', Broadcast(word_spec, 2), rate=250_000)
+    lo = graph.add('lo', LogicStage(lambda i, o: o.eq(i[:8]),
+                                    word_spec, byte_spec))
+    hi = graph.add('hi', LogicStage(lambda i, o: o.eq(i[8:]),
+                                    word_spec, byte_spec))
+    join = graph.add('join', Zip((('lo', byte_spec), ('hi', byte_spec))))
+    graph.connect('fork.data_out[0]', 'lo.in_data')
+    graph.connect(fork.data_out[1], hi.in_data)
+    graph.connect('lo.out_data', 'join.hi_in', skid=True)
+    graph.connect('hi.out_data', 'join.lo_in')
+
+    # Mistakes are caught, and name the ends.
+    def fails(f, exc, text):
+        try:
+            f()
+        except exc as e:
+            assert text in str(e), f'{text!r} not in {str(e)!r}'
+        else:
+            assert False, f'expected {exc.__name__}'
+    fails(lambda: graph.connect('lo.out_data', 'join.lo_in'),
+          AssertionError, 'lo.out_data is already connected')
+    fails(lambda: graph.connect('hi.output', 'join.lo_in'),
+          ValueError, 'hi has hi.in_data, hi.out_data')
+    fails(lambda: graph.connect('join.lo_in', 'lo.in_data'),
+          AssertionError, 'join.lo_in is a PipeOutlet')
+    fails(graph.check,
+          ValueError, 'unconnected pipe ends fork.data_in, join.data_out')
+    graph.leave_unconnected('fork.data_in', 'join.data_out')
+    graph.check()
+
+    rates = graph.rates()
+    assert rates == dict(fork=250_000, lo=250_000, hi=250_000,
+                         join=250_000), rates
+    dot = graph.to_dot()
+    print(dot)
+    assert ('    lo -> join [label="out_data -> hi_in\\n8 bits'
+            '\\n<= 250 kwords/s\\nskid"];') in dot, dot
+
+    # A fast pipe and a slow one join.  As data, the slow one sets the
+    # rate.  As control, it doesn't.
+    mixes = []
+    for control in (False, True):
+        mix = PipeGraph(clk_freq=1_000_000)
+        mix.add('fast', byte_spec.inlet(), rate=48_000)
+        mix.add('slow', byte_spec.inlet(), rate=100)
+        mix.add('join', Zip((('sample', byte_spec), ('level', byte_spec))))
+        mix.connect('fast', 'join.sample_in')
+        mix.connect('slow', 'join.level_in', control=control)
+        mix.leave_unconnected('join.data_out')
+        mixes.append(mix)
+    assert mixes[0].rates()['join'] == 100
+    assert mixes[1].rates()['join'] == 48_000
+    dot = mixes[1].to_dot()
+    assert ('    slow -> join [label="slow -> level_in\\n8 bits'
+            '\\n<= 100 words/s\\ncontrol"];') in dot, dot
+
+    # Workaround nMigen issue #280
+    m = Module()
+    m.submodules.graph = graph
+    m.submodules.fork = fork
+    m.submodules.lo = lo
+    m.submodules.hi = hi
+    m.submodules.join = join
+    for (i, mix) in enumerate(mixes):
+        m.submodules[f'mix_{i}'] = mix
+        m.submodules[f'mix_join_{i}'] = mix.nodes['join']
+    i_valid = Signal()
+    i_data = Signal(16)
+    i_ready = Signal()
+    m.d.comb += [
+        fork.data_in.i_valid.eq(i_valid),
+        fork.data_in.i_data.eq(i_data),
+        join.data_out.i_ready.eq(i_ready),
+    ]
+
+    N = 50
+    words = [i * 0x1357 & 0xFFFF for i in range(N)]
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+
+        @sim.sync_process
+        def writer():
+            for (i, word) in enumerate(words):
+                yield i_data.eq(word)
+                yield i_valid.eq(i % 5 != 2)
+                yield Settle()
+                n = 0
+                while not (yield fork.data_in.received()):
+                    yield
+                    yield i_valid.eq(True)
+                    yield Settle()
+                    n += 1
+                    assert n < 1_000, 'stuck'
+                yield
+            yield i_valid.eq(False)
+
+        @sim.sync_process
+        def reader():
+            n = 0
+            for word in words:
+                yield i_ready.eq(n % 7 != 3)
+                yield Settle()
+                while not (yield join.data_out.sent()):
+                    yield
+                    n += 1
+                    assert n < 1_000, 'stuck'
+                    yield i_ready.eq(n % 7 != 3)
+                    yield Settle()
+                actual = (
+                    (yield join.data_out.o_data.lo),
+                    (yield join.data_out.o_data.hi),
+                )
+                assert actual == (word >> 8, word & 0xFF), (
+                    f'expected {word:#06x}, got {actual}'
+                )
+                yield
+                n += 1
@@ -0,0 +1,263 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Elaboratable, Module, Signal
+from nmigen.asserts import Assert, Assume
+from nmigen.back import rtlil
+from nmigen.back.pysim import Passive, Settle
+
+from nmigen_lib.util import Main
+
+from nmigen_lib.pipe.analyze import _handshake
+from nmigen_lib.pipe.endpoint import PipeInlet
+from nmigen_lib.pipe.fifo import _payload
+from nmigen_lib.pipe.spec import PipeSpec, START_STOP
+
+
+class PipeMonitor(Elaboratable):
+
+    """Check the ready/valid protocol on one pipe.
+
+       `end` may be either end of a connection.  The monitor only
+       reads its signals, so add it as a submodule next to the
+       pipe's stages.  A sender that raises valid must keep offering
+       the same word until the receiver takes it.  So the monitor
+       flags these, on the clock they happen:
+
+         `valid_dropped` -- valid fell before the word was taken.
+         `data_changed` --  the data, or start, stop or data size,
+                            changed before the word was taken.
+         `framing_error` -- with `framing=True` on a START_STOP pipe,
+                            a start inside a packet or a word outside
+                            one.
+
+       `violation` is set by the first of them and stays set.
+
+       In simulation, `attach(sim)` adds a passive process that
+       counts `transfers` and `stalls` and describes each violation
+       in `violations`.  With `strict`, the first violation fails
+       the simulation.  (pysim can't run Assert or Assume.)
+
+       For formal verification, `mode='assert'` also asserts that
+       the three flags stay clear.  Use it on pipes the design
+       drives.  `mode='assume'` assumes it instead, for pipes the
+       solver drives.
+    """
+
+    MODES = ('sim', 'assert', 'assume')
+
+    def __init__(self, end, mode='sim', framing=False, name=None):
+        assert mode in self.MODES, f'PipeMonitor: unknown mode {mode!r}'
+        spec = end._spec
+        assert not framing or spec.start_stop, (
+            f'PipeMonitor: framing needs START_STOP on {end!r}'
+        )
+        self.end = end
+        self.mode = mode
+        self.framing = framing
+        self.name = name or end.name or type(end).__name__
+
+        self.valid_dropped = Signal()
+        self.data_changed = Signal()
+        self.framing_error = Signal()
+        self.violation = Signal()
+
+        (self._valid, self._ready) = _handshake(end)
+        self._payload = _payload(end, spec)
+        self._held = Signal.like(self._payload, name='held')
+
+        self.transfers = 0
+        self.stalls = 0
+        self.violations = []
+
+    def _framing_signals(self):
+        if isinstance(self.end, PipeInlet):
+            return (self.end.o_start, self.end.o_stop)
+        return (self.end.i_start, self.end.i_stop)
+
+    def elaborate(self, platform):
+        valid = self._valid
+        ready = self._ready
+        payload = self._payload
+        held = self._held
+
+        m = Module()
+        waiting = Signal()      # offered and not taken last clock
+        m.d.sync += [
+            waiting.eq(valid & ~ready),
+            held.eq(payload),
+        ]
+        m.d.comb += [
+            self.valid_dropped.eq(waiting & ~valid),
+            self.data_changed.eq(waiting & valid & (payload != held)),
+        ]
+
+        if self.framing:
+            (start, stop) = self._framing_signals()
+            in_packet = Signal()
+            with m.If(valid & ready):
+                m.d.sync += in_packet.eq(~stop)
+                m.d.comb += self.framing_error.eq(start == in_packet)
+
+        flags = (self.valid_dropped, self.data_changed, self.framing_error)
+        with m.If(self.valid_dropped | self.data_changed
+                  | self.framing_error):
+            m.d.sync += self.violation.eq(True)
+        if self.mode != 'sim':
+            check = Assert if self.mode == 'assert' else Assume
+            m.d.comb += [check(~flag) for flag in flags]
+        return m
+
+    def attach(self, sim, domain='sync', strict=True):
+        """Add a passive process that watches the pipe to `sim`."""
+        assert self.mode == 'sim', (
+            f'PipeMonitor: pysim can\'t run mode {self.mode!r}'
+        )
+
+        def describe(clock):
+            problems = []
+            if (yield self.valid_dropped):
+                problems.append('valid dropped before the word was taken')
+            if (yield self.data_changed):
+                problems.append(
+                    f'data changed from {(yield self._held):#x} '
+                    f'to {(yield self._payload):#x} before it was taken'
+                )
+            if (yield self.framing_error):
+                problems.append('start inside a packet' if
+                                (yield self._framing_signals()[0])
+                                else 'word outside a packet')
+            return [f'clock {clock}: {self.name}: {p}' for p in problems]
+
+        def monitor():
+            yield Passive()
+            clock = 0
+            while True:
+                yield Settle()
+                valid = yield self._valid
+                ready = yield self._ready
+                if valid and ready:
+                    self.transfers += 1
+                elif valid:
+                    self.stalls += 1
+                problems = yield from describe(clock)
+                self.violations += problems
+                assert not (strict and problems), problems[0]
+                clock += 1
+                yield
+        sim.sync_process(monitor, domain=domain)
+        return self
+
+
+if __name__ == '__main__':
+    from nmigen_lib.pipe.skid import SkidBuffer
+
+    spec = PipeSpec(8, flags=START_STOP)
+
+    # Formal mode turns the checks into properties.
+    for (mode, cell) in (('assert', '$assert'), ('assume', '$assume')):
+        skid = SkidBuffer(spec)
+        skid.skid_in.leave_unconnected()
+        skid.skid_out.leave_unconnected()
+        top = Module()
+        top.submodules.skid = skid
+        top.submodules.monitor = PipeMonitor(skid.skid_out, mode=mode)
+        text = rtlil.convert(top, ports=[skid.skid_out.o_valid])
+        assert text.count(cell) >= 3, f'{mode}: no {cell} cells'
+
+    # A SkidBuffer keeps the rules, and a hand-driven sender breaks them.
+    design = SkidBuffer(spec)
+    design.skid_in.leave_unconnected()
+    design.skid_out.leave_unconnected()
+    bad = spec.inlet()
+    bad.leave_unconnected()
+    good_in = PipeMonitor(design.skid_in, framing=True, name='skid_in')
+    good_out = PipeMonitor(design.skid_out, framing=True, name='skid_out')
+    bad_mon = PipeMonitor(bad, framing=True, name='bad')
+
+    # Workaround nMigen issue #280
+    m = Module()
+    m.submodules.design = design
+    m.submodules.good_in = good_in
+    m.submodules.good_out = good_out
+    m.submodules.bad_mon = bad_mon
+    i_valid = Signal()
+    i_data = Signal(8)
+    i_start = Signal()
+    i_stop = Signal()
+    i_ready = Signal()
+    m.d.comb += [
+        design.skid_in.i_valid.eq(i_valid),
+        design.skid_in.i_data.eq(i_data),
+        design.skid_in.i_start.eq(i_start),
+        design.skid_in.i_stop.eq(i_stop),
+        design.skid_out.i_ready.eq(i_ready),
+    ]
+
+    N = 40
+    words = [(i * 37 & 0xFF, i % 4 == 0, i % 4 == 3) for i in range(N)]
+
+    # (valid, data, start, stop, ready) on each clock.
+    bad_clocks = [
+        (1, 1, 1, 0, 1),            # 0: packet starts
+        (1, 2, 0, 0, 0),            # 1: stall
+        (1, 3, 0, 0, 0),            # 2: data changed
+        (0, 3, 0, 0, 0),            # 3: valid dropped
+        (1, 4, 0, 1, 1),            # 4: packet ends
+        (1, 5, 0, 1, 1),            # 5: word outside a packet
+        (1, 6, 1, 0, 1),            # 6: packet starts
+        (1, 7, 1, 0, 1),            # 7: start inside a packet
+        (0, 0, 0, 0, 0),
+    ]
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+        good_in.attach(sim)
+        good_out.attach(sim)
+        bad_mon.attach(sim, strict=False)
+
+        @sim.sync_process
+        def writer():
+            for (i, (data, start, stop)) in enumerate(words):
+                yield i_data.eq(data)
+                yield i_start.eq(start)
+                yield i_stop.eq(stop)
+                yield i_valid.eq(i % 3 != 1)
+                yield Settle()
+                n = 0
+                while not (yield design.skid_in.received()):
+                    yield
+                    yield i_valid.eq(True)
+                    yield Settle()
+                    n += 1
+                    assert n < 1_000, 'stuck'
+                yield
+            yield i_valid.eq(False)
+
+        @sim.sync_process
+        def reader():
+            for n in range(3 * N):
+                yield i_ready.eq(n % 4 != 1)
+                yield
+
+        @sim.sync_process
+        def bad_sender():
+            for (valid, data, start, stop, ready) in bad_clocks:
+                yield bad.o_valid.eq(valid)
+                yield bad.o_data.eq(data)
+                yield bad.o_start.eq(start)
+                yield bad.o_stop.eq(stop)
+                yield bad.i_ready.eq(ready)
+                yield
+            assert (yield bad_mon.violation)
+            assert not (yield good_out.violation)
+
+    assert (good_in.transfers, good_out.transfers) == (N, N)
+    assert good_out.stalls > 0
+    assert (bad_mon.transfers, bad_mon.stalls) == (5, 2)
+    print('\n'.join(bad_mon.violations))
+    assert bad_mon.violations == [
+        'clock 2: bad: data changed from 0x2 to 0x3 before it was taken',
+        'clock 3: bad: valid dropped before the word was taken',
+        'clock 5: bad: word outside a packet',
+        'clock 7: bad: start inside a packet',
+    ], bad_mon.violations
@@ -1,21 +1,32 @@
 from nmigen import Elaboratable, Module
 
 from .endpoint import PipeInlet, PipeOutlet
+from .skid import SkidBuffer
 
 class Pipeline(Elaboratable):
 
-    def __init__(self, seq):
+    """Connect a sequence of stages, each one's inlet to the next's outlet.
+
+       With `skid=True`, a SkidBuffer goes between each pair of
+       stages, so ready and valid chains are cut at every stage.
+       That adds a clock of latency per connection.
+
+       Ends are paired by spec, first match first.  When a stage has
+       several ends with the same spec, name them with a PipeGraph.
+    """
+
+    def __init__(self, seq, skid=False):
         self.seq = seq
+        self.skid = skid
 
     def elaborate(self, platform):
         m = Module()
         sink = None
         for source in self.seq:
+            outlets = find_outlets(source)
             if sink is not None:
-                outlets = find_outlets(source)
                 if not outlets:
                     raise ValueError(f'{source} has no PipeOutlet members')
-                inlets = find_inlets(sink)
                 if not inlets:
                     raise ValueError(f'{sink} has no PipeInlet members')
                 try:
@@ -24,8 +35,17 @@ class Pipeline(Elaboratable):
                     raise ValueError(
                         f'{sink} and {source} have no matching pipe endpoints'
                     )
-                m.d.comb += outlet.flow_from(inlet)
+                if self.skid:
+                    buf = SkidBuffer(outlet._spec)
+                    m.submodules += buf
+                    m.d.comb += [
+                        buf.skid_in.flow_from(inlet),
+                        outlet.flow_from(buf.skid_out),
+                    ]
+                else:
+                    m.d.comb += outlet.flow_from(inlet)
             sink = source
+            inlets = find_inlets(sink)
         return m
 
 
@@ -48,7 +68,12 @@ def find_inlets(obj):
     ]
 
 def best_match(outlets, inlets):
+    # The first outlet that matches any inlet, and the first inlet
+    # it matches.  Index the inlets by spec, so this is linear.
+    by_spec = {}
+    for i in inlets:
+        by_spec.setdefault(i._spec, i)
     for o in outlets:
-        for i in inlets:
-            if o._spec == i._spec:
-                return o, i
+        i = by_spec.get(o._spec)
+        if i is not None:
+            return o, i
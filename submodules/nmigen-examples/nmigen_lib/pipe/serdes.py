@@ -0,0 +1,280 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Elaboratable, Module, Mux, Signal
+from nmigen.back.pysim import Settle
+
+from nmigen_lib.util import Main
+
+from nmigen_lib.pipe.desc import StageTiming
+from nmigen_lib.pipe.spec import PipeSpec, START_STOP
+
+
+def _ratio(wide_spec, narrow_spec, who):
+    wide = wide_spec.data_width
+    narrow = narrow_spec.data_width
+    assert wide % narrow == 0, (
+        f'{who}: {wide} bit words do not split into {narrow} bit words'
+    )
+    assert wide_spec.start_stop == narrow_spec.start_stop, (
+        f'{who}: both pipes or neither must have START_STOP'
+    )
+    return wide // narrow
+
+
+class Serializer(Elaboratable):
+
+    """Split each wide word into N narrow words, low word first.
+
+       `wide_in` and `narrow_out` may have any specs whose data
+       widths are a multiple; records are treated as bits.  With
+       START_STOP, a wide word's start goes on its first narrow word
+       and its stop on its last.
+
+       One narrow word per clock, so one wide word every N clocks.
+    """
+
+    def __init__(self, wide_spec, narrow_spec):
+        self.wide_spec = wide_spec
+        self.narrow_spec = narrow_spec
+        self.N = _ratio(wide_spec, narrow_spec, 'Serializer')
+        self.pipe_timing = StageTiming(interval=1, latency=1,
+                                       ratio=1 / self.N)
+        self.wide_in = wide_spec.outlet()
+        self.narrow_out = narrow_spec.inlet()
+
+    def elaborate(self, platform):
+        w_in = self.wide_in
+        n_out = self.narrow_out
+        N = self.N
+        width = self.narrow_spec.data_width
+
+        m = Module()
+        buf = Signal(self.wide_spec.data_width)
+        index = Signal(range(N))
+        start = Signal()
+        stop = Signal()
+        last = Signal()
+        m.d.comb += [
+            last.eq(index == N - 1),
+            n_out.o_data.eq(buf.word_select(index, width)),
+            w_in.o_ready.eq(~n_out.o_valid | (last & n_out.i_ready)),
+        ]
+        if self.wide_spec.start_stop:
+            m.d.comb += [
+                n_out.o_start.eq(start & (index == 0)),
+                n_out.o_stop.eq(stop & last),
+            ]
+
+        with m.If(w_in.received()):
+            m.d.sync += [
+                buf.eq(w_in.i_data),
+                index.eq(0),
+                n_out.o_valid.eq(True),
+            ]
+            if self.wide_spec.start_stop:
+                m.d.sync += [
+                    start.eq(w_in.i_start),
+                    stop.eq(w_in.i_stop),
+                ]
+        with m.Elif(n_out.sent()):
+            with m.If(last):
+                m.d.sync += n_out.o_valid.eq(False)
+            with m.Else():
+                m.d.sync += index.eq(index + 1)
+        return m
+
+
+class Deserializer(Elaboratable):
+
+    """Pack N narrow words into each wide word, low word first.
+
+       The reverse of Serializer.  With START_STOP, a start begins a
+       new wide word, dropping any partial one, and a stop ends it
+       early.  The unfilled high words are zero.
+
+       Takes one narrow word per clock, and sends a wide word on the
+       clock after its last narrow word arrives.
+    """
+
+    def __init__(self, narrow_spec, wide_spec):
+        self.narrow_spec = narrow_spec
+        self.wide_spec = wide_spec
+        self.N = _ratio(wide_spec, narrow_spec, 'Deserializer')
+        self.pipe_timing = StageTiming(interval=self.N, latency=1,
+                                       ratio=self.N)
+        self.narrow_in = narrow_spec.outlet()
+        self.wide_out = wide_spec.inlet()
+
+    def elaborate(self, platform):
+        n_in = self.narrow_in
+        w_out = self.wide_out
+        N = self.N
+        width = self.narrow_spec.data_width
+        framed = self.narrow_spec.start_stop
+
+        m = Module()
+        acc = Signal(self.wide_spec.data_width)
+        count = Signal(range(N))
+        first = Signal()                # start seen on this word
+
+        # Where this narrow word goes, and whether it finishes the
+        # wide word.
+        restart = n_in.i_start if framed else False
+        base = Signal.like(acc)
+        index = Signal.like(count)
+        filled = Signal.like(acc)
+        last = Signal()
+        m.d.comb += [
+            base.eq(Mux(restart, 0, acc)),
+            index.eq(Mux(restart, 0, count)),
+            filled.eq(base),
+            filled.word_select(index, width).eq(n_in.i_data),
+            last.eq(index == N - 1),
+        ]
+        if framed:
+            m.d.comb += last.eq((index == N - 1) | n_in.i_stop)
+
+        out_free = ~w_out.o_valid | w_out.i_ready
+        m.d.comb += n_in.o_ready.eq(~last | out_free)
+
+        with m.If(w_out.sent()):
+            m.d.sync += w_out.o_valid.eq(False)
+        with m.If(n_in.received()):
+            with m.If(last):
+                m.d.sync += [
+                    w_out.o_data.eq(filled),
+                    w_out.o_valid.eq(True),
+                    acc.eq(0),
+                    count.eq(0),
+                ]
+                if framed:
+                    m.d.sync += [
+                        w_out.o_start.eq(Mux(restart, True, first)),
+                        w_out.o_stop.eq(n_in.i_stop),
+                        first.eq(False),
+                    ]
+            with m.Else():
+                m.d.sync += [
+                    acc.eq(filled),
+                    count.eq(index + 1),
+                ]
+                if framed:
+                    m.d.sync += first.eq(Mux(restart, True, first))
+        return m
+
+
+if __name__ == '__main__':
+    byte_spec = PipeSpec(8, flags=START_STOP)
+    word_spec = PipeSpec(32, flags=START_STOP)
+    ser = Serializer(word_spec, byte_spec)
+    des = Deserializer(byte_spec, word_spec)
+    ser.wide_in.leave_unconnected()
+    ser.narrow_out.leave_unconnected()
+    des.narrow_in.leave_unconnected()
+    des.wide_out.leave_unconnected()
+
+    # Workaround nMigen issue #280
+    m = Module()
+    m.submodules.ser = ser
+    m.submodules.des = des
+    ends = (ser.wide_in, des.narrow_in)
+    ins = [
+        {n: Signal(len(getattr(e, 'i_' + n)), name=n)
+         for n in ('valid', 'data', 'start', 'stop')}
+        for e in ends
+    ]
+    readies = [Signal(name='ready') for _ in range(2)]
+    for (e, sigs) in zip(ends, ins):
+        m.d.comb += [getattr(e, 'i_' + n).eq(s) for (n, s) in sigs.items()]
+    m.d.comb += [
+        ser.narrow_out.i_ready.eq(readies[0]),
+        des.wide_out.i_ready.eq(readies[1]),
+    ]
+
+    # Serializer: three-word packets.
+    words = [(0x01020304 * (i + 1) & 0xFFFFFFFF, i % 3 == 0, i % 3 == 2)
+             for i in range(12)]
+    ser_expected = [
+        (w >> 8 * k & 0xFF, start and k == 0, stop and k == 3)
+        for (w, start, stop) in words
+        for k in range(4)
+    ]
+
+    # Deserializer: a full packet, a packet that stops early, a start
+    # that interrupts a word, then full speed.
+    def frame(data):
+        return [(d, i == 0, i == len(data) - 1) for (i, d) in enumerate(data)]
+    bytes_ = (frame([1, 2, 3, 4, 5, 6, 7, 8])
+              + frame([9, 10, 11, 12, 13, 14])
+              + [(0xEE, True, False), (0xEF, False, False)]
+              + frame(list(range(0x20, 0x20 + 4 * 20))))
+    des_expected = [
+        (0x04030201, True, False), (0x08070605, False, True),
+        (0x0C0B0A09, True, False), (0x00000E0D, False, True),
+    ] + [
+        (sum((0x20 + 4 * i + k) << 8 * k for k in range(4)),
+         i == 0, i == 19)
+        for i in range(20)
+    ]
+
+    def source(k, seq, valid_pattern):
+        sigs = ins[k]
+        def proc():
+            for (i, (data, start, stop)) in enumerate(seq):
+                yield sigs['data'].eq(data)
+                yield sigs['start'].eq(start)
+                yield sigs['stop'].eq(stop)
+                yield sigs['valid'].eq(valid_pattern(i))
+                yield Settle()
+                n = 0
+                while not (yield ends[k].received()):
+                    yield
+                    yield sigs['valid'].eq(True)
+                    yield Settle()
+                    n += 1
+                    assert n < 1_000, 'stuck'
+                yield
+            yield sigs['valid'].eq(False)
+        return proc
+
+    def sink(k, end, expected, ready_pattern, check):
+        def proc():
+            n = 0
+            times = []
+            while len(times) < len(expected):
+                yield readies[k].eq(ready_pattern(n))
+                yield Settle()
+                if (yield end.sent()):
+                    actual = (
+                        (yield end.o_data),
+                        bool((yield end.o_start)),
+                        bool((yield end.o_stop)),
+                    )
+                    exp = expected[len(times)]
+                    assert actual == exp, f'expected {exp}, got {actual}'
+                    times.append(n)
+                yield
+                n += 1
+                assert n < 1_000, f'stuck after {len(times)} words'
+            check(times)
+        return proc
+
+    def ser_check(times):
+        # After the first few words, one byte per clock.
+        t = times[8:]
+        assert t == list(range(t[0], t[0] + len(t))), t
+
+    def des_check(times):
+        # Once the output stops stalling, words come every four clocks.
+        t = times[-12:]
+        assert t == list(range(t[0], t[0] + 4 * 12, 4)), t
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+        sim.sync_process(source(0, words, lambda i: i != 1))
+        sim.sync_process(sink(0, ser.narrow_out, ser_expected,
+                              lambda n: n < 5 or n > 8, ser_check))
+        sim.sync_process(source(1, bytes_, lambda i: i != 3))
+        sim.sync_process(sink(1, des.wide_out, des_expected,
+                              lambda n: n > 40 or n % 11 != 4,
+                              des_check))
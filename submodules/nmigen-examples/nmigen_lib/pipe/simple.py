@@ -1,12 +1,14 @@
 #!/usr/bin/env nmigen
 
-from nmigen import Elaboratable, Module
+from nmigen import Elaboratable, Module, Signal, unsigned
+from nmigen.back.pysim import Settle
+from nmigen.hdl.ast import Statement
 
-from nmigen_lib.pipe import PipeSpec, START_STOP
+from nmigen_lib.util import Main
+
+from nmigen_lib.pipe.desc import StageTiming
+from nmigen_lib.pipe.spec import PipeSpec, START_STOP, _PipeSpec
 
-# This code is an idea.  It does not run in current form.
-# But boy would it make pipelining easy...
-#
 # A `SimpleStage` is a pipeline stage that can always compute one
 # result from one input in a single clock.  It has no state
 # or external timing dependencies.
@@ -15,237 +17,290 @@ from nmigen_lib.pipe import PipeSpec, START_STOP
 #   into_a = PipeSpec(...)
 #   a_to_b = PipeSpec(...)
 #   b_to_c = PipeSpec(...)
-#   out_of_c = PipeSpec(...)
 #
-#   class A(SimpleStage):
+#   # set output `o` based on input `i`.  Handshake
+#   # and flow control are provided.
+#   def a_logic(m, i, o):
+#       m.d.sync += o.eq(...)
 #
-#       # set output `o` based on input `i`.  Handshake
-#       # and flow control are provided.
-#       def logic(self, m, i, o):
-#           m.d.sync += o.eq(...)
-#           m.d.comb += ...
+#   # control both logic and optional handshake signals
+#   def b_logic(i, o):
+#       return [
+#           o.o_data.eq(...),
+#           o.o_start.eq(...), # or whatever
+#       ]
 #
-#   class B(SimpleStage):
+#   m.submodules.a = a = SimpleStage(a_logic, into_a, a_to_b)
+#   m.submodules.b = b = LogicAndHandshakeStage(b_logic, a_to_b, b_to_c)
+#   m.d.comb += a.out_data.flow_to(b.in_data)
 #
-#       # control both logic and optional handshake signals
-#       def logic_and_handshake(self, m, i, o):
-#           m.d.sync += [
-#               o.data.eq(...),
-#               o.o_start.eq(...), # or whatever
-#           ]
+# Or let SimplePipeline connect them.  Stages built from lambdas
+# get their PipeSpecs from their neighbors.
 #
-#   m.submodules.a = a = SimpleStage(into_a, a_to_b)
-#   m.submodules.b = b = SimpleStage(a_to_b, b_to_c)
-#   m.submodules.c = SimpleStage.sync_expr([o.eq(...), ...])
-#
-# And that's it.  The last one doesn't work, because the input and
-# output pipespecs are not passed in, and because `o` is not bound
-# in the expression.
-
-# Here's another idea.
-#
-#   m.pipeline = pipeline = SimplePipeline.assemble(
-#       PipeSpec(16),              # pipe takes unsigned(16) words
+#   m.submodules.pipeline = pipeline = SimplePipeline.assemble(
+#       PipeSpec(16),               # pipe takes unsigned(16) words
 #       LogicStage(
 #           lambda i, o: o.eq(some_function(i))
 #       ),
-#       PipeSpec(unsigned(12)),     # 1st stage passes unsigned(16) to 2nd
+#       PipeSpec(unsigned(12)),     # 1st stage passes unsigned(12) to 2nd
 #       LogicAndHandshakeStage(
 #           lambda i, o:
 #               [
-#                   o.o_data_size.eq(whatever),
 #                   o.o_data.flag.eq(some_condition),
-#                   o.o_data.word.eq(other_function(i)),
+#                   o.o_data.word.eq(other_function(i.i_data)),
+#                   o.o_start.eq(i.i_start),
+#                   o.o_stop.eq(i.i_stop),
 #               ]
 #       ),
-#       PipeSpec((('flag': 1), ('word', signed(8)), flags=DATA_SIZE)
-#                               # pipe emits flag + 8-bit word + data_size.
+#       PipeSpec((('flag', 1), ('word', signed(8))), flags=START_STOP),
+#                                   # pipe emits flag + 8-bit word
 #   )
+#
+# `pipeline.data_in` is the first stage's inlet, and
+# `pipeline.data_out` is the last stage's outlet.
+#
+# A stage's logic runs only on the clock it takes a new input, so
+# `m.d.sync` assignments load the output register.  Comb
+# assignments are fine for temporaries.  Each stage holds its
+# output until the next stage takes it, and takes a new input
+# whenever its output is empty or being taken, so bubbles collapse
+# and a chain of stages moves one datum per clock.  Ready is
+# combinatorial through the chain; put a SkidBuffer in a long one.
 
-class Decimator(Elaboratable):
 
-    def __init__(self, cfg):
-        ...
-        self.samples_in = mono_sample_spec(cfg.osc_depth).outlet()
-        self.samples_out = mono_sample_spec(cfg.osc_depth).inlet()
+class SimpleStage(Elaboratable):
 
-    def elaborate(self, platform):
-        m = Module()
-        N = self.M + 2
-        assert _is_power_of_2(N)
-        # kernel_RAM = Memory(width=COEFF_WIDTH, depth=N, init=kernel)
-        m.submodules.kr_port = kr_port = kernel_RAM.read_port()
-        sample_RAM = Memory(width=self.sample_depth, depth=N, init=[0] * N)
-        m.submodules.sw_port = sw_port = sample_RAM.write_port()
-        m.submodules.sr_port = sr_port = sample_RAM.read_port()
-
-        roto_sample_spec = PipeSpec(
-            (
-                ('coeff', COEFF_SHAPE),
-                ('sample', signed(sample_depth)),
-            ),
-            flags=START_STOP,
-        )
+    """A pipeline stage whose logic is `logic(m, i, o)`.
+
+       `i` is the input data and `o` is the output data.  `logic`
+       adds statements to module `m` that unconditionally compute
+       `o` from `i`.  START_STOP signals pass through.
+    """
+
+    pipe_timing = StageTiming(interval=1, latency=1)
 
-        class RotorFIFO(Elaboratable):
-            def elaborate(self):
-                m = Module()
-                # when samples_in and fifo not full: insert sample.
-                # when samples_readable and out pipe not full:
-                #     out pipe send {}
-                #         o_data.coeff = kernel[c_index],
-                #         o_data.sample = sample[...],
-                #         o_start=c_index == 1,
-                #         o_stop=c_index == ~0,
-                #     }
-                # when c_index == ~0:
-                #     c_index = 1
-                #     sr_index = start_index + R
-                #     start_index += R
-                # else:
-                #     c_index += 1
-                #     sr_index += 1
-                return m
-
-
-        m.submodules.rfifo = RotorFifo()
-        m.submodules.pipe = SimplePipeline.assemble(
-            roto_sample_spec,
-            LogicModule(lambda m, i, o: o.eq(i.coeff * i.sample)),
-            PipeSpec(signed(COEFF_WIDTH + sample_depth)),
-            LogicAndHandshakeModule(
-                lambda m, i, o: {
-                    'sync': acc.eq(Mux(i_start, i_data, acc + i_data)),
-                    'comb': o.o_data.eq(acc[shift:]),
-                }
-            ),
-            PipeSpec(signed(sample_depth)),
-            flags=START_STOP,
+    def __init__(self, logic, in_spec=None, out_spec=None):
+        assert callable(logic), (
+            f'{type(self).__name__}: logic must be callable, not {logic!r}'
         )
+        self._logic = logic
+        self.in_data = None
+        self.out_data = None
+        if in_spec is not None and out_spec is not None:
+            self.bind(in_spec, out_spec)
+
+    def bind(self, in_spec, out_spec):
+        """Create the stage's pipe endpoints."""
+        assert self.in_data is None, f'{self} is already bound'
+        self.in_data = in_spec.outlet()
+        self.out_data = out_spec.inlet()
+        return self
+
+    def elaborate(self, platform):
+        assert self.in_data is not None, f'{self} was never bound'
+        i = self.in_data
+        o = self.out_data
+        m = Module()
+        advance = Signal()
+        m.d.comb += [
+            advance.eq(~o.o_valid | o.i_ready),
+            i.o_ready.eq(advance),
+        ]
+        with m.If(advance):
+            m.d.sync += o.o_valid.eq(i.i_valid)
+        with m.If(i.received()):
+            self._stage_logic(m, i, o)
         return m
 
+    def _stage_logic(self, m, i, o):
+        # i and o are the pipe ends.
+        if i._spec.start_stop and o._spec.start_stop:
+            m.d.sync += [
+                o.o_start.eq(i.i_start),
+                o.o_stop.eq(i.i_stop),
+            ]
+        self._data_logic(m, i.i_data, o.o_data)
 
+    def _data_logic(self, m, i, o):
+        self._logic(m, i, o)
 
-class SimplePipeline(Elaboratable):
 
-    @classmethod
-    def assemble(cls, *args):
-        assert len(args) % 2 == 1
-        assert all(callable(a) for a in args[1::2])
-        assert all(isinstance(s, PipeSpec) for s in args[::2])
-        pline = cls()
-        pline.inlet = args[0]
-        pline.outlet = args[1]
-        stages = args[1:-1:2]
-        sources = args[:-2:2]
-        sinks = args[2::2]
-        for (src, stg, snk) in zip(sources, stages, sinks):
-            # get name for stage
-            # LogicStg()
-            ...
-        return pline
-
-    def __init__(self):
-        self.stages = []
-        self.connector_specs = []
-
-    # @property.setter
-    # def inlet(self, spec):
-    #     self.inlet_spec = spec
-    #     self.data_in = spec.outlet()
-    #     return self
-    #
-    # @property.setter
-    # def outlet(self, spec):
-    #     self.outlet_spec = spec
-    #     self.data_out = spec.inlet()
-    #     return self
-
-    def data(self, data):
-        self.elements.append(data)
-        return self
+def _add_logic(m, frag):
+    # frag may be a statement, a list of statements, or a dict that
+    # maps domain names to (lists of) statements.
+    if isinstance(frag, (list, tuple, Statement)):
+        m.d.sync += frag
+    elif isinstance(frag, dict):
+        for (domain, stmts) in frag.items():
+            m.d[domain] += stmts
+    else:
+        raise TypeError(f'unknown stage logic {frag!r}')
 
-    def logic_stage(self, logic):
-        """logic may be:
-              a callable
-              an assignment (e.g. a.eq(b0))
-              a list of assignments
-              a dict that maps domain names to (list of) assignments
-        """
-        self.stages.append(logic)
-        return self
 
-    def logic_and_handshake_stage(self, logic):
-        """logic may be a callable or a dict"""
-        self.elements.append(logic)
-        return self
+class LogicStage(SimpleStage):
 
-    def elaborate(self, platform):
-        ...
+    """A SimpleStage whose logic is `logic(i, o)`.
 
+       `i` is the input data and `o` is the output data.  `logic`
+       returns a statement, a list of statements, or a dict that
+       maps domain names to statements.  Lone statements and lists
+       go in the sync domain.  START_STOP signals pass through.
+    """
 
-class SimpleStage(Elaboratable):
+    def _data_logic(self, m, i, o):
+        _add_logic(m, self._logic(i, o))
 
-    def __init__(self, in_spec, out_spec):
-        self.in_data = in_spec.outlet()
-        self.out_data = out_spec.inlet()
 
-    def elaborate(self, platform):
-        m = Module()
-        m.d.comb += self.in_data.o_ready.eq(~self.out_data.full())
-        with m.If(self.in_data.received()):
-            self.logic_and_handshake(m, self.in_data, self.out_data)
-            m.d.sync += self.out_data.o_valid.eq(True)
-        with m.Else():
-            m.d.sync += self.out_data.o_valid.eq(False)
-        return
-
-    def logic_and_handshake(self, m, i, o):
-        """default implementation.  Override to access handshake signals."""
-        ...
-        return self.logic(m, i.i_data, o.o_data)
-
-    def logic(self, m, i, o):
-        """Override with code that unconditionally computes o from i."""
-        raise NotImplementedError()
+class LogicAndHandshakeStage(SimpleStage):
 
-    def elaborate(self, platform):
-        m = Module()
-        logic = self.logic_and_handshake(m, self.in_data, self.out_data)
-        if isinstance(logic, dict):
-            ...
-        elif isinstance(logic, AST):
-            ...
-        return m
+    """A SimpleStage whose logic is `logic(i, o)`.
 
-    # @classmethod
-    # def sync_expr(cls, m, sync_exprs):
-    #     """create a pipeline stage around one or more nMigen AST expressions"""
-    #     class Anonymous(cls):
-    #         def logic(self, m, i, o):
-    #             m.d.sync += sync_exprs
-    #     return Anonymous()
+       `i` is the input pipe end and `o` is the output pipe end, so
+       the logic sets `o.o_data` and any of `o.o_start`, `o.o_stop`
+       and `o.o_data_size`.  It may not set `o.o_valid`.
+    """
 
+    def _stage_logic(self, m, i, o):
+        _add_logic(m, self._logic(i, o))
 
-def LogicAndHandshakeStage(SimpleStage):
 
-    def __init__(self, logic):
-        super().__init__(None, None)
-        self._logic = logic
+class SimplePipeline(Elaboratable):
 
-    def logic_and_handshake(self, m, i, o):
-        frag = self._logic
-        if callable(frag):
-            frag = frag(m, i, o)
-        if isinstance(frag, (list, Assign)):
-            m.d.sync += frag
-        elif isinstance(frag, dict):
-            for domain, frags in frag:
-                m.d[domain] += frag
-        else:
-            raise TypeError('unknown logic_and_handshake {frag!r}')
+    @classmethod
+    def assemble(cls, *args):
+        """Build a pipeline from alternating PipeSpecs and stages.
+
+           The first and last arguments are PipeSpecs.  Each stage
+           gets the specs on either side of it.
+        """
+        assert len(args) % 2 == 1 and len(args) >= 3, (
+            'SimplePipeline: need spec, stage, spec[, stage, spec...]'
+        )
+        specs = args[::2]
+        stages = args[1::2]
+        assert all(isinstance(s, _PipeSpec) for s in specs), (
+            f'SimplePipeline: expected PipeSpecs, got {specs}'
+        )
+        assert all(isinstance(s, SimpleStage) for s in stages), (
+            f'SimplePipeline: expected SimpleStages, got {stages}'
+        )
+        for (in_spec, stage, out_spec) in zip(specs, stages, specs[1:]):
+            if stage.in_data is None:
+                stage.bind(in_spec, out_spec)
+            assert (stage.in_data._spec, stage.out_data._spec) == (
+                in_spec, out_spec
+            ), f'SimplePipeline: {stage} has the wrong PipeSpecs'
+        return cls(stages)
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.data_in = self.stages[0].in_data
+        self.data_out = self.stages[-1].out_data
+
+    def elaborate(self, platform):
+        m = Module()
+        for (i, stage) in enumerate(self.stages):
+            m.submodules[f'stage_{i}'] = stage
+        for (src, snk) in zip(self.stages, self.stages[1:]):
+            m.d.comb += src.out_data.flow_to(snk.in_data)
+        return m
 
 
 if __name__ == '__main__':
-    spec = PipeSpec(1)  # one bit of data
-    # design = SimpleStage.sync_expr(o.eq(~i))
+
+    def add_one(m, i, o):
+        m.d.sync += o.eq(i + 1)
+
+    design = SimplePipeline.assemble(
+        PipeSpec(8, flags=START_STOP),
+        SimpleStage(add_one),
+        PipeSpec(9, flags=START_STOP),
+        LogicStage(lambda i, o: o.eq(i * 3)),
+        PipeSpec(11, flags=START_STOP),
+        LogicAndHandshakeStage(
+            lambda i, o: {
+                'sync': [
+                    o.o_data.flag.eq(i.i_data[0]),
+                    o.o_data.word.eq(i.i_data[1:]),
+                    o.o_start.eq(i.i_stop),         # swap start and stop
+                    o.o_stop.eq(i.i_start),
+                ],
+            }
+        ),
+        PipeSpec((('flag', 1), ('word', unsigned(10))), flags=START_STOP),
+    )
+    design.data_in.leave_unconnected()
+    design.data_out.leave_unconnected()
+
+    # Workaround nMigen issue #280
+    m = Module()
+    m.submodules.design = design
+    i_valid = Signal()
+    i_data = Signal(8)
+    i_start = Signal()
+    i_stop = Signal()
+    i_ready = Signal()
+    m.d.comb += [
+        design.data_in.i_valid.eq(i_valid),
+        design.data_in.i_data.eq(i_data),
+        design.data_in.i_start.eq(i_start),
+        design.data_in.i_stop.eq(i_stop),
+        design.data_out.i_ready.eq(i_ready),
+    ]
+
+    N = 200
+    words = [(i * 37 & 0xFF, i % 5 == 0, i % 5 == 4) for i in range(N)]
+    expected = [
+        ((d + 1) * 3 & 1, (d + 1) * 3 >> 1, stop, start)
+        for (d, start, stop) in words
+    ]
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+
+        @sim.sync_process
+        def writer():
+            for (i, (data, start, stop)) in enumerate(words):
+                yield i_data.eq(data)
+                yield i_start.eq(start)
+                yield i_stop.eq(stop)
+                # Hold off now and then after the first hundred.
+                yield i_valid.eq(i < 100 or i % 4 != 1)
+                yield Settle()
+                while not (yield design.data_in.received()):
+                    yield
+                    yield i_valid.eq(True)
+                    yield Settle()
+                yield
+            yield i_valid.eq(False)
+
+        @sim.sync_process
+        def reader():
+            n = 0
+            while expected:
+                # Stall for the first ten clocks: the three stages fill.
+                # Then full speed, then random stalls.
+                ready = 10 <= n < 100 or n > 100 and n % 3 != 0
+                yield i_ready.eq(ready)
+                yield Settle()
+                if n == 9:
+                    assert (yield design.data_in.o_ready) == 0
+                if (yield design.data_out.sent()):
+                    do = design.data_out
+                    actual = (
+                        (yield do.o_data.flag),
+                        (yield do.o_data.word),
+                        bool((yield do.o_start)),
+                        bool((yield do.o_stop)),
+                    )
+                    exp = expected.pop(0)
+                    assert actual == exp, f'expected {exp}, got {actual}'
+                if n == 99:
+                    # Three words went in during the stall, then one per
+                    # clock after.
+                    assert len(expected) == N - 90, (
+                        f'{N - len(expected)} words by clock {n}'
+                    )
+                yield
+                n += 1
+                assert n < 10_000, f'missing words {expected}'
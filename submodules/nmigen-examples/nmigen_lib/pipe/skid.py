@@ -0,0 +1,137 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Elaboratable, Module, Mux, Signal
+from nmigen.back.pysim import Settle
+
+from nmigen_lib.util import Main
+
+from nmigen_lib.pipe.desc import StageTiming
+from nmigen_lib.pipe.fifo import _payload
+from nmigen_lib.pipe.spec import PipeSpec, START_STOP
+
+
+class SkidBuffer(Elaboratable):
+
+    """Register slice for a pipe.
+
+       `skid_in` and `skid_out` have the same PipeSpec, so the buffer
+       can go between any two stages.  All its outputs come straight
+       from flip-flops: `skid_out`'s valid and data, and `skid_in`'s
+       ready.  So no combinatorial path passes through it, in either
+       direction.
+
+       Ready is one clock late, so when the output stalls, one more
+       word may arrive.  It waits in the skid register.  The buffer
+       passes one word per clock, with one clock of latency.
+    """
+
+    pipe_timing = StageTiming(interval=1, latency=1)
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.skid_in = spec.outlet()
+        self.skid_out = spec.inlet()
+
+    def elaborate(self, platform):
+        skid_in = self.skid_in
+        skid_out = self.skid_out
+        in_data = _payload(skid_in, self.spec)
+        out_data = _payload(skid_out, self.spec)
+
+        m = Module()
+
+        skid_valid = Signal()
+        skid_data = Signal.like(in_data)
+        m.d.comb += skid_in.o_ready.eq(~skid_valid)
+
+        with m.If(~skid_out.o_valid | skid_out.i_ready):
+            m.d.sync += [
+                out_data.eq(Mux(skid_valid, skid_data, in_data)),
+                skid_out.o_valid.eq(skid_valid | skid_in.i_valid),
+                skid_valid.eq(False),
+            ]
+        with m.Elif(skid_in.received()):
+            m.d.sync += [
+                skid_data.eq(in_data),
+                skid_valid.eq(True),
+            ]
+
+        return m
+
+
+if __name__ == '__main__':
+    spec = PipeSpec(8, flags=START_STOP)
+    design = SkidBuffer(spec)
+    design.skid_in.leave_unconnected()
+    design.skid_out.leave_unconnected()
+
+    # Workaround nMigen issue #280
+    m = Module()
+    m.submodules.design = design
+    i_valid = Signal()
+    i_data = Signal(8)
+    i_start = Signal()
+    i_stop = Signal()
+    i_ready = Signal()
+    m.d.comb += [
+        design.skid_in.i_valid.eq(i_valid),
+        design.skid_in.i_data.eq(i_data),
+        design.skid_in.i_start.eq(i_start),
+        design.skid_in.i_stop.eq(i_stop),
+        design.skid_out.i_ready.eq(i_ready),
+    ]
+
+    N = 200
+    words = [(i * 37 & 0xFF, i % 5 == 0, i % 5 == 4) for i in range(N)]
+    expected = list(words)
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+
+        @sim.sync_process
+        def writer():
+            for (i, (data, start, stop)) in enumerate(words):
+                yield i_data.eq(data)
+                yield i_start.eq(start)
+                yield i_stop.eq(stop)
+                # Hold off now and then after the first hundred.
+                yield i_valid.eq(i < 100 or i % 7 != 3)
+                yield Settle()
+                while not (yield design.skid_in.received()):
+                    yield
+                    yield i_valid.eq(True)
+                    yield Settle()
+                yield
+            yield i_valid.eq(False)
+
+        @sim.sync_process
+        def reader():
+            n = 0
+            while expected:
+                # Full speed for the first hundred, then stall.
+                ready = n < 100 or n % 3 != 0 or n % 11 == 0
+                yield i_ready.eq(ready)
+                yield Settle()
+                # Ready in must not depend on ready out.
+                r0 = yield design.skid_in.o_ready
+                yield i_ready.eq(not ready)
+                yield Settle()
+                assert (yield design.skid_in.o_ready) == r0, (
+                    f'clock {n}: ready is combinatorial'
+                )
+                yield i_ready.eq(ready)
+                yield Settle()
+                if (yield design.skid_out.sent()):
+                    actual = (
+                        (yield design.skid_out.o_data),
+                        bool((yield design.skid_out.o_start)),
+                        bool((yield design.skid_out.o_stop)),
+                    )
+                    exp = expected.pop(0)
+                    assert actual == exp, f'expected {exp}, got {actual}'
+                    if len(expected) == N - 100:
+                        # One clock of latency, no bubbles.
+                        assert n == 100, f'100 words took {n} clocks'
+                yield
+                n += 1
+                assert n < 10_000, f'missing words {expected}'
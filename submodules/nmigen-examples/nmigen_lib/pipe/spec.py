@@ -1,3 +1,4 @@
+from functools import cached_property
 from typing import NamedTuple, Union
 
 from nmigen import Elaboratable, Module, Record, Shape, Signal, Value
@@ -12,12 +13,37 @@ from .endpoint import PipeInlet, PipeOutlet
 
 DATA_SIZE = 1 << 8
 START_STOP = 1 << 9
+CREDIT = 1 << 10
 
 
-class PipeSpec(NamedTuple):
+def _shape_key(dsol):
+    if isinstance(dsol, Layout):
+        return tuple(
+            (name, _shape_key(shape), dir)
+            for (name, shape, dir) in dsol
+        )
+    return (dsol.width, dsol.signed)
+
+
+class _PipeSpecFields(NamedTuple):
     flags: int
     dsol: Union[Shape, Layout]
 
+
+class PipeSpec(_PipeSpecFields):
+
+    # A PipeSpec is a tuple, but this subclass has a `__dict__`, so
+    # the derived properties below are computed once and cached.
+    # Specs are immutable, so the caches never go stale.
+
+    def __hash__(self):
+        return hash(self._key)
+
+    @cached_property
+    def _key(self):
+        # Layouts are not hashable.
+        return (self.flags, _shape_key(self.dsol))
+
     @classmethod
     def new(cls, dswol, *, flags=0):
         """
@@ -27,7 +53,9 @@ class PipeSpec(NamedTuple):
         of the data signal, a `Layout` describing the data signal, or
         a tuple of tuples that nMigen can coerce into a `Layout`.
 
-        The flags arg may include DATA_SIZE or START_STOP flags.
+        The flags arg may include DATA_SIZE, START_STOP or CREDIT flags.
+        A CREDIT pipe has no ready signal.  Instead, the receiver
+        pulses credit to return one buffer slot to the sender.
         """
         # dsol: data shape or layout
         # dwsol: data width, shape, or layout
@@ -43,7 +71,7 @@ class PipeSpec(NamedTuple):
         Create a PipeSpec from a 32 bit integer for SpokeFPGA compatibility.
         """
         data_width = n & 0xFF
-        flags = n & 0x300
+        flags = n & 0x700
         if n != data_width | flags:
             raise ValueError(f'invalid PipeSpec {n:\#x}')
         return cls.new(data_width, flags=flags)
@@ -53,7 +81,7 @@ class PipeSpec(NamedTuple):
         """Convert a PipeSpec to a SpokeFPGA-compatible 32 bit integer."""
         return self.data_width | self.flags
 
-    @property
+    @cached_property
     def data_width(self):
         return Record((('d', self.dsol), )).shape()[0]
 
@@ -65,29 +93,35 @@ class PipeSpec(NamedTuple):
     def start_stop(self):
         return bool(self.flags & START_STOP)
 
+    @property
+    def credit(self):
+        return bool(self.flags & CREDIT)
+
     def inlet(self, **kwargs):
-        return PipeInlet(
-            self,
-            Layout(
-                (PipeInlet.prefices[dir] + name, shape)
-                for (name, shape, dir) in self._signals()
-            ),
-            src_loc_at=1,
-            **kwargs,
-        )
+        return PipeInlet(self, self._inlet_layout, src_loc_at=1, **kwargs)
 
     def outlet(self, **kwargs):
-        return PipeOutlet(
-            self,
-            Layout(
-                (PipeOutlet.prefices[dir] + name, shape)
-                for (name, shape, dir) in self._signals()
-            ),
-            src_loc_at=1,
-            **kwargs,
+        return PipeOutlet(self, self._outlet_layout, src_loc_at=1, **kwargs)
+
+    @cached_property
+    def _inlet_layout(self):
+        return Layout(
+            (PipeInlet.prefices[dir] + name, shape)
+            for (name, shape, dir) in self._signals()
+        )
+
+    @cached_property
+    def _outlet_layout(self):
+        return Layout(
+            (PipeOutlet.prefices[dir] + name, shape)
+            for (name, shape, dir) in self._signals()
         )
 
     def _signals(self):
+        return self._signal_descs
+
+    @cached_property
+    def _signal_descs(self):
         # N.B., these need to be in the same order as SpokeFPGA uses.
         sigs = (
             SignalDesc('data', self.dsol),
@@ -104,29 +138,36 @@ class PipeSpec(NamedTuple):
             )
         sigs += (
             SignalDesc('valid', 1),
-            SignalDesc('ready', 1, SignalDirection.UPSTREAM),
         )
+        if self.flags & CREDIT:
+            sigs += (
+                SignalDesc('credit', 1, SignalDirection.UPSTREAM),
+            )
+        else:
+            sigs += (
+                SignalDesc('ready', 1, SignalDirection.UPSTREAM),
+            )
         return sigs
 
-    @property
+    @cached_property
     def payload_signals(self):
         def is_payload(name, shape, dir):
-            return name not in {'ready', 'valid'}
+            return name not in {'ready', 'valid', 'credit'}
         return self._filter_signals(is_payload)
 
-    @property
+    @cached_property
     def handshake_signals(self):
         def is_handshake(name, shape, dir):
-            return name in {'ready', 'valid'}
+            return name in {'ready', 'valid', 'credit'}
         return self._filter_signals(is_handshake)
 
-    @property
+    @cached_property
     def upstream_signals(self):
         def is_upstream(name, shape, dir):
             return dir == SignalDirection.UPSTREAM
         return self._filter_signals(is_upstream)
 
-    @property
+    @cached_property
     def downstream_signals(self):
         def is_downstream(name, shape, dir):
             return dir == SignalDirection.DOWNSTREAM
@@ -0,0 +1,184 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Elaboratable, Module, Shape, Signal
+from nmigen.back.pysim import Settle
+from nmigen.lib.fifo import SyncFIFO, SyncFIFOBuffered
+
+from nmigen_lib.util import Main
+
+from nmigen_lib.pipe.desc import StageTiming
+from nmigen_lib.pipe.fifo import _payload
+from nmigen_lib.pipe.spec import PipeSpec, START_STOP
+
+
+# FIFOs with more bits than this go in block RAM.
+BRAM_THRESHOLD = 256
+
+
+class PipeFIFO(Elaboratable):
+
+    """Buffer a pipe.
+
+       `fifo_in` and `fifo_out` have the same PipeSpec, so the FIFO
+       can be dropped into a Pipeline anywhere.  It holds up to
+       `depth` words and passes one word per clock.
+
+       When the FIFO has more than `bram_threshold` bits, it uses
+       nMigen's SyncFIFOBuffered, which fits in SB_RAM40_4K block
+       RAM.  A word takes two clocks to get through.  Smaller FIFOs
+       are SyncFIFOs in registers, and a word takes one clock.
+
+         `level`        words in the FIFO now.
+         `almost_full`  at least `almost_full_level` words are in
+                        the FIFO.  The default is `depth - 2`.
+    """
+
+    def __init__(self,
+                 spec,
+                 depth=8,
+                 almost_full_level=None,
+                 bram_threshold=BRAM_THRESHOLD):
+        if almost_full_level is None:
+            almost_full_level = max(1, depth - 2)
+        assert depth >= 2, f'PipeFIFO: depth = {depth} < 2'
+        assert 1 <= almost_full_level <= depth, (
+            f'PipeFIFO: almost_full_level = {almost_full_level} '
+            f'out of range 1..{depth}'
+        )
+        self.spec = spec
+        self.depth = depth
+        self.almost_full_level = almost_full_level
+        self.bram_threshold = bram_threshold
+        self.fifo_in = spec.outlet()
+        self.fifo_out = spec.inlet()
+        self.level = Signal(range(depth + 1))
+        self.almost_full = Signal()
+
+    @property
+    def uses_bram(self):
+        width = self.spec.data_width + sum(
+            Shape.cast(desc.shape).width
+            for desc in self.spec.payload_signals
+            if desc.name != 'data'
+        )
+        return width * self.depth > self.bram_threshold
+
+    @property
+    def pipe_timing(self):
+        return StageTiming(interval=1, latency=2 if self.uses_bram else 1)
+
+    def elaborate(self, platform):
+        fifo_in = self.fifo_in
+        fifo_out = self.fifo_out
+        w_data = _payload(fifo_in, self.spec)
+        r_data = _payload(fifo_out, self.spec)
+
+        m = Module()
+        if self.uses_bram:
+            fifo = SyncFIFOBuffered(width=len(w_data), depth=self.depth)
+        else:
+            fifo = SyncFIFO(width=len(w_data), depth=self.depth)
+        m.submodules.fifo = fifo
+        m.d.comb += [
+            fifo.w_data.eq(w_data),
+            fifo.w_en.eq(fifo_in.i_valid),
+            fifo_in.o_ready.eq(fifo.w_rdy),
+
+            r_data.eq(fifo.r_data),
+            fifo_out.o_valid.eq(fifo.r_rdy),
+            fifo.r_en.eq(fifo_out.i_ready),
+
+            self.level.eq(fifo.level),
+            self.almost_full.eq(fifo.level >= self.almost_full_level),
+        ]
+        return m
+
+
+if __name__ == '__main__':
+    spec = PipeSpec(8, flags=START_STOP)
+    # 10 bits * 16 words goes in registers, * 32 words in BRAM.
+    designs = [PipeFIFO(spec, depth=16), PipeFIFO(spec, depth=32)]
+    assert [d.uses_bram for d in designs] == [False, True]
+
+    # Workaround nMigen issue #280
+    m = Module()
+    i_valid = Signal()
+    i_data = Signal(8)
+    i_start = Signal()
+    i_stop = Signal()
+    i_ready = Signal()
+    all_ready = Signal()
+    m.d.comb += all_ready.eq(designs[0].fifo_in.o_ready
+                             & designs[1].fifo_in.o_ready)
+    for (i, design) in enumerate(designs):
+        m.submodules[f'fifo_{i}'] = design
+        design.fifo_in.leave_unconnected()
+        design.fifo_out.leave_unconnected()
+        m.d.comb += [
+            design.fifo_in.i_valid.eq(i_valid & all_ready),
+            design.fifo_in.i_data.eq(i_data),
+            design.fifo_in.i_start.eq(i_start),
+            design.fifo_in.i_stop.eq(i_stop),
+            design.fifo_out.i_ready.eq(i_ready),
+        ]
+
+    N = 300
+    words = [(i * 37 & 0xFF, i % 5 == 0, i % 5 == 4) for i in range(N)]
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+
+        @sim.sync_process
+        def writer():
+            for (data, start, stop) in words:
+                yield i_data.eq(data)
+                yield i_start.eq(start)
+                yield i_stop.eq(stop)
+                yield i_valid.eq(True)
+                yield Settle()
+                while not (yield designs[0].fifo_in.received()):
+                    yield
+                    yield Settle()
+                yield
+            yield i_valid.eq(False)
+
+        @sim.sync_process
+        def reader():
+            expected = [list(words) for d in designs]
+            levels = [0 for d in designs]
+            n = 0
+            while any(expected):
+                # Full speed first, then a long stall to fill the FIFOs,
+                # then full speed again.
+                yield i_ready.eq(not 50 < n < 90)
+                yield Settle()
+                for (design, exp, level) in zip(designs, expected, levels):
+                    fi, fo = design.fifo_in, design.fifo_out
+                    assert (yield design.level) == level, (
+                        f'clock {n}: level {(yield design.level)} != {level}'
+                    )
+                    af = level >= design.almost_full_level
+                    assert (yield design.almost_full) == af
+                    if (yield fo.sent()):
+                        actual = (
+                            (yield fo.o_data),
+                            bool((yield fo.o_start)),
+                            bool((yield fo.o_stop)),
+                        )
+                        e = exp.pop(0)
+                        assert actual == e, f'expected {e}, got {actual}'
+                        level -= 1
+                    if (yield fi.received()):
+                        level += 1
+                    levels[designs.index(design)] = level
+                if n == 50:
+                    # One word per clock, after the first word's latency.
+                    for (design, exp) in zip(designs, expected):
+                        lat = 2 if design.uses_bram else 1
+                        assert len(exp) == N - (n - lat + 1), (
+                            f'{design.depth} deep: {N - len(exp)} words'
+                        )
+                yield
+                n += 1
+                assert n < 10_000, f'missing words {expected}'
+            assert levels == [0, 0]
@@ -1,7 +1,7 @@
 from nmigen import Elaboratable, Module, Signal
 from nmigen.back.pysim import Passive
 
-from nmigen_lib.uart import UARTTx, UARTRx
+from nmigen_lib.uart import OversamplingUARTRx, UARTTx, UARTRx
 from . import *
 from nmigen_lib.util import Main, delay
 
@@ -90,6 +90,75 @@ class P_UARTRx(Elaboratable):
         return m
 
 
+def uart_rx_flagged_spec(data_bits=8):
+    return PipeSpec((
+        ('data', data_bits),
+        ('frame_err', 1),
+        ('overrun', 1),
+    ))
+
+
+class P_OversamplingUARTRx(Elaboratable):
+
+    """Pipe interface to OversamplingUARTRx.
+
+       By default, bytes with errors are dropped, and errors are
+       only reported on `rx_err` and `rx_ovf`.  With `error_flags`,
+       the pipe carries `uart_rx_flagged_spec` records: a byte with
+       a bad stop bit is passed on with `frame_err` set, and the
+       first byte after one or more lost bytes has `overrun` set.
+    """
+
+    def __init__(self, clk_freq, baud, data_bits=8, inlet=None,
+                 error_flags=False):
+        if inlet is None:
+            if error_flags:
+                inlet = uart_rx_flagged_spec(data_bits).inlet()
+            else:
+                inlet = PipeSpec(data_bits).inlet()
+        self.clk_freq = clk_freq
+        self.baud = baud
+        self.data_bits = data_bits
+        self.error_flags = error_flags
+
+        self.rx_pin = Signal(reset=1)
+        self.rx_out = inlet
+        self.rx_err = Signal()
+        self.rx_ovf = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+        rx = OversamplingUARTRx(self.clk_freq, self.baud, self.data_bits)
+        m.submodules.rx = rx
+        m.d.comb += [
+            rx.rx_pin.eq(self.rx_pin),
+            rx.rx_hold.eq(self.rx_out.full()),
+            self.rx_err.eq(rx.rx_err),
+            self.rx_ovf.eq(rx.rx_ovf),
+        ]
+        with m.If(self.rx_out.sent()):
+            m.d.sync += self.rx_out.o_valid.eq(False)
+        if self.error_flags:
+            lost = Signal()
+            with m.If(rx.rx_ovf):
+                m.d.sync += lost.eq(True)
+            with m.Elif(rx.rx_rdy | rx.rx_err):
+                m.d.sync += [
+                    self.rx_out.o_valid.eq(True),
+                    self.rx_out.o_data.data.eq(rx.rx_data),
+                    self.rx_out.o_data.frame_err.eq(rx.rx_err),
+                    self.rx_out.o_data.overrun.eq(lost),
+                    lost.eq(False),
+                ]
+        else:
+            with m.If(rx.rx_rdy):
+                m.d.sync += [
+                    self.rx_out.o_valid.eq(True),
+                    self.rx_out.o_data.eq(rx.rx_data),
+                ]
+        return m
+
+
 if __name__ == '__main__':
     divisor = 8
     design = P_UART(divisor=divisor)
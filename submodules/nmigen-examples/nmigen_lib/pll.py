@@ -26,12 +26,17 @@ class PLL(Elaboratable):
     for other uses.  So you might as well have the PLL generate the
     default 'sync' clock domain.
 
+    If you do need the reference clock, pass `ref_domain_name`.  Then
+    the PLL is an SB_PLL40_2_PAD, which passes the reference clock
+    through to a second clock domain, `ref_domain`.
+
     This module also has a reset synchronizer -- the domain's reset line
     is not released until a few clocks after the PLL lock signal is
     good.
     """
 
-    def __init__(self, freq_in_mhz, freq_out_mhz, domain_name='sync'):
+    def __init__(self, freq_in_mhz, freq_out_mhz, domain_name='sync',
+                 ref_domain_name=None):
         self.freq_in = freq_in_mhz
         self.freq_out = freq_out_mhz
         self.coeff = self._calc_freq_coefficients()
@@ -43,6 +48,14 @@ class PLL(Elaboratable):
             self.domain.clk,
             self.domain.rst,
         ]
+        self.ref_domain_name = ref_domain_name
+        self.ref_domain = None
+        if ref_domain_name is not None:
+            self.ref_domain = ClockDomain(ref_domain_name)
+            self.ports += [
+                self.ref_domain.clk,
+                self.ref_domain.rst,
+            ]
 
     def _calc_freq_coefficients(self):
         # cribbed from Icestorm's icepll.
@@ -74,7 +87,7 @@ class PLL(Elaboratable):
         # coeff = self._calc_freq_coefficients()
 
         pll_lock = Signal()
-        pll = Instance("SB_PLL40_PAD",
+        params = dict(
             p_FEEDBACK_PATH='SIMPLE',
             p_DIVR=self.coeff.divr,
             p_DIVF=self.coeff.divf,
@@ -85,12 +98,27 @@ class PLL(Elaboratable):
             i_RESETB=Const(1),
             i_BYPASS=Const(0),
 
-            o_PLLOUTGLOBAL=ClockSignal(self.domain_name),
-            o_LOCK=pll_lock)
+            o_LOCK=pll_lock,
+        )
+        if self.ref_domain is None:
+            pll = Instance("SB_PLL40_PAD",
+                o_PLLOUTGLOBAL=ClockSignal(self.domain_name),
+                **params)
+        else:
+            pll = Instance("SB_PLL40_2_PAD",
+                p_PLLOUT_SELECT_PORTB='GENCLK',
+                o_PLLOUTGLOBALA=ClockSignal(self.ref_domain_name),
+                o_PLLOUTGLOBALB=ClockSignal(self.domain_name),
+                **params)
         rs = ResetSynchronizer(~pll_lock, domain=self.domain_name)
 
         m = Module()
         m.submodules += [pll, rs]
+        if self.ref_domain is not None:
+            m.submodules.ref_rs = ResetSynchronizer(
+                ~pll_lock,
+                domain=self.ref_domain_name,
+            )
         return m
 
 
@@ -253,6 +253,132 @@ class UARTRx(Elaboratable):
         return m
 
 
+class OversamplingUARTRx(Elaboratable):
+
+    def __init__(self, clk_freq, baud, data_bits=8, oversample=16,
+                 acc_bits=24):
+        """Assume no parity, 1 stop bit.
+
+           The sample clock comes from a phase accumulator, so `baud`
+           need not divide `clk_freq`.  Each bit is sampled
+           `oversample` times, and the middle three samples vote.
+
+           `rx_err` flags a framing error (bad stop bit), and
+           `rx_ovf` flags a byte that arrived while `rx_hold` was
+           set.  `rx_rdy` is only set for a good byte.  `rx_data` is
+           loaded in all three cases.
+        """
+        inc = round(oversample * baud / clk_freq * 2**acc_bits)
+        assert 0 < inc < 2**acc_bits, (
+            f'OversamplingUARTRx: clk_freq = {clk_freq:,} is too slow '
+            f'for {oversample}X oversampling at {baud:,} baud'
+        )
+        assert oversample >= 4
+        self.clk_freq = clk_freq
+        self.baud = baud
+        self.data_bits = data_bits
+        self.oversample = oversample
+        self.acc_bits = acc_bits
+        self.inc = inc
+        actual_baud = inc * clk_freq / oversample / 2**acc_bits
+        self.baud_error = actual_baud / baud - 1
+
+        self.rx_pin = Signal(reset=1)
+        self.rx_hold = Signal()
+        self.rx_rdy = Signal()
+        self.rx_err = Signal()
+        self.rx_ovf = Signal()
+        self.rx_data = Signal(data_bits)
+        self.ports = (self.rx_pin,
+                      self.rx_hold,
+                      self.rx_rdy,
+                      self.rx_err,
+                      self.rx_ovf,
+                      self.rx_data,
+                     )
+
+    def elaborate(self, platform):
+        acc = Signal(self.acc_bits + 1)
+        tick = Signal()
+        mid = self.oversample // 2
+        phase = Signal(range(self.oversample))
+        votes = Signal(2)
+        bit = Signal()
+        rx_data = Signal(self.data_bits)
+        rx_bits = Signal(range(-1, self.data_bits - 1))
+        rx_pin = Signal(reset=1)
+        rx_pin1 = Signal(reset=1)
+
+        m = Module()
+        m.d.sync += [
+            rx_pin.eq(rx_pin1),
+            rx_pin1.eq(self.rx_pin),
+            acc.eq(acc[:-1] + self.inc),
+            self.rx_rdy.eq(False),
+            self.rx_err.eq(False),
+            self.rx_ovf.eq(False),
+        ]
+        m.d.comb += [
+            tick.eq(acc[-1]),
+            # Majority of the two earlier votes and the current sample.
+            bit.eq((votes[0] & votes[1]) | ((votes[0] | votes[1]) & rx_pin)),
+        ]
+
+        # `phase` counts ticks within a bit.  Samples at `mid - 1`
+        # and `mid` are saved; the sample at `mid + 1` decides.
+        with m.If(tick):
+            m.d.sync += phase.eq(
+                Mux(phase == self.oversample - 1, 0, phase + 1)
+            )
+            with m.If(phase == mid - 1):
+                m.d.sync += votes[0].eq(rx_pin)
+            with m.If(phase == mid):
+                m.d.sync += votes[1].eq(rx_pin)
+
+        with m.FSM():
+            with m.State('IDLE'):
+                with m.If(tick & ~rx_pin):
+                    m.d.sync += phase.eq(1)
+                    m.next = 'START'
+
+            with m.State('START'):
+                with m.If(tick & (phase == mid + 1)):
+                    with m.If(bit):
+                        m.next = 'IDLE'     # glitch, not a start bit
+                    with m.Else():
+                        m.d.sync += rx_bits.eq(self.data_bits - 2)
+                        m.next = 'DATA'
+
+            with m.State('DATA'):
+                with m.If(tick & (phase == mid + 1)):
+                    m.d.sync += rx_data.eq(Cat(rx_data[1:], bit))
+                    with m.If(rx_bits[-1]):
+                        m.next = 'STOP'
+                    with m.Else():
+                        m.d.sync += rx_bits.eq(rx_bits - 1)
+
+            with m.State('STOP'):
+                # Finish in the middle of the stop bit so the next
+                # start bit is seen as early as possible.
+                with m.If(tick & (phase == mid + 1)):
+                    m.d.sync += [
+                        self.rx_data.eq(rx_data),
+                        self.rx_rdy.eq(bit & ~self.rx_hold),
+                        self.rx_err.eq(~bit),
+                        self.rx_ovf.eq(self.rx_hold),
+                    ]
+                    with m.If(bit):
+                        m.next = 'IDLE'
+                    with m.Else():
+                        m.next = 'BREAK'
+
+            with m.State('BREAK'):
+                # Wait for the line to go idle.
+                with m.If(tick & rx_pin):
+                    m.next = 'IDLE'
+        return m
+
+
 if __name__ == '__main__':
     divisor = 20
     design = UART(divisor=divisor)
@@ -265,6 +391,15 @@ if __name__ == '__main__':
     m.d.comb += design.tx_data.eq(tx_data)
     m.d.comb += design.tx_trg.eq(tx_trg)
 
+    # The oversampling receiver gets a baud rate that does not divide
+    # the 1 MHz sim clock.
+    os_clk_freq = 1_000_000
+    os_baud = 57_600
+    os_rx = OversamplingUARTRx(clk_freq=os_clk_freq, baud=os_baud)
+    m.submodules.os_rx = os_rx
+    os_hold = Signal()
+    m.d.comb += os_rx.rx_hold.eq(os_hold)
+
     #280 with Main(design).sim as sim:
     with Main(m).sim as sim:
 
@@ -299,3 +434,46 @@ if __name__ == '__main__':
                 yield design.rx_pin.eq(1)
                 yield from delay(divisor)
                 yield from delay(2)
+
+        @sim.sync_process
+        def os_send_chars():
+            clocks_per_bit = os_clk_freq / os_baud
+            t = 0
+            def wait_bits(n):
+                nonlocal t
+                start = round(t)
+                t += n * clocks_per_bit
+                yield from delay(round(t) - start)
+            # (byte, stop bit, hold)
+            chars = [(0x95, 1, 0), (0x00, 1, 0), (0xFF, 1, 0),
+                     (0x3C, 0, 0), (0xA5, 1, 1), (0x5A, 1, 0)]
+            yield os_rx.rx_pin.eq(1)
+            yield from wait_bits(1)
+            for (char, stop, hold) in chars:
+                yield os_hold.eq(hold)
+                yield os_rx.rx_pin.eq(0)
+                yield from wait_bits(1)
+                for i in range(8):
+                    yield os_rx.rx_pin.eq(char >> i & 1)
+                    yield from wait_bits(1)
+                yield os_rx.rx_pin.eq(stop)
+                yield from wait_bits(1)
+                yield os_rx.rx_pin.eq(1)
+                yield from wait_bits(0.5 if stop else 2)
+
+        @sim.sync_process
+        def os_recv_chars():
+            expected = [('rdy', 0x95), ('rdy', 0x00), ('rdy', 0xFF),
+                        ('err', 0x3C), ('ovf', 0xA5), ('rdy', 0x5A)]
+            while expected:
+                yield
+                rdy = yield os_rx.rx_rdy
+                err = yield os_rx.rx_err
+                ovf = yield os_rx.rx_ovf
+                if rdy or err or ovf:
+                    kind = 'ovf' if ovf else 'err' if err else 'rdy'
+                    actual = (kind, (yield os_rx.rx_data))
+                    assert actual == expected[0], (
+                        f'expected {expected[0]}, got {actual}'
+                    )
+                    expected.pop(0)
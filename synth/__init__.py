@@ -8,27 +8,59 @@ if sys.argv[:1] == ['-m']:
 else:
     from .config    import SynthConfig
     from .decimator import Decimator
+    from .envelope  import EnvelopeBank, envelope_gate_spec
     from .gate      import Gate
-    from .i2s       import I2S, P_I2STx, I2STx, I2SRx, stereo_sample_spec
+    from .i2s       import I2S, P_I2SRx, P_I2STx, I2STx, I2SRx
+    from .i2s       import stereo_sample_spec
+    from .interpolator import Interpolator
+    from .mac       import SharedMultiplier, mac_request_spec
+    from .mac       import mac_result_spec
     from .midi      import MIDIDecoder
+    from .mixer     import Mixer, mix_control_spec, voice_sample_spec
     from .osc       import Oscillator, mono_sample_spec
     from .pair      import ChannelPair
     from .priority  import MonoPriority
+    from .svf       import SVFilter, svf_coeffs, svf_control_spec
+    from .sysex     import SysExDecoder, sysex_data_spec
+    from .tdm       import TDMTx, tdm_sample_spec
     from .util      import MIDI_note_to_freq
+    from .vca       import GateToLevel, VCA, voice_level_spec
+    from .wavefold  import Wavefolder
 
     __all__ = [
                'ChannelPair',
                'Decimator',
+               'EnvelopeBank',
                'Gate',
+               'GateToLevel',
                'I2S',
                'I2SRx',
                'I2STx',
+               'Interpolator',
                'MIDIDecoder',
                'MIDI_note_to_freq',
+               'Mixer',
                'MonoPriority',
                'Oscillator',
+               'P_I2SRx',
                'P_I2STx',
+               'SVFilter',
+               'SharedMultiplier',
                'SynthConfig',
+               'SysExDecoder',
+               'TDMTx',
+               'VCA',
+               'Wavefolder',
+               'envelope_gate_spec',
+               'mac_request_spec',
+               'mac_result_spec',
+               'mix_control_spec',
                'mono_sample_spec',
                'stereo_sample_spec',
+               'svf_coeffs',
+               'svf_control_spec',
+               'sysex_data_spec',
+               'tdm_sample_spec',
+               'voice_level_spec',
+               'voice_sample_spec',
     ]
@@ -21,6 +21,7 @@ class SynthConfig:
         while base_rate // 2 >= MIN_SAMPLE_RATE:
             base_rate //= 2
         self.clk_freq = clk_freq
+        self.base_rate = base_rate
         self.osc_rate = osc_oversample * base_rate
         self.osc_depth = osc_depth
         self.out_rate = out_oversample * base_rate
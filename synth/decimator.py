@@ -9,6 +9,7 @@ from nmigen import signed, unsigned
 from nmigen.asserts import Assert
 from nmigen.back.pysim import Passive
 
+from nmigen_lib.pipe import StageTiming
 from nmigen_lib.util import Main, delay
 
 from .config import SynthConfig
@@ -89,6 +90,14 @@ class Decimator(Elaboratable):
         self.samples_in = mono_sample_spec(cfg.osc_depth).outlet()
         self.samples_out = mono_sample_spec(cfg.osc_depth).inlet()
 
+        # One output per M + 2 clock convolution, then three pipeline
+        # stages to the output register.
+        self.pipe_timing = StageTiming(
+            interval=M + 2,
+            latency=M + 5,
+            ratio=self.R,
+        )
+
     def _make_kernel(self):
         # Make a windowed sinc filter kernel.
         M = self.M
@@ -0,0 +1,419 @@
+#!/usr/bin/env nmigen
+
+from math import ceil, exp, log2
+
+from nmigen import Cat, Const, Elaboratable, Memory, Module, Mux, Signal
+from nmigen import signed, unsigned
+from nmigen.back.pysim import Settle
+
+from nmigen_lib.pipe import PipeSpec
+from nmigen_lib.util import Main, delay
+
+from synth.mac import mac_request_spec, mac_result_spec
+from synth.vca import LEVEL_WIDTH, voice_level_spec
+
+
+def envelope_gate_spec(voices=1):
+    """Open or close one voice's gate."""
+    return PipeSpec((
+        ('voice', unsigned(max(1, (voices - 1).bit_length()))),
+        ('gate', unsigned(1)),
+    ))
+
+
+# Envelope stages.
+IDLE, ATTACK, DECAY, SUSTAIN, RELEASE = range(5)
+
+# Levels have 24 fraction bits.  FULL is 1.0.
+FRAC_BITS = 24
+FULL = 1 << FRAC_BITS
+
+# Each segment is an exponential approach to a target beyond its end,
+# so it gets there in finite time.  (See earlevel.com's ADSR.)
+ATTACK_OVERSHOOT = FULL // 4
+DECAY_OVERSHOOT = FULL // 16
+
+# Segment times are set by a 7 bit number, 1 msec to 10 sec.
+TIME_BITS = 7
+MIN_TIME = 0.001
+MAX_TIME = 10.0
+
+# The rate table holds each time's coefficient c = 1 - exp(-1 / (t * Fs))
+# as a 15 bit mantissa and a 5 bit exponent: c = mant * 2**-(15 + exp).
+MANT_BITS = 15
+EXP_BITS = 5
+DIFF_SHIFT = 10     # diff's LSBs are discarded before multiplying.
+
+
+def rate_table(update_rate):
+    table = []
+    for i in range(2**TIME_BITS):
+        t = MIN_TIME * (MAX_TIME / MIN_TIME)**(i / (2**TIME_BITS - 1))
+        c = 1 - exp(-1 / (t * update_rate))
+        e = max(0, ceil(-log2(c)) - 1)
+        mant = min(round(c * 2**(MANT_BITS + e)), 2**MANT_BITS - 1)
+        assert e < 2**EXP_BITS
+        table.append(e << MANT_BITS | mant)
+    return table
+
+
+def adsr_step(table, stage, level, gate, attack, decay, sustain, release):
+    """Bit-exact model of one envelope update.  Returns (stage, level)."""
+    if gate and stage in (IDLE, RELEASE):
+        stage = ATTACK
+    elif not gate and stage not in (IDLE, RELEASE):
+        stage = RELEASE
+    sustain_level = sustain << (FRAC_BITS - LEVEL_WIDTH)
+    (target, time) = {
+        IDLE: (0, 0),
+        ATTACK: (FULL + ATTACK_OVERSHOOT, attack),
+        DECAY: (sustain_level - DECAY_OVERSHOOT, decay),
+        SUSTAIN: (sustain_level, 0),
+        RELEASE: (-DECAY_OVERSHOOT, release),
+    }[stage]
+    entry = table[time]
+    mant = entry & (2**MANT_BITS - 1)
+    e = entry >> MANT_BITS
+    diff = (target - level) >> DIFF_SHIFT
+    level += diff * mant >> (MANT_BITS - DIFF_SHIFT + e)
+    if stage == IDLE:
+        level = 0
+    elif stage == ATTACK and level >= FULL:
+        (stage, level) = (DECAY, FULL)
+    elif stage == DECAY and level <= sustain_level:
+        (stage, level) = (SUSTAIN, sustain_level)
+    elif stage == SUSTAIN:
+        level = sustain_level
+    elif stage == RELEASE and level <= 0:
+        (stage, level) = (IDLE, 0)
+    return (stage, level)
+
+
+def level_out(level):
+    """The level sent to the VCA."""
+    return min(level >> (FRAC_BITS - LEVEL_WIDTH), 2**LEVEL_WIDTH - 1)
+
+
+class EnvelopeBank(Elaboratable):
+
+    """ADSR envelopes for `voices` voices.
+
+       Gates are opened and closed through `gate_outlet`.  Every
+       voice's envelope is updated `update_rate` times per second, and
+       each new level is sent out `level_inlet` to the VCA.
+
+       Each voice's stage and level are kept in RAM, and one datapath
+       updates the voices in turn, four clocks per voice.  More
+       voices cost RAM, not logic.
+
+       Each segment is exponential.  `attack`, `decay` and `release`
+       choose segment times from 1 msec to 10 sec on a log scale,
+       through a small rate table.  `sustain` is a level; 0xFFFF is
+       full scale.  They are shared by all voices.
+
+       With `multiplier`, a SharedMultiplier, the envelopes have no
+       multiplier of their own.  Each multiply is sent out `mul_out`
+       and its product comes back through `mul_in`; connect them to
+       one of the multiplier's users.  A voice then takes up to
+       `len(multiplier.schedule) + multiplier.latency` more clocks.
+    """
+
+    def __init__(self, clk_freq, update_rate, voices=1, multiplier=None):
+        self.clk_freq = clk_freq
+        self.update_rate = update_rate
+        self.voices = voices
+        self.period = int(clk_freq // update_rate)
+        self.shared = multiplier is not None
+        voice_clocks = 4
+        if self.shared:
+            voice_clocks += len(multiplier.schedule) + multiplier.latency
+        assert voice_clocks * voices + 2 <= self.period, (
+            f'EnvelopeBank: {voices} voices do not fit in '
+            f'{self.period} clocks'
+        )
+        self.rate_table = rate_table(update_rate)
+
+        self.gate_outlet = envelope_gate_spec(voices).outlet()
+        self.level_inlet = voice_level_spec(voices).inlet()
+        if self.shared:
+            self.mul_out = mac_request_spec().inlet()
+            self.mul_in = mac_result_spec().outlet()
+        self.attack = Signal(TIME_BITS, reset=10)
+        self.decay = Signal(TIME_BITS, reset=60)
+        self.sustain = Signal(LEVEL_WIDTH, reset=0xC000)
+        self.release = Signal(TIME_BITS, reset=70)
+
+    def elaborate(self, platform):
+        voices = self.voices
+        level_width = FRAC_BITS + 3         # signed, with headroom
+
+        m = Module()
+
+        # Per-voice state: stage and level.
+        state_RAM = Memory(width=3 + FRAC_BITS + 1, depth=voices)
+        m.submodules.sw_port = sw_port = state_RAM.write_port()
+        m.submodules.sr_port = sr_port = state_RAM.read_port()
+
+        # Per-voice gates, written as gate messages arrive.
+        gate_RAM = Memory(width=1, depth=voices)
+        m.submodules.gw_port = gw_port = gate_RAM.write_port()
+        m.submodules.gr_port = gr_port = gate_RAM.read_port()
+        m.d.comb += [
+            self.gate_outlet.o_ready.eq(True),
+            gw_port.addr.eq(self.gate_outlet.i_data.voice),
+            gw_port.data.eq(self.gate_outlet.i_data.gate),
+            gw_port.en.eq(self.gate_outlet.received()),
+        ]
+
+        rate_ROM = Memory(width=EXP_BITS + MANT_BITS,
+                          depth=len(self.rate_table),
+                          init=self.rate_table)
+        m.submodules.rate_port = rate_port = rate_ROM.read_port()
+
+        pending = Signal()                  # a pass over the voices is due
+        voice = Signal(range(voices))
+        stage = Signal(3)
+        level = Signal(signed(level_width))
+        target = Signal(signed(level_width))
+        sustain_level = Signal(signed(level_width))
+        prod = Signal(signed(16 + MANT_BITS))
+        shift = Signal(range(2**EXP_BITS + MANT_BITS - DIFF_SHIFT))
+        new_level = Signal(signed(level_width))
+        gate = Signal()
+        m.d.comb += [
+            sustain_level.eq(self.sustain << (FRAC_BITS - LEVEL_WIDTH)),
+            sw_port.addr.eq(voice),
+            sr_port.addr.eq(voice),
+            gr_port.addr.eq(voice),
+            gate.eq(gr_port.data),
+            new_level.eq(level + (prod >> shift)),
+        ]
+
+        with m.FSM():
+
+            with m.State('WAIT'):
+                with m.If(pending):
+                    m.d.sync += [
+                        pending.eq(False),
+                        voice.eq(0),
+                    ]
+                    m.next = 'READ'
+
+            with m.State('READ'):
+                # RAM addresses are `voice`.  Data is ready next clock.
+                m.next = 'DECIDE'
+
+            with m.State('DECIDE'):
+                old_stage = sr_port.data[:3]
+                new_stage = Signal(3)
+                m.d.comb += new_stage.eq(old_stage)
+                in_release = (old_stage == IDLE) | (old_stage == RELEASE)
+                with m.If(gate & in_release):
+                    m.d.comb += new_stage.eq(ATTACK)
+                with m.If(~gate & ~in_release):
+                    m.d.comb += new_stage.eq(RELEASE)
+                m.d.sync += [
+                    stage.eq(new_stage),
+                    level.eq(sr_port.data[3:]),
+                ]
+                with m.Switch(new_stage):
+                    with m.Case(ATTACK):
+                        m.d.comb += rate_port.addr.eq(self.attack)
+                        m.d.sync += target.eq(FULL + ATTACK_OVERSHOOT)
+                    with m.Case(DECAY):
+                        m.d.comb += rate_port.addr.eq(self.decay)
+                        m.d.sync += target.eq(
+                            sustain_level - DECAY_OVERSHOOT
+                        )
+                    with m.Case(RELEASE):
+                        m.d.comb += rate_port.addr.eq(self.release)
+                        m.d.sync += target.eq(-DECAY_OVERSHOOT)
+                    with m.Default():
+                        m.d.comb += rate_port.addr.eq(0)
+                        m.d.sync += target.eq(sustain_level)
+                m.next = 'MULTIPLY'
+
+            with m.State('MULTIPLY'):
+                diff = (target - level) >> DIFF_SHIFT
+                mant = Signal(signed(MANT_BITS + 1))
+                m.d.comb += mant.eq(rate_port.data[:MANT_BITS])
+                m.d.sync += shift.eq(
+                    rate_port.data[MANT_BITS:] + MANT_BITS - DIFF_SHIFT
+                )
+                if self.shared:
+                    m.d.sync += [
+                        self.mul_out.o_valid.eq(True),
+                        self.mul_out.o_data.a.eq(diff[:16].as_signed()),
+                        self.mul_out.o_data.b.eq(mant),
+                    ]
+                    m.next = 'PRODUCT'
+                else:
+                    m.d.sync += prod.eq(diff[:16].as_signed() * mant)
+                    m.next = 'WRITE'
+
+            if self.shared:
+                with m.State('PRODUCT'):
+                    m.d.comb += self.mul_in.o_ready.eq(True)
+                    with m.If(self.mul_in.received()):
+                        m.d.sync += prod.eq(self.mul_in.i_data)
+                        m.next = 'WRITE'
+
+            with m.State('WRITE'):
+                out_stage = Signal(3)
+                out_level = Signal(signed(level_width))
+                m.d.comb += [
+                    out_stage.eq(stage),
+                    out_level.eq(new_level),
+                ]
+                with m.Switch(stage):
+                    with m.Case(IDLE):
+                        m.d.comb += out_level.eq(0)
+                    with m.Case(ATTACK):
+                        with m.If(new_level >= FULL):
+                            m.d.comb += [
+                                out_stage.eq(DECAY),
+                                out_level.eq(FULL),
+                            ]
+                    with m.Case(DECAY):
+                        with m.If(new_level <= sustain_level):
+                            m.d.comb += [
+                                out_stage.eq(SUSTAIN),
+                                out_level.eq(sustain_level),
+                            ]
+                    with m.Case(SUSTAIN):
+                        m.d.comb += out_level.eq(sustain_level)
+                    with m.Case(RELEASE):
+                        with m.If(new_level <= 0):
+                            m.d.comb += [
+                                out_stage.eq(IDLE),
+                                out_level.eq(0),
+                            ]
+                m.d.comb += [
+                    sw_port.data.eq(Cat(out_stage, out_level)),
+                    sw_port.en.eq(~self.level_inlet.full()),
+                ]
+                with m.If(~self.level_inlet.full()):
+                    m.d.sync += [
+                        self.level_inlet.o_valid.eq(True),
+                        self.level_inlet.o_data.voice.eq(voice),
+                        self.level_inlet.o_data.level.eq(
+                            Mux(out_level >= FULL,
+                                2**LEVEL_WIDTH - 1,
+                                out_level[FRAC_BITS - LEVEL_WIDTH:])
+                        ),
+                        voice.eq(voice + 1),
+                    ]
+                    m.next = 'READ'
+                    with m.If(voice == voices - 1):
+                        m.next = 'WAIT'
+
+        with m.If(self.level_inlet.sent()):
+            m.d.sync += self.level_inlet.o_valid.eq(False)
+        if self.shared:
+            with m.If(self.mul_out.sent()):
+                m.d.sync += self.mul_out.o_valid.eq(False)
+
+        # Start a pass over all voices every sample period.
+        period_max = self.period - 2
+        period_cnt = Signal(range(-1, period_max + 1), reset=period_max)
+        with m.If(period_cnt[-1]):
+            m.d.sync += [
+                period_cnt.eq(period_max),
+                pending.eq(True),
+            ]
+        with m.Else():
+            m.d.sync += period_cnt.eq(period_cnt - 1)
+
+        return m
+
+
+if __name__ == '__main__':
+    from synth.mac import SharedMultiplier
+
+    voices = 4
+    params = {'attack': 0, 'decay': 5, 'sustain': 0x6000, 'release': 10}
+
+    # One bank has its own multiplier.  Two more share one.
+    mul = SharedMultiplier(1_000_000, 20_000, users=2)
+    banks = [EnvelopeBank(1_000_000, 20_000, voices=voices)] + [
+        EnvelopeBank(1_000_000, 20_000, voices=voices, multiplier=mul)
+        for _ in range(2)
+    ]
+
+    # Work around nMigen issue #280
+    m = Module()
+    m.submodules.mul = mul
+    gate_sigs = []
+    for (i, bank) in enumerate(banks):
+        m.submodules[f'bank_{i}'] = bank
+        bank.gate_outlet.leave_unconnected()
+        bank.level_inlet.leave_unconnected()
+        sigs = (
+            Signal(name=f'i_valid{i}'),
+            Signal(2, name=f'i_voice{i}'),
+            Signal(name=f'i_gate{i}'),
+        )
+        m.d.comb += [
+            bank.gate_outlet.i_valid.eq(sigs[0]),
+            bank.gate_outlet.i_data.voice.eq(sigs[1]),
+            bank.gate_outlet.i_data.gate.eq(sigs[2]),
+            bank.level_inlet.i_ready.eq(True),
+        ]
+        m.d.comb += [getattr(bank, k).eq(v) for (k, v) in params.items()]
+        if bank.shared:
+            u = i - 1
+            m.d.comb += mul.requests[u].flow_from(bank.mul_out)
+            m.d.comb += bank.mul_in.flow_from(mul.results[u])
+        gate_sigs.append(sigs)
+
+    # Gate events, keyed by pass number.  Voice 1 is released before
+    # it reaches sustain, and voice 2 is retriggered during release.
+    events = {
+        2: [(0, 1), (1, 1)],
+        30: [(2, 1)],
+        60: [(1, 0)],
+        200: [(0, 0), (2, 0)],
+        230: [(2, 1)],
+        300: [(2, 0)],
+        310: [(3, 1)],
+        311: [(3, 0)],
+    }
+    n_passes = 500
+
+    def tester(bank, sigs):
+        (i_valid, i_voice, i_gate) = sigs
+        def process():
+            gates = [0] * voices
+            state = [(IDLE, 0)] * voices
+            stages_seen = set()
+            for n in range(n_passes):
+                for (voice, gate) in events.get(n, []):
+                    yield i_voice.eq(voice)
+                    yield i_gate.eq(gate)
+                    yield i_valid.eq(True)
+                    yield
+                    gates[voice] = gate
+                yield i_valid.eq(False)
+                for v in range(voices):
+                    state[v] = adsr_step(bank.rate_table, *state[v],
+                                         gates[v], **params)
+                    stages_seen.add(state[v][0])
+                    while not (yield bank.level_inlet.o_valid):
+                        yield
+                    actual = (
+                        (yield bank.level_inlet.o_data.voice),
+                        (yield bank.level_inlet.o_data.level),
+                    )
+                    expected = (v, level_out(state[v][1]))
+                    assert actual == expected, (
+                        f'pass {n}: expected {expected}, got {actual}'
+                    )
+                    yield
+            assert stages_seen == {IDLE, ATTACK, DECAY, SUSTAIN, RELEASE}
+            assert state == [(IDLE, 0)] * voices
+        return process
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+        for (bank, sigs) in zip(banks, gate_sigs):
+            sim.sync_process(tester(bank, sigs))
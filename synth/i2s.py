@@ -1,10 +1,13 @@
 #!/usr/bin/env nmigen
 
-from numbers import Complex
+import warnings
 
 from nmigen import Array, Cat, Const, Elaboratable, Module, Mux, Record
 from nmigen import Signal, signed
-from nmigen.build import Resource
+from nmigen.back.pysim import Passive, Settle
+from nmigen.build import Pins, Resource, Subsignal
+from nmigen.lib.cdc import FFSynchronizer
+from nmigen.lib.fifo import SyncFIFOBuffered
 
 from nmigen_lib.pipe import PipeSpec
 from nmigen_lib.util import Main, delay
@@ -19,7 +22,12 @@ def I2STxRecord():
     ])
 
 def I2SRxRecord():
-    raise NotImplementedError()
+    return Record([
+        ('mclk', 1),
+        ('lrck', 1),
+        ('sck', 1),
+        ('sd', 1),          # input
+    ])
 
 
 def stereo_sample_spec(width=16):
@@ -38,8 +46,14 @@ def PmodI2STxResource(name, number, *, pmod, extras=None):
         extras=extras
     )
 
-def PmodI2STxResource(name, number, *, pmod, extras=None):
-    raise NotImplementedEror()
+def PmodI2SRxResource(name, number, *, pmod, extras=None):
+    return Resource(name, number,
+        Subsignal('mclk', Pins('7', conn=('pmod', pmod), dir='o')),
+        Subsignal('lrck', Pins('8', conn=('pmod', pmod), dir='o')),
+        Subsignal('sck',  Pins('9', conn=('pmod', pmod), dir='o')),
+        Subsignal('sd',   Pins('10', conn=('pmod', pmod), dir='i')),
+        extras=extras
+    )
 
 
 class I2S(Elaboratable):
@@ -62,132 +76,209 @@ class I2S(Elaboratable):
 
     def elaborate(self, platform):
         m = Module()
-        i2s_tx = I2STx(clk_freq, tx_rate, tx_depth)
-        i2s_rx = I2SRx(clk_freq, rx_rate, rx_depth)
-        m.submodules += [i2s_tx, i2s_rx]
+        i2s_tx = I2STx(self.clk_freq, self.tx_rate, self.tx_depth)
+        i2s_rx = I2SRx(self.clk_freq, self.rx_rate, self.rx_depth)
+        m.submodules.i2s_tx = i2s_tx
+        m.submodules.i2s_rx = i2s_rx
         m.d.comb += [
-            i2s_tx.tx_samples.eq(self.tx_samples),
+            i2s_tx.tx_samples[0].eq(self.tx_samples[0]),
+            i2s_tx.tx_samples[1].eq(self.tx_samples[1]),
             i2s_tx.tx_stb.eq(self.tx_stb),
             self.tx_ack.eq(i2s_tx.tx_ack),
-            i2s.tx_i2s.mclk.eq(self.tx_i2s.mclk),
-            i2s.tx_i2s.lrck.eq(self.tx_i2s.lrck),
-            i2s.tx_i2s.sck.eq(self.tx_i2s.sck),
-            i2s.tx_i2s.sd.eq(self.tx_i2s.sd),
+            self.tx_i2s.eq(i2s_tx.tx_i2s),
 
-            # RX signals not connected.  TBD.
+            self.rx_rdy.eq(i2s_rx.rx_rdy),
+            self.rx_samples[0].eq(i2s_rx.rx_samples[0]),
+            self.rx_samples[1].eq(i2s_rx.rx_samples[1]),
+            self.rx_i2s.mclk.eq(i2s_rx.rx_i2s.mclk),
+            self.rx_i2s.lrck.eq(i2s_rx.rx_i2s.lrck),
+            self.rx_i2s.sck.eq(i2s_rx.rx_i2s.sck),
+            i2s_rx.rx_i2s.sd.eq(self.rx_i2s.sd),
         ]
         return m
 
 
 class P_I2STx(Elaboratable):
 
+    """Pipe interface to I2STx, with an elastic sample FIFO.
+
+       Samples wait in a `fifo_depth` deep FIFO (block RAM if it's
+       big enough) until the transmitter takes one each frame.  So
+       the upstream pipeline can run in bursts, as long as it keeps
+       up on average.
+
+       There are some counters to show how well it keeps up.
+
+         `fifo_level`       samples in the FIFO now.
+         `fifo_high_water`  most samples ever in the FIFO.
+         `underrun_count`   frames sent with no new sample (the
+                            previous sample is repeated).
+         `overrun_count`    samples that arrived when the FIFO was
+                            full and had to wait.
+
+       The counters saturate.  Underruns are not counted until the
+       first sample arrives.
+    """
+
     # def __init__(self, clk_freq, tx_rate, tx_depth=16):
-    def __init__(self, cfg):
+    def __init__(self, cfg, fifo_depth=16, counter_width=16):
         self.clk_freq = cfg.clk_freq
         self.tx_rate = cfg.out_rate
         self.tx_depth = cfg.out_depth
+        self.fifo_depth = fifo_depth
         assert cfg.out_channels == 2
+        assert fifo_depth >= 1, f'P_I2STx: fifo_depth = {fifo_depth} < 1'
 
         self.sample_outlet = stereo_sample_spec(self.tx_depth).outlet()
         self.tx_i2s = I2STxRecord()
+        self.fifo_level = Signal(range(fifo_depth + 1))
+        self.fifo_high_water = Signal(range(fifo_depth + 1))
+        self.underrun_count = Signal(counter_width)
+        self.overrun_count = Signal(counter_width)
 
     def elaborate(self, platform):
         sample = Record.like(self.sample_outlet.i_data)
+        primed = Signal()       # first sample has arrived
+        was_blocked = Signal()
 
         m = Module()
+
+        def saturating_inc(counter):
+            with m.If(counter != 2**len(counter) - 1):
+                m.d.sync += counter.eq(counter + 1)
+
         i2s_tx = I2STx(self.clk_freq, self.tx_rate, self.tx_depth)
+        fifo = SyncFIFOBuffered(width=len(sample), depth=self.fifo_depth)
         m.submodules.i2s_tx = i2s_tx
+        m.submodules.fifo = fifo
         m.d.comb += [
             i2s_tx.tx_stb.eq(True),
             i2s_tx.tx_samples[0].eq(sample.left),
             i2s_tx.tx_samples[1].eq(sample.right),
             self.tx_i2s.eq(i2s_tx.tx_i2s),
+
+            fifo.w_data.eq(self.sample_outlet.i_data),
+            fifo.w_en.eq(self.sample_outlet.i_valid),
+            self.sample_outlet.o_ready.eq(fifo.w_rdy),
+            fifo.r_en.eq(i2s_tx.tx_ack),
+            self.fifo_level.eq(fifo.level),
         ]
+
+        # Take the next sample each frame.
         with m.If(i2s_tx.tx_ack):
-            m.d.sync += [
-                self.sample_outlet.o_ready.eq(True),
-            ]
-        with m.If(self.sample_outlet.received()):
-            m.d.sync += [
-                self.sample_outlet.o_ready.eq(False),
-                sample.eq(self.sample_outlet.i_data),
-            ]
-        return m
+            with m.If(fifo.r_rdy):
+                m.d.sync += [
+                    sample.eq(fifo.r_data),
+                    primed.eq(True),
+                ]
+            with m.Elif(primed):
+                saturating_inc(self.underrun_count)
 
+        # Count each blocked sample once.
+        blocked = self.sample_outlet.i_valid & ~fifo.w_rdy
+        m.d.sync += was_blocked.eq(blocked)
+        with m.If(blocked & ~was_blocked):
+            saturating_inc(self.overrun_count)
 
-class I2STx(Elaboratable):
+        with m.If(fifo.level > self.fifo_high_water):
+            m.d.sync += self.fifo_high_water.eq(fifo.level)
+        return m
 
-    def __init__(self, clk_freq, tx_rate, tx_depth=16):
 
-        """I2S transmit side.  Generate an I2S stereo audio stream.
+def i2s_divisors(clk_freq, rate, depth, who='I2S'):
+    """Pick the MCLK and LRCK divisors for an I2S stream.
 
-           tx_rate can be between 2KHz and 200KHz, but is restricted to
-           specific fractions of clk_freq.  tx_depth can be either 16
-           or 24 bits.
+       rate can be between 2KHz and 200KHz.  depth can be either 16
+       or 24 bits.  Returns (mclk_divisor, lrck_divisor).
 
-           This module will pick the "best" mode for the Cirrus CS4344
-           based on tx_rate and tx_depth.
-        """
+       mclk_divisor is an int if it is even, otherwise a float.
 
-        assert tx_depth in (16, 24), (
-            f'I2STx: tx_depth = {tx_depth} must be 16 or 24.'
-        )
-        if 2_000 <= tx_rate < 50_000:
-            lrck_divisor = 256
-        elif 50_000 <= tx_rate < 100_000:
-            lrck_divisor = 128
-        elif 100_000 <= tx_rate <= 200_000:
-            lrck_divisor = 64
-        else:
-            assert False, (
-                f'tx_rate = {tx_rate:,} must be between 2,000 and 200,000.'
-            )
-        if tx_depth == 24:
-            lrck_divisor = lrck_divisor * 3 // 2
-        mclk_freq = lrck_divisor * tx_rate
-        mclk_divisor = int(clk_freq) // int(mclk_freq)
-        assert mclk_divisor // 2 == clk_freq / mclk_freq / 2, (
-            f'I2STx: 2 * mclk_freq = {2 * mclk_freq:,} must divide '
-            f'clk_freq = {clk_freq:,}'
-        )
-        assert clk_freq > mclk_freq, (
-            f'clk_freq={clk_freq:,} must be '
-            f'greater than mclk_freq={mclk_freq:,}'
+       This picks the "best" mode for the Cirrus CS4344 and CS5343.
+    """
+
+    assert depth in (16, 24), (
+        f'{who}: depth = {depth} must be 16 or 24.'
+    )
+    if 2_000 <= rate < 50_000:
+        lrck_divisor = 256
+    elif 50_000 <= rate < 100_000:
+        lrck_divisor = 128
+    elif 100_000 <= rate <= 200_000:
+        lrck_divisor = 64
+    else:
+        assert False, (
+            f'{who}: rate = {rate:,} must be between 2,000 and 200,000.'
         )
-        self.tx_depth = tx_depth
-        self.clk_freq = clk_freq
-        self.mclk_divisor = mclk_divisor
-        self.lrck_divisor = lrck_divisor
+    if depth == 24:
+        lrck_divisor = lrck_divisor * 3 // 2
+    mclk_freq = lrck_divisor * rate
+    mclk_divisor = clk_freq / mclk_freq
+    assert mclk_divisor >= 2, (
+        f'{who}: clk_freq={clk_freq:,} must be at least '
+        f'2 * mclk_freq={2 * mclk_freq:,}'
+    )
+    if mclk_divisor % 2 == 0:
+        mclk_divisor = int(mclk_divisor)
+    return mclk_divisor, lrck_divisor
 
-        # # Print all the variables.
-        # d = self.__dict__; d.update(locals())
-        # vars = {k: v
-        #         for (k, v) in d.items()
-        #         if isinstance(v, Complex)}
-        # w = len(max(vars, key=len))
-        # for k in sorted(vars):
-        #     print(f'{k:{w}} = {vars[k]:,}')
-        # print()
 
-        self.tx_samples = Array([Signal(signed(tx_depth), name='sample0'),
-                                 Signal(signed(tx_depth), name='sample1')])
-        self.tx_stb = Signal()
-        self.tx_ack = Signal()
-        self.tx_i2s = I2STxRecord()
+class I2SClocks(Elaboratable):
 
-    def elaborate(self, platform):
-        bitstream = Signal(2 * self.tx_depth)
-        pre_sd = Signal()
-        sd = Signal()
+    """Generate the I2S clocks.  Shared by I2STx and I2SRx.
+
+       The outputs are combinatorial, and the transmitter and
+       receiver register them, so the clock pins and data line up.
+
+         `mclk`, `sck`, `lrck`  next values of the I2S clocks.
+         `load`       a new frame starts.
+         `shift`      SCK is about to fall: time to change SD.
+         `bit_index`  which bit of the frame is next on SD.
 
+       If mclk_divisor is not an even integer, the clocks come from
+       a fractional-N phase accumulator.  The average rates are right
+       (within `rate_error`), but each clock edge may be early by up
+       to one clk period.  `jitter` is that, in seconds, peak to peak.
+    """
+
+    def __init__(self, clk_freq, mclk_divisor, lrck_divisor, depth,
+                 acc_bits=24):
+        self.mclk_divisor = mclk_divisor
+        self.lrck_divisor = lrck_divisor
+        self.depth = depth
+        self.sck_bit = -7 if depth == 24 else -6
+        self.acc_bits = acc_bits
+        if isinstance(mclk_divisor, int):
+            self.phase_inc = None
+            self.jitter = 0.0
+            self.rate_error = 0.0
+        else:
+            # The accumulator overflows twice per MCLK period.
+            self.phase_inc = round(2 * 2**acc_bits / mclk_divisor)
+            actual_divisor = 2 * 2**acc_bits / self.phase_inc
+            self.jitter = 1 / clk_freq
+            self.rate_error = mclk_divisor / actual_divisor - 1
+            warnings.warn(
+                f'I2SClocks: MCLK divisor {mclk_divisor:.4f} is fractional; '
+                f'clocks have {self.jitter * 1e9:.1f} ns p-p jitter',
+                stacklevel=3)
+
+        self.mclk = Signal()
+        self.sck = Signal()
+        self.lrck = Signal()
+        self.load = Signal()
+        self.shift = Signal()
+        self.bit_index = Signal(-(self.sck_bit + 1))
+
+    def elaborate(self, platform):
         m = Module()
 
         # There are four counters.
         #
-        # `fast_cnt` decrements at clk frequency and underflows at mclk
-        #   frequency.  `fast_clk` is only needed/possible if mclk
-        #   frequency is less than clk_freq.  It is used to advance
-        #   `slow_cnt` and `mcnt`.
+        # `fast_cnt` decrements at clk frequency and underflows at twice
+        #   mclk frequency.  It is used to advance `slow_cnt` and `mcnt`.
+        #   If the MCLK divisor is fractional, `fast_cnt` is replaced by
+        #   the phase accumulator `phase`, which overflows at twice mclk
+        #   frequency on average.
         #
         # `slow_cnt` decrements at twice mclk frequency and underflows
         #   at lrck_frequency.  It is used to reset `mcnt` each
@@ -202,23 +293,26 @@ class I2STx(Elaboratable):
         #   frequency, and underflows when it's time to toggle `lrck`.
         #   In 16-bit mode, `lrck` is simply the high bit of `mcnt`.
         #
-        fast_cnt_needed = self.mclk_divisor >= 2
-        if fast_cnt_needed:
+        slow_inc = Signal()
+        if self.phase_inc is None:
             fast_max = self.mclk_divisor // 2 - 2
             fast_cnt = Signal(range(-1, fast_max + 1))
-            slow_inc = Signal()
+            fast_tick = fast_cnt[-1]
             with m.If(fast_cnt[-1]):
                 m.d.sync += [
                     fast_cnt.eq(fast_max),
-                    slow_inc.eq(True),
                 ]
             with m.Else():
                 m.d.sync += [
                     fast_cnt.eq(fast_cnt - 1),
-                    slow_inc.eq(False),
                 ]
         else:
-            slow_inc = True
+            phase = Signal(self.acc_bits)
+            next_phase = Signal(self.acc_bits + 1)
+            fast_tick = next_phase[-1]
+            m.d.comb += next_phase.eq(phase + self.phase_inc)
+            m.d.sync += phase.eq(next_phase)
+        m.d.sync += slow_inc.eq(fast_tick)
 
         slow_max = 2 * self.lrck_divisor - 2
         slow_cnt = Signal(range(-1, slow_max + 1))
@@ -236,7 +330,7 @@ class I2STx(Elaboratable):
                     mcnt.eq(mcnt + 1),
                 ]
 
-        lr_cnt_needed = self.tx_depth == 24
+        lr_cnt_needed = self.depth == 24
         if lr_cnt_needed:
             lr_cnt_max = self.lrck_divisor - 2
             lr_cnt = Signal(range(-1, lr_cnt_max + 1))
@@ -252,8 +346,70 @@ class I2STx(Elaboratable):
                         lr_cnt.eq(lr_cnt - 1),
                     ]
 
+        # `fast_tick` advances `mcnt` on the next clock.  If the two
+        # come on consecutive clocks, look at `mcnt`'s next value.
+        next_mcnt = Signal.like(mcnt)
+        m.d.comb += next_mcnt.eq(mcnt)
+        with m.If(slow_inc):
+            m.d.comb += next_mcnt.eq(Mux(slow_cnt[-1], 0, mcnt + 1))
+
+        sck_bit = self.sck_bit
+        m.d.comb += [
+            self.load.eq(slow_cnt[-1] & slow_inc),
+            self.shift.eq(fast_tick & (~next_mcnt[:sck_bit + 1] == 0)),
+            self.bit_index.eq(next_mcnt[sck_bit + 1:]),
+            self.mclk.eq(mcnt[0]),
+            self.sck.eq(mcnt[sck_bit]),
+            self.lrck.eq(pre_lrck if lr_cnt_needed else mcnt[-1]),
+        ]
+        return m
+
+
+class I2STx(Elaboratable):
+
+    def __init__(self, clk_freq, tx_rate, tx_depth=16):
+
+        """I2S transmit side.  Generate an I2S stereo audio stream.
+
+           tx_rate can be between 2KHz and 200KHz.  clk_freq must be
+           at least twice the MCLK frequency.  If it is not an even
+           multiple, the clocks have one clk of jitter; see I2SClocks.
+           tx_depth can be either 16 or 24 bits.
+
+           This module will pick the "best" mode for the Cirrus CS4344
+           based on tx_rate and tx_depth.
+        """
+
+        mclk_divisor, lrck_divisor = i2s_divisors(
+            clk_freq, tx_rate, tx_depth, who='I2STx'
+        )
+        self.tx_depth = tx_depth
+        self.clk_freq = clk_freq
+        self.mclk_divisor = mclk_divisor
+        self.lrck_divisor = lrck_divisor
+        self.clocks = I2SClocks(
+            clk_freq,
+            mclk_divisor,
+            lrck_divisor,
+            tx_depth,
+        )
+        self.jitter = self.clocks.jitter
+
+        self.tx_samples = Array([Signal(signed(tx_depth), name='sample0'),
+                                 Signal(signed(tx_depth), name='sample1')])
+        self.tx_stb = Signal()
+        self.tx_ack = Signal()
+        self.tx_i2s = I2STxRecord()
+
+    def elaborate(self, platform):
+        bitstream = Signal(2 * self.tx_depth)
+        sd = Signal()
+
+        m = Module()
+        m.submodules.clocks = clocks = self.clocks
+
         # Load and ack next frame at start of period.
-        with m.If(slow_cnt[-1] & slow_inc):
+        with m.If(clocks.load):
             m.d.sync += [
                 # I2S bitstream is MSB first, so reverse bits here.
                 bitstream.eq(Mux(self.tx_stb,
@@ -270,46 +426,165 @@ class I2STx(Elaboratable):
         # The SD signal needs to be delayed by one SCK period.
         # So the LSB is actually sent after LRCK has transitioned.
         # This is apparently how I2S works.
-        sck_bit = -7 if lr_cnt_needed else -6
-        with m.If(fast_cnt[-1] & (~mcnt[:sck_bit + 1] == 0)):
+        with m.If(clocks.shift):
             m.d.sync += [
-                sd.eq(bitstream.bit_select(mcnt[sck_bit + 1:], 1))
+                sd.eq(bitstream.bit_select(clocks.bit_index, 1))
             ]
         m.d.sync += [
-            self.tx_i2s.mclk.eq(mcnt[0]),
-            self.tx_i2s.sck.eq(mcnt[sck_bit]),
+            self.tx_i2s.mclk.eq(clocks.mclk),
+            self.tx_i2s.sck.eq(clocks.sck),
             self.tx_i2s.sd.eq(sd),
-            self.tx_i2s.lrck.eq(pre_lrck if lr_cnt_needed else mcnt[-1]),
+            self.tx_i2s.lrck.eq(clocks.lrck),
+        ]
+        return m
+
+
+class P_I2SRx(Elaboratable):
+
+    """Pipe interface to I2SRx.
+
+       Receives the same sample rate and depth that P_I2STx sends.
+       If the pipe is not ready when a frame arrives, the frame is
+       dropped and `overrun` pulses.
+    """
+
+    def __init__(self, cfg):
+        self.clk_freq = cfg.clk_freq
+        self.rx_rate = cfg.out_rate
+        self.rx_depth = cfg.out_depth
+        assert cfg.out_channels == 2
+
+        self.sample_inlet = stereo_sample_spec(self.rx_depth).inlet()
+        self.rx_i2s = I2SRxRecord()
+        self.overrun = Signal()
+
+    def elaborate(self, platform):
+        inlet = self.sample_inlet
+
+        m = Module()
+        i2s_rx = I2SRx(self.clk_freq, self.rx_rate, self.rx_depth)
+        m.submodules.i2s_rx = i2s_rx
+        m.d.comb += [
+            self.rx_i2s.mclk.eq(i2s_rx.rx_i2s.mclk),
+            self.rx_i2s.lrck.eq(i2s_rx.rx_i2s.lrck),
+            self.rx_i2s.sck.eq(i2s_rx.rx_i2s.sck),
+            i2s_rx.rx_i2s.sd.eq(self.rx_i2s.sd),
         ]
+        with m.If(inlet.sent()):
+            m.d.sync += inlet.o_valid.eq(False)
+        m.d.sync += self.overrun.eq(False)
+        with m.If(i2s_rx.rx_rdy):
+            with m.If(inlet.full()):
+                m.d.sync += self.overrun.eq(True)
+            with m.Else():
+                m.d.sync += [
+                    inlet.o_valid.eq(True),
+                    inlet.o_data.left.eq(i2s_rx.rx_samples[0]),
+                    inlet.o_data.right.eq(i2s_rx.rx_samples[1]),
+                ]
         return m
 
 
 class I2SRx(Elaboratable):
 
-    def __init__(self, clk_freq, mclk_divisor, rx_depth=16):
-        raise NotImplementedError("I'm not writing it.  YOU write it.")
+    def __init__(self, clk_freq, rx_rate, rx_depth=16):
+
+        """I2S receive side.  Receive an I2S stereo audio stream.
+
+           The receiver is the I2S master: it generates MCLK, SCK and
+           LRCK with the same counters as I2STx, and samples SD on the
+           rising edge of SCK.  rx_rate and rx_depth have the same
+           limits as I2STx's.
+
+           `rx_rdy` pulses when both samples of a frame have arrived.
+        """
+
+        mclk_divisor, lrck_divisor = i2s_divisors(
+            clk_freq, rx_rate, rx_depth, who='I2SRx'
+        )
+        self.rx_depth = rx_depth
+        self.clk_freq = clk_freq
+        self.mclk_divisor = mclk_divisor
+        self.lrck_divisor = lrck_divisor
+        self.clocks = I2SClocks(
+            clk_freq,
+            mclk_divisor,
+            lrck_divisor,
+            rx_depth,
+        )
+        self.jitter = self.clocks.jitter
+
+        self.rx_samples = Array([Signal(signed(rx_depth), name='sample0'),
+                                 Signal(signed(rx_depth), name='sample1')])
+        self.rx_rdy = Signal()
+        self.rx_i2s = I2SRxRecord()
 
     def elaborate(self, platform):
-        ...
+        depth = self.rx_depth
+        sd = Signal()
+        prev_sck = Signal()
+        prev_lrck = Signal()
+        shift = Signal(depth - 1)
+        word = Signal(signed(depth))
+
+        m = Module()
+        m.submodules.clocks = clocks = self.clocks
+        m.submodules.sd_sync = FFSynchronizer(self.rx_i2s.sd, sd)
+        m.d.sync += [
+            self.rx_i2s.mclk.eq(clocks.mclk),
+            self.rx_i2s.sck.eq(clocks.sck),
+            self.rx_i2s.lrck.eq(clocks.lrck),
+            prev_sck.eq(self.rx_i2s.sck),
+            self.rx_rdy.eq(False),
+        ]
+
+        # Each channel's LSB arrives on the first SCK after LRCK
+        # changes, so a word is complete when LRCK has changed.
+        m.d.comb += word.eq(Cat(sd, shift))
+        with m.If(self.rx_i2s.sck & ~prev_sck):
+            m.d.sync += [
+                shift.eq(word),
+                prev_lrck.eq(self.rx_i2s.lrck),
+            ]
+            with m.If(self.rx_i2s.lrck != prev_lrck):
+                with m.If(prev_lrck):
+                    m.d.sync += [
+                        self.rx_samples[1].eq(word),
+                        self.rx_rdy.eq(True),
+                    ]
+                with m.Else():
+                    m.d.sync += self.rx_samples[0].eq(word)
+        return m
 
 
 if __name__ == '__main__':
-    design = P_I2STx(48_000_000, 46_875, tx_depth=16)
-    # design = I2STx(72_000_000, 46_875, tx_depth=24)
-    # design = I2STx(48_000_000, 2 * 46_875, tx_depth=16)
-    # design = I2STx(72_000_000, 2 * 46_875, tx_depth=24)
-    # design = I2STx(48_000_000, 4 * 46_875, tx_depth=16)
-    # design = I2STx(72_000_000, 4 * 46_875, tx_depth=24)
+    from synth.config import SynthConfig
+
+    cfg = SynthConfig(48_000_000)
+    # cfg = SynthConfig(48_000_000, out_oversample=2)
+    # cfg = SynthConfig(48_000_000, out_oversample=4)
+    # cfg = SynthConfig(48_000_000, out_depth=24)     # fractional MCLK
+    design = P_I2STx(cfg, fifo_depth=4)
     design.sample_outlet.leave_unconnected()
+    frame_clocks = round(cfg.clk_freq / cfg.out_rate)
+
+    # Loop the transmitter back to a receiver.
+    rx = P_I2SRx(cfg)
+    rx.sample_inlet.leave_unconnected()
+    received = []
+    clocks = 0
 
     # Work around nMigen issue #280
     m = Module()
     m.submodules.p_i2s_tx = design
+    m.submodules.p_i2s_rx = rx
     i_valid = Signal()
     i_data = Signal.like(design.sample_outlet.i_data)
     m.d.comb += [
         design.sample_outlet.i_valid.eq(i_valid),
         design.sample_outlet.i_data.eq(i_data),
+        rx.rx_i2s.sd.eq(design.tx_i2s.sd),
+        rx.sample_inlet.i_ready.eq(True),
     ]
 
     # 280 with Main(design).sim as sim:
@@ -330,16 +605,60 @@ if __name__ == '__main__':
         #         yield design.tx_stb.eq(False)
         #         yield
 
-        # Simulate the pipe TX.
+        # Simulate the pipe TX.  Send a burst of six samples into the
+        # four sample FIFO, then let it run dry.
         @sim.sync_process
         def tx_proc():
-            left = 0; right = 100
+            left = 0; right = -100
             s = signed(design.tx_depth)
-            for i in range(24):
+            sent = []
+            yield from delay(frame_clocks // 2)   # miss the first frame
+            for i in range(6):
                 yield i_valid.eq(True)
                 yield i_data.eq(Cat(Const(left, s), Const(right, s)))
-                left += 3; right += 5
-                while (yield design.sample_outlet.o_ready) == False:
+                sent.append((left, right))
+                left += 3; right -= 5
+                yield Settle()
+                while not (yield design.sample_outlet.received()):
                     yield
+                    yield Settle()
+                yield
                 yield i_valid.eq(False)
+            yield from delay(10 * frame_clocks)
+            high_water = yield design.fifo_high_water
+            overruns = yield design.overrun_count
+            underruns = yield design.underrun_count
+            assert high_water == 4, f'high water = {high_water}'
+            # Samples 5 and 6 each waited for space.
+            assert overruns == 2, f'overrun count = {overruns}'
+            # Four samples were left when the burst ended, so six of
+            # the next ten frames underran.
+            assert underruns == 6, f'underrun count = {underruns}'
+            assert (yield design.fifo_level) == 0
+
+            # Every frame came through the loopback: silence until the
+            # first sample, then the six samples, then the last one
+            # repeated.
+            # The first frame starts at clock 0, and the last is
+            # still in flight.
+            frames = clocks // frame_clocks + 1
+            assert len(received) == frames - 1, (
+                f'received {len(received)} of {frames} frames'
+            )
+            while received and received[0] == (0, 0):
+                received.pop(0)
+            assert received[:6] == sent, f'received {received[:6]}'
+            assert set(received[6:]) == {sent[-1]}, f'received {received}'
+
+        @sim.sync_process
+        def rx_proc():
+            global clocks
+            yield Passive()
+            while True:
                 yield
+                clocks += 1
+                if (yield rx.sample_inlet.o_valid):
+                    received.append((
+                        (yield rx.sample_inlet.o_data.left),
+                        (yield rx.sample_inlet.o_data.right),
+                    ))
@@ -0,0 +1,340 @@
+#!/usr/bin/env nmigen
+
+from math import ceil, log2
+
+import numpy as np
+
+from nmigen import Elaboratable, Memory, Module, Mux, Signal
+from nmigen import signed
+from nmigen.back.pysim import Passive, Settle
+
+from nmigen_lib.util import Main, delay
+
+from .config import SynthConfig
+from .decimator import COEFF_WIDTH, COEFF_SHAPE
+from .osc import mono_sample_spec
+
+
+# An interpolator raises the sample rate by L.  Conceptually, it
+# inserts L - 1 zeros after each input sample, then low-pass filters
+# away the images of the original spectrum.
+#
+# The polyphase form skips the multiplications by zero.  The kernel
+# is split into L phases of P taps each, and output j of each group
+# convolves the last P input samples with phase j:
+#
+#     y[n * L + j] = sum(h[k * L + j] * x[n - k] for k in range(P))
+#
+# See earlevel.com for polyphase filter based resampling.
+
+class Interpolator(Elaboratable):
+
+    """Raise a base-rate sample stream to `cfg.out_rate`.
+
+       For each sample received on `samples_in`, L = out_rate /
+       base_rate samples are sent out `samples_out`.  The filter is
+       a windowed sinc that passes `pass_freq` and rejects the images
+       above base_rate - pass_freq.
+
+       There is one multiplier.  Each output takes P + 4 clocks.
+    """
+
+    def __init__(self, cfg, P=None, pass_freq=20_000):
+        self.clk_freq = cfg.clk_freq
+        self.sample_depth = cfg.out_depth
+        self.in_rate = cfg.base_rate
+        self.out_rate = cfg.out_rate
+        assert cfg.out_depth == 16
+        self.L = cfg.out_rate // cfg.base_rate
+        assert self.L in (2, 4), (
+            f'Interpolator: out_rate / base_rate = {self.L} must be 2 or 4'
+        )
+        # Transition band is from pass_freq to the first image's edge.
+        BW = (cfg.base_rate - 2 * pass_freq) / cfg.out_rate
+        assert BW > 0, (
+            f'Interpolator: pass_freq = {pass_freq:,} is too high for '
+            f'base_rate = {cfg.base_rate:,}'
+        )
+        budget = int(cfg.clk_freq // cfg.out_rate) - 4
+        if P is None:
+            # 4 / BW taps only gets 40 dB at the transition band's
+            # edge.  6 / BW gets more than 60 dB.
+            P = min(ceil((6 / BW + 1) / self.L), budget)
+        assert 0 < P <= budget, (
+            f'Interpolator: P = {P} taps per phase do not fit in '
+            f'{budget + 4} clocks per sample'
+        )
+        self.P = P
+        self.M = self.L * P - 1
+        self.BW = BW
+        self.Fp = pass_freq / cfg.out_rate
+        self.Fc = 0.5 / self.L
+        self._make_kernel()
+
+        # L: interpolation ratio.
+        # P: taps per phase.
+        # M: kernel size - 1.
+        # Fp: pass frequency as a fraction of out Fs.
+        # BW: transition band width as a fraction of out Fs.
+        # Fc: cutoff frequency.  Half the input Fs.
+        # shift: number of LSBs to discard in output samples.
+        # acc_width: number of bits in accumulator.
+        # kernel: convolution kernel.
+        if cfg.verbose:
+            Fc_KHz = self.Fc * cfg.out_rate / 1000
+            print(f'Interpolator:')
+            print(f'    L         = {self.L:,}')
+            print(f'    P         = {self.P:,}')
+            print(f'    M         = {self.M:,}')
+            print(f'    Fp        = {self.Fp:,.4}')
+            print(f'    BW        = {self.BW:,.4}')
+            print(f'    Fc        = {self.Fc:,.4} = {Fc_KHz:,.4} KHz')
+            print(f'    shift     = {self.shift}')
+            print(f'    acc_width = {self.acc_width}')
+            print(f'    kernel    = ', end='')
+            with np.printoptions(linewidth=75-16):
+                print(str(np.array(self.kernel))
+                      .replace('\n', '\n' + 16 * ' '))
+            print()
+
+        self.samples_in = mono_sample_spec(cfg.out_depth).outlet()
+        self.samples_out = mono_sample_spec(cfg.out_depth).inlet()
+
+    def _make_kernel(self):
+        # Make a windowed sinc filter kernel with gain L, so each
+        # phase has gain 1.
+        M = self.M
+        x = np.linspace(-self.Fc * M, +self.Fc * M, M + 1)
+        kernel = np.sinc(x) * np.blackman(M + 1)
+        kernel *= self.L / kernel.sum()
+
+        # Scale by a power of 2 so the coefficients are as large
+        # as possible.
+        coeff_max = 2**(COEFF_WIDTH - 1) - 1
+        peak = max(abs(kernel))
+        shift = 0
+        while 2 * peak <= coeff_max:
+            peak *= 2
+            shift += 1
+        kernel = np.round(kernel * 2**shift).astype(np.int64)
+
+        # The worst case input is full scale with the sign of each
+        # coefficient, in the phase with the largest absolute sum.
+        worst = max(
+            np.abs(kernel[j::self.L]).sum() * 2**(self.sample_depth - 1)
+            for j in range(self.L)
+        )
+        acc_width = ceil(log2(worst)) + 1
+
+        self.kernel = [int(c) for c in kernel]
+        self.shift = shift
+        self.acc_width = acc_width
+
+    def elaborate(self, platform):
+        L, P = self.L, self.P
+        depth = self.sample_depth
+        sample_max = 2**(depth - 1) - 1
+
+        # coeff_RAM holds the kernel, sorted by phase.
+        coeffs = [self.kernel[k * L + j] for j in range(L) for k in range(P)]
+        coeff_RAM = Memory(width=COEFF_WIDTH, depth=L * P, init=coeffs)
+
+        # sample_RAM is a circular buffer of the last P input samples.
+        N = 2**ceil(log2(P))
+        sample_RAM = Memory(width=depth, depth=N, init=[0] * N)
+
+        m = Module()
+        m.submodules.cr_port = cr_port = coeff_RAM.read_port()
+        m.submodules.sw_port = sw_port = sample_RAM.write_port()
+        m.submodules.sr_port = sr_port = sample_RAM.read_port()
+
+        newest = Signal(range(N))           # most recent sample's index
+        phase = Signal(range(L))
+        tap = Signal(range(P))
+        running = Signal()
+        in_flight = Signal()                # a phase is being summed
+
+        # The convolution is pipelined.
+        #
+        #   stage 0: fetch coefficient and sample from their RAMs.
+        #   stage 1: multiply coefficient and sample.
+        #   stage 2: add product to accumulator.
+        #   stage 3: saturate and send accumulated sample.
+        #
+        # Each stage has a valid bit, and `first` and `last` bits
+        # mark the ends of each phase's convolution.
+        valid = Signal(3)
+        first = Signal(2)
+        last = Signal(3)
+        coeff = Signal(COEFF_SHAPE)
+        sample = Signal(signed(depth))
+        prod = Signal(signed(COEFF_WIDTH + depth))
+        acc = Signal(signed(self.acc_width))
+        result = Signal(signed(self.acc_width - self.shift))
+
+        # Accept a new sample when all phases of the last one have
+        # been fetched.
+        m.d.comb += [
+            self.samples_in.o_ready.eq(~running),
+            sw_port.addr.eq(newest + 1),
+            sw_port.data.eq(self.samples_in.i_data),
+            sw_port.en.eq(self.samples_in.received()),
+        ]
+        with m.If(self.samples_in.received()):
+            m.d.sync += [
+                newest.eq(newest + 1),
+                phase.eq(0),
+                tap.eq(0),
+                running.eq(True),
+            ]
+
+        # Stage 0.  Start a phase when the output is free.
+        issue = Signal()
+        m.d.comb += [
+            issue.eq(
+                running &
+                ((tap != 0) | ~(in_flight | self.samples_out.o_valid))
+            ),
+            cr_port.addr.eq(phase * P + tap),
+            sr_port.addr.eq(newest - tap),
+        ]
+        m.d.sync += [
+            valid[0].eq(issue),
+            first[0].eq(tap == 0),
+            last[0].eq(tap == P - 1),
+        ]
+        with m.If(issue):
+            m.d.sync += tap.eq(tap + 1)
+            with m.If(tap == P - 1):
+                m.d.sync += [
+                    tap.eq(0),
+                    phase.eq(phase + 1),
+                    in_flight.eq(True),
+                ]
+                with m.If(phase == L - 1):
+                    m.d.sync += running.eq(False)
+
+        # Stage 1.
+        m.d.comb += [
+            coeff.eq(cr_port.data),
+            sample.eq(sr_port.data),
+        ]
+        m.d.sync += [
+            prod.eq(coeff * sample),
+            valid[1].eq(valid[0]),
+            first[1].eq(first[0]),
+            last[1].eq(last[0]),
+        ]
+
+        # Stage 2.
+        with m.If(valid[1]):
+            m.d.sync += acc.eq(Mux(first[1], prod, acc + prod))
+        m.d.sync += [
+            valid[2].eq(valid[1]),
+            last[2].eq(valid[1] & last[1]),
+        ]
+
+        # Stage 3.
+        m.d.comb += result.eq(acc[self.shift:])
+        with m.If(last[2]):
+            m.d.sync += [
+                self.samples_out.o_valid.eq(True),
+                self.samples_out.o_data.eq(
+                    Mux(result > sample_max, sample_max,
+                        Mux(result < -sample_max - 1, -sample_max - 1,
+                            result))
+                ),
+                in_flight.eq(False),
+            ]
+        with m.If(self.samples_out.sent()):
+            m.d.sync += self.samples_out.o_valid.eq(False)
+
+        return m
+
+
+def interpolate(design, samples):
+    """Bit-exact model of an Interpolator, for testing."""
+    L, P = design.L, design.P
+    lo, hi = -2**(design.sample_depth - 1), 2**(design.sample_depth - 1) - 1
+    kernel = np.array(design.kernel, dtype=np.int64)
+    history = np.zeros(P, dtype=np.int64)
+    out = []
+    for x in samples:
+        history = np.append([x], history[:-1])
+        for j in range(L):
+            acc = int((kernel[j::L] * history).sum())
+            out.append(min(hi, max(lo, acc >> design.shift)))
+    return out
+
+
+if __name__ == '__main__':
+    cfg = SynthConfig(48e6, out_oversample=4)
+    # cfg = SynthConfig(24e6, out_oversample=2)
+    cfg.describe()
+    design = Interpolator(cfg)
+    design.samples_in.leave_unconnected()
+    design.samples_out.leave_unconnected()
+    L = design.L
+
+    # Check the filter.  The passband is flat, and the images are
+    # at least 60 dB down.
+    H = np.abs(np.fft.rfft(np.array(design.kernel) / 2**design.shift / L,
+                           8192))
+    f = np.linspace(0, 0.5, len(H))
+    passband = H[f <= design.Fp]
+    stopband = H[f >= design.Fp + design.BW]
+    assert np.all(np.abs(20 * np.log10(passband)) < 0.1), 'passband ripple'
+    assert np.all(20 * np.log10(stopband + 1e-12) < -60), 'stopband leak'
+
+    # A full-scale square wave overshoots, and a sine doesn't.
+    freq = 1000
+    n_in = 3 * cfg.base_rate // freq
+    square = [32767 if (i * freq * 2 // cfg.base_rate) % 2 else -32768
+              for i in range(n_in // 3)]
+    sine = [int(30000 * np.sin(np.pi * 2 * i * freq / cfg.base_rate))
+            for i in range(n_in - len(square))]
+    samples_in = square + sine
+    expected = interpolate(design, samples_in)
+
+    # Work around nMigen issue #280
+    i_valid = Signal.like(design.samples_in.i_valid)
+    i_data = Signal.like(design.samples_in.i_data)
+    i_ready = Signal.like(design.samples_out.i_ready)
+    m = Module()
+    m.submodules.design = design
+    m.d.comb += [
+        design.samples_in.i_valid.eq(i_valid),
+        design.samples_in.i_data.eq(i_data),
+        design.samples_out.i_ready.eq(i_ready),
+    ]
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+        sim.add_clock(1 / cfg.clk_freq, domain='sync')
+
+        @sim.sync_process
+        def sample_in_process():
+            # Send as fast as the interpolator takes them.
+            for x in samples_in:
+                yield i_data.eq(x)
+                yield i_valid.eq(True)
+                yield Settle()
+                while not (yield design.samples_in.received()):
+                    yield
+                    yield Settle()
+                yield
+                yield i_valid.eq(False)
+
+        @sim.sync_process
+        def sample_out_process():
+            n = 0
+            while expected:
+                # Exercise back pressure.
+                yield i_ready.eq(n % 7 != 3)
+                yield Settle()
+                n += 1
+                if (yield design.samples_out.sent()):
+                    actual = yield design.samples_out.o_data
+                    exp = expected.pop(0)
+                    assert actual == exp, f'expected {exp}, got {actual}'
+                yield
@@ -0,0 +1,508 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Cat, Const, Elaboratable, Memory, Module, Mux, Signal
+from nmigen import unsigned
+from nmigen.back.pysim import Passive, Settle
+
+from nmigen_lib.pipe import PipeSpec, START_STOP
+from nmigen_lib.pipe.uart import P_UARTRx, P_UARTTx
+from nmigen_lib.util import Main, delay
+
+
+# Bulk write protocol.
+#
+# The host sends frames.  Each frame writes a run of bytes into
+# one table, starting at some address.
+#
+#     MAGIC
+#     sequence number, 0 to 127
+#     table
+#     address, low byte first
+#     count - 1, low byte first
+#     `count` data bytes
+#     CRC-16, high byte first
+#
+# The CRC is CRC-16/CCITT-FALSE (polynomial 0x1021, initial value
+# 0xFFFF), calculated over everything after MAGIC.
+#
+# The loader answers each frame with one byte: ACK or NAK in the
+# high bit, and the frame's sequence number in the low seven bits.
+# So the host can match replies to frames even when a frame gets no
+# reply.  A frame that stops arriving before its CRC is NAKed when
+# it times out.
+#
+# Data bytes wait in a buffer until the CRC has been checked, and
+# only a good frame's bytes are written.  So a NAKed frame writes
+# nothing, and resending it is always safe.  A frame may carry at
+# most as many data bytes as the buffer holds; a longer one is
+# NAKed.
+
+FRAME_MAGIC = 0xA5
+ACK = 0x80
+NAK = 0x00
+SEQ_MASK = 0x7F
+CRC_INIT = 0xFFFF
+CRC_POLY = 0x1021
+
+bulk_write_spec = PipeSpec((
+    ('table', unsigned(8)),
+    ('addr', unsigned(16)),
+    ('data', unsigned(8)),
+), flags=START_STOP)
+
+
+def _crc16_shift8(crc):
+    # Shift one byte's worth of zeros through the CRC.
+    for _ in range(8):
+        crc <<= 1
+        if crc & 0x10000:
+            crc ^= CRC_POLY
+        crc &= 0xFFFF
+    return crc
+
+
+def crc16(data, crc=CRC_INIT):
+    """CRC-16/CCITT-FALSE of a byte sequence."""
+    for byte in data:
+        crc = _crc16_shift8(crc ^ byte << 8)
+    return crc
+
+assert crc16(b'123456789') == 0x29B1
+
+
+def bulk_frame(seq, table, addr, data):
+    """Build one bulk write frame."""
+    assert 0 <= seq <= SEQ_MASK
+    assert 0 < len(data) <= 0x10000
+    assert 0 <= addr and addr + len(data) <= 0x10000
+    count = len(data) - 1
+    body = bytes((seq, table, addr & 0xFF, addr >> 8,
+                  count & 0xFF, count >> 8))
+    body += bytes(data)
+    crc = crc16(body)
+    return bytes((FRAME_MAGIC, )) + body + bytes((crc >> 8, crc & 0xFF))
+
+
+def _crc16_next(crc, byte):
+    # One byte of CRC calculation in combinatorial logic.  The CRC is
+    # linear, so each output bit is the XOR of some input bits.
+    x = crc ^ Cat(Const(0, 8), byte)
+    bits = []
+    for j in range(16):
+        terms = [x[i] for i in range(16) if _crc16_shift8(1 << i) >> j & 1]
+        bit = terms[0]
+        for t in terms[1:]:
+            bit = bit ^ t
+        bits.append(bit)
+    return Cat(*bits)
+
+
+class BulkLoader(Elaboratable):
+
+    """Decode bulk write frames from a byte stream.
+
+       Each data byte of a good frame is sent out `write_out` with
+       its table and address.  The first write of a frame has
+       `start` set, and the last has `stop` set.  A reply byte is
+       sent out `ack_out` when each frame ends.
+
+       Data bytes wait in a `depth` word buffer, in block RAM, until
+       the frame's CRC is checked.  Then a good frame's writes go
+       out, while the next frame arrives.  A bad frame's bytes are
+       dropped.  Frames may have up to `depth` data bytes.
+
+       If no byte arrives for `timeout` clocks, a partial frame is
+       NAKed and dropped, and the loader looks for the next MAGIC
+       byte.
+
+       `tables` maps each table number the design can load to the
+       table's size in bytes.  A frame for any other table, or one
+       that runs past the end of its table, is NAKed and dropped.
+       With no `tables`, every table is accepted.
+    """
+
+    def __init__(self, timeout, depth=256, tables=None):
+        assert depth & depth - 1 == 0, (
+            f'BulkLoader: depth = {depth} is not a power of 2'
+        )
+        for (number, size) in (tables or {}).items():
+            assert 0 <= number < 256 and 0 < size <= 2**16, (
+                f'BulkLoader: bad table {number} of {size} bytes'
+            )
+        self.timeout = timeout
+        self.depth = depth
+        self.tables = None if tables is None else dict(tables)
+        self.serial_in = PipeSpec(8).outlet()
+        self.write_out = bulk_write_spec.inlet()
+        self.ack_out = PipeSpec(8).inlet()
+        self.crc_err = Signal()
+
+    def elaborate(self, platform):
+        i_data = self.serial_in.i_data
+        write_out = self.write_out
+        depth = self.depth
+
+        seq = Signal(7)
+        table = Signal(8)
+        addr = Signal(16)
+        count = Signal(16)
+        crc = Signal(16, reset=CRC_INIT)
+        first = Signal()
+        drop = Signal()                 # too long, or no such table
+        idle_max = self.timeout - 2
+        idle_cnt = Signal(range(-1, idle_max + 1))
+
+        # The buffer is a ring.  Bytes from `commit` to `w_ptr` are
+        # the current frame's; bytes from `r_ptr` to `commit` are
+        # good, and waiting to go out `write_out`.  The pointers have
+        # one more bit than the addresses, so a full ring and an
+        # empty one look different.
+        payload = Cat(*(
+            write_out._get_signal(desc)
+            for desc in bulk_write_spec.payload_signals
+        ))
+        buf = Memory(width=len(payload), depth=depth)
+        w_ptr = Signal(range(2 * depth))
+        commit = Signal.like(w_ptr)
+        r_ptr = Signal.like(w_ptr)
+        used = Signal.like(w_ptr)
+        fetched = Signal()              # buffer read port has a word
+        storing = Signal()              # next byte goes in the buffer
+
+        m = Module()
+        m.submodules.buf_w = buf_w = buf.write_port()
+        m.submodules.buf_r = buf_r = buf.read_port(transparent=False)
+
+        def reply(ok):
+            m.d.sync += [
+                self.ack_out.o_valid.eq(True),
+                self.ack_out.o_data.eq(Mux(ok, ACK, NAK) | seq),
+            ]
+
+        def abandon_if_idle():
+            # NAK the partial frame and drop its bytes.
+            with m.If(idle_cnt[-1] & ~self.ack_out.full()):
+                reply(False)
+                m.d.sync += w_ptr.eq(commit)
+                m.next = 'SYNC'
+
+        m.d.comb += [
+            used.eq(w_ptr - r_ptr),
+            self.serial_in.o_ready.eq(
+                ~(storing & (used == depth)) & ~self.ack_out.full()
+            ),
+        ]
+        with m.If(write_out.sent()):
+            m.d.sync += [
+                write_out.o_valid.eq(False),
+            ]
+        with m.If(self.ack_out.sent()):
+            m.d.sync += [
+                self.ack_out.o_valid.eq(False),
+            ]
+        m.d.sync += self.crc_err.eq(False)
+
+        # Send good bytes.  A word takes a clock to read, so they go
+        # out every other clock.  That is still far faster than they
+        # arrive.
+        m.d.comb += buf_r.addr.eq(r_ptr)
+        with m.If(fetched):
+            m.d.sync += [
+                payload.eq(buf_r.data),
+                write_out.o_valid.eq(True),
+                fetched.eq(False),
+            ]
+        with m.Elif((r_ptr != commit) & (~write_out.o_valid
+                                         | write_out.i_ready)):
+            m.d.sync += [
+                fetched.eq(True),
+                r_ptr.eq(r_ptr + 1),
+            ]
+
+        with m.If(self.serial_in.received()):
+            m.d.sync += [
+                crc.eq(_crc16_next(crc, i_data)),
+                idle_cnt.eq(idle_max),
+            ]
+        with m.Elif(~idle_cnt[-1]):
+            m.d.sync += [
+                idle_cnt.eq(idle_cnt - 1),
+            ]
+
+        with m.FSM():
+
+            with m.State('SYNC'):
+                m.d.sync += crc.eq(CRC_INIT)
+                with m.If(self.serial_in.received()):
+                    with m.If(i_data == FRAME_MAGIC):
+                        m.next = 'SEQ'
+
+            with m.State('SEQ'):
+                # Too soon to NAK: there is no sequence number yet.
+                with m.If(idle_cnt[-1]):
+                    m.next = 'SYNC'
+                with m.If(self.serial_in.received()):
+                    m.d.sync += seq.eq(i_data)
+                    m.next = 'TABLE'
+
+            with m.State('TABLE'):
+                abandon_if_idle()
+                with m.If(self.serial_in.received()):
+                    m.d.sync += table.eq(i_data)
+                    m.next = 'ADDR_LO'
+
+            with m.State('ADDR_LO'):
+                abandon_if_idle()
+                with m.If(self.serial_in.received()):
+                    m.d.sync += addr[:8].eq(i_data)
+                    m.next = 'ADDR_HI'
+
+            with m.State('ADDR_HI'):
+                abandon_if_idle()
+                with m.If(self.serial_in.received()):
+                    m.d.sync += addr[8:].eq(i_data)
+                    m.next = 'COUNT_LO'
+
+            with m.State('COUNT_LO'):
+                abandon_if_idle()
+                with m.If(self.serial_in.received()):
+                    m.d.sync += count[:8].eq(i_data)
+                    m.next = 'COUNT_HI'
+
+            with m.State('COUNT_HI'):
+                abandon_if_idle()
+                with m.If(self.serial_in.received()):
+                    last = Cat(count[:8], i_data)   # data bytes - 1
+                    fits = Const(1)
+                    if self.tables is not None:
+                        end = addr + last           # 17 bits
+                        fits = Const(0)
+                        for (number, size) in self.tables.items():
+                            fits |= (table == number) & (end < size)
+                    m.d.sync += [
+                        count[8:].eq(i_data),
+                        drop.eq((last >= depth) | ~fits),
+                        first.eq(True),
+                    ]
+                    m.next = 'DATA'
+
+            with m.State('DATA'):
+                abandon_if_idle()
+                # A dropped frame is read, but not kept.
+                m.d.comb += storing.eq(~drop)
+                with m.If(self.serial_in.received()):
+                    fields = {
+                        'data': Cat(table, addr, i_data),
+                        'start': first,
+                        'stop': count == 0,
+                    }
+                    m.d.comb += [
+                        buf_w.addr.eq(w_ptr),
+                        buf_w.data.eq(Cat(*(
+                            fields[desc.name]
+                            for desc in bulk_write_spec.payload_signals
+                        ))),
+                        buf_w.en.eq(~drop),
+                    ]
+                    m.d.sync += [
+                        addr.eq(addr + 1),
+                        count.eq(count - 1),
+                        first.eq(False),
+                    ]
+                    with m.If(~drop):
+                        m.d.sync += w_ptr.eq(w_ptr + 1)
+                    with m.If(count == 0):
+                        m.next = 'CRC_HI'
+
+            with m.State('CRC_HI'):
+                abandon_if_idle()
+                with m.If(self.serial_in.received()):
+                    m.next = 'CRC_LO'
+
+            with m.State('CRC_LO'):
+                abandon_if_idle()
+                # With the received CRC included, the CRC is zero.
+                with m.If(self.serial_in.received()):
+                    crc_ok = _crc16_next(crc, i_data) == 0
+                    ok = crc_ok & ~drop
+                    reply(ok)
+                    m.d.sync += self.crc_err.eq(~crc_ok)
+                    with m.If(ok):
+                        m.d.sync += commit.eq(w_ptr)
+                    with m.Else():
+                        m.d.sync += w_ptr.eq(commit)
+                    m.next = 'SYNC'
+
+        return m
+
+
+class ControlPort(Elaboratable):
+
+    """High speed serial port for bulk table loading.
+
+       Bundles a UART receiver, a BulkLoader, and a UART transmitter
+       for the loader's ACK/NAK replies.  `baud` should divide
+       `clk_freq` exactly or nearly so.  `depth` is the longest
+       frame, in data bytes.  `tables` is passed to the BulkLoader.
+    """
+
+    def __init__(self, clk_freq, baud=3_000_000, timeout=0.01, depth=256,
+                 tables=None):
+        divisor = int(clk_freq // baud)
+        assert abs(clk_freq / divisor / baud - 1) < 0.02, (
+            f'ControlPort: baud = {baud:,} is too far from '
+            f'clk_freq / {divisor} = {clk_freq / divisor:,}'
+        )
+        self.divisor = divisor
+        self.loader = BulkLoader(timeout=int(timeout * clk_freq),
+                                 depth=depth, tables=tables)
+
+        self.rx_pin = Signal(reset=1)
+        self.tx_pin = Signal()
+        self.write_out = self.loader.write_out
+        self.crc_err = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.rx = rx = P_UARTRx(divisor=self.divisor)
+        m.submodules.tx = tx = P_UARTTx(divisor=self.divisor, data_bits=8)
+        m.submodules.loader = loader = self.loader
+        m.d.comb += [
+            loader.serial_in.flow_from(rx.rx_out),
+            loader.ack_out.flow_to(tx.tx_in),
+            rx.rx_pin.eq(self.rx_pin),
+            self.tx_pin.eq(tx.tx_pin),
+            self.crc_err.eq(loader.crc_err),
+        ]
+        return m
+
+
+if __name__ == '__main__':
+    design = BulkLoader(timeout=50, depth=8,
+                        tables={0: 0x18, 3: 0x1239, 0xFF: 0x10000})
+    design.serial_in.leave_unconnected()
+    design.write_out.leave_unconnected()
+    design.ack_out.leave_unconnected()
+
+    # Workaround nMigen issue #280
+    m = Module()
+    m.submodules.design = design
+    i_valid = Signal()
+    i_data = Signal(8)
+    w_ready = Signal()
+    m.d.comb += [
+        design.serial_in.i_valid.eq(i_valid),
+        design.serial_in.i_data.eq(i_data),
+        design.write_out.i_ready.eq(w_ready),
+        design.ack_out.i_ready.eq(True),
+    ]
+
+    good0 = bulk_frame(0, 3, 0x1234, b'\x00\x01\xFE\xFF\xA5')
+    bad = bytearray(bulk_frame(1, 1, 0, b'spam'))
+    bad[-3] ^= 0x40
+    bad_table = bytearray(bulk_frame(2, 1, 0, b'ham'))
+    bad_table[3] ^= 0x01
+    good1 = bulk_frame(3, 0xFF, 0xFFFF, b'\x5A')
+    truncated = bulk_frame(4, 2, 0, b'eggs')[:-4]
+    too_long = bulk_frame(5, 0, 0, bytes(range(9)))
+    good2 = bulk_frame(6, 0, 0x10, bytes(range(8)))     # fills table 0
+    no_table = bulk_frame(7, 9, 0, b'bacon')
+    past_end = bulk_frame(8, 0, 0x11, bytes(range(8)))
+    good3 = bulk_frame(9, 3, 0, b'ok')
+    # (frame, expected reply); None is a pause.
+    stream = [
+        (good0, ACK | 0),
+        (b'\x00\x55', None),
+        (bad, NAK | 1),
+        (truncated, None),
+        (None, NAK | 4),
+        (good1, ACK | 3),
+        (bad_table, NAK | 2),
+        (too_long, NAK | 5),
+        (good2, ACK | 6),
+        (no_table, NAK | 7),
+        (past_end, NAK | 8),
+        (good3, ACK | 9),
+    ]
+
+    def writes(frame):
+        table, addr = frame[2], frame[3] | frame[4] << 8
+        data = frame[7:-2]
+        return [
+            (table, addr + i, b, i == 0, i == len(data) - 1)
+            for (i, b) in enumerate(data)
+        ]
+    # Only good frames are written, and only after their CRC.
+    expected_writes = [
+        (w, k) for (k, f) in enumerate((good0, good1, good2, good3))
+        for w in writes(f)
+    ]
+    expected_acks = [ack for (frame, ack) in stream if ack is not None]
+    frames_done = [0]               # good frames fully received
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+        @sim.sync_process
+        def byte_source():
+            for (frame, ack) in stream:
+                if frame is None:
+                    yield from delay(60)      # let the loader time out
+                    continue
+                for (i, b) in enumerate(frame):
+                    yield i_data.eq(b)
+                    yield i_valid.eq(True)
+                    yield Settle()
+                    n = 0
+                    while not (yield design.serial_in.received()):
+                        yield
+                        yield Settle()
+                        n += 1
+                        assert n < 1_000, 'stuck'
+                    yield
+                    yield i_valid.eq(False)
+                    yield from delay(i % 3)
+                if ack is not None and ack & ACK:
+                    frames_done[0] += 1
+            yield from delay(60)
+            assert not expected_writes, f'missing writes {expected_writes}'
+            assert not expected_acks, f'missing acks {expected_acks}'
+
+        @sim.sync_process
+        def write_sink():
+            yield Passive()
+            n = 0
+            while True:
+                # Stall now and then.
+                yield w_ready.eq(n % 5 != 2)
+                yield Settle()
+                if (yield design.write_out.sent()):
+                    actual = (
+                        (yield design.write_out.o_data.table),
+                        (yield design.write_out.o_data.addr),
+                        (yield design.write_out.o_data.data),
+                        bool((yield design.write_out.o_start)),
+                        bool((yield design.write_out.o_stop)),
+                    )
+                    assert expected_writes, f'unexpected write {actual}'
+                    (expected, k) = expected_writes.pop(0)
+                    assert actual == expected, (
+                        f'expected write {expected}, got {actual}'
+                    )
+                    assert k < frames_done[0], (
+                        f'write {actual} before its CRC'
+                    )
+                yield
+                n += 1
+
+        @sim.sync_process
+        def ack_sink():
+            yield Passive()
+            while True:
+                yield
+                if (yield design.ack_out.o_valid):
+                    actual = yield design.ack_out.o_data
+                    assert expected_acks, f'unexpected ack {actual:#x}'
+                    expected = expected_acks.pop(0)
+                    assert actual == expected, (
+                        f'expected ack {expected:#x}, got {actual:#x}'
+                    )
@@ -0,0 +1,410 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Array, Const, Elaboratable, Module, Mux, Signal, signed
+from nmigen.back.pysim import Settle
+
+from nmigen_lib.pipe import PipeFIFO, PipeSpec
+from nmigen_lib.util import Main, delay
+
+
+def mac_request_spec(a_shape=signed(16), b_shape=signed(16),
+                     accumulate=False):
+    """A multiply request.  The product is a * b.
+
+       With `accumulate`, the request also has `acc`.  If `acc` is
+       set, the product is added to the user's last result.
+    """
+    fields = [
+        ('a', a_shape),
+        ('b', b_shape),
+    ]
+    if accumulate:
+        fields.append(('acc', 1))
+    return PipeSpec(tuple(fields))
+
+def mac_result_spec(width=32):
+    return PipeSpec(signed(width))
+
+
+class SharedMultiplier(Elaboratable):
+
+    """Share one multiplier-accumulator (one SB_MAC16) among several
+       users.
+
+       Each user has a pipe to send requests and a pipe to receive
+       products.  Users take turns by a static schedule.  `schedule`
+       is a list of user numbers, one per clock, and it repeats
+       forever.  By default, each user gets every `users`th clock.
+       A request is granted only in its user's slots, so each user's
+       timing is the same no matter what the others do.
+
+       Each user may have up to `latency` products in flight, so a
+       user that owns every slot gets a product every clock but one
+       in `latency + 1`.  A product comes out `latency` = 3 clocks
+       after the request is granted: operand registers, multiplier
+       output register, result FIFO.  Each product is tagged with its
+       user on the way down the pipeline, and waits in that user's
+       FIFO, `latency` deep, until the user takes it.
+
+       With `accumulate`, requests have an `acc` bit (see
+       `mac_request_spec`) and each user has an accumulator.  A
+       request with `acc` set adds its product to the user's last
+       result, so a user can sum a dot product one term per grant.
+       Every request still returns a result: the running sum.
+       `guard_bits` widens the results so the sum does not overflow.
+
+       Sharing is opt-in.  Only `EnvelopeBank` takes a
+       SharedMultiplier.  `VCA`, `Mixer` (two), `SVFilter`,
+       `Interpolator` and `Decimator` each still have their own
+       multiplier, and `describe()` only counts this one.
+
+       `busy_clocks` is the number of clocks the multiplier was used
+       during the last sample period.  `describe()` prints the static
+       schedule and each user's maximum rate.
+    """
+
+    def __init__(self, clk_freq, sample_rate, users, schedule=None,
+                 a_shape=signed(16), b_shape=signed(16),
+                 accumulate=False, guard_bits=0):
+        if schedule is None:
+            schedule = list(range(users))
+        assert sorted(set(schedule)) == list(range(users)), (
+            f'SharedMultiplier: schedule {schedule} must give each of '
+            f'{users} users a slot'
+        )
+        assert accumulate or not guard_bits, (
+            'SharedMultiplier: guard_bits needs accumulate'
+        )
+        self.clk_freq = clk_freq
+        self.sample_rate = sample_rate
+        self.users = users
+        self.schedule = list(schedule)
+        self.period = int(clk_freq // sample_rate)
+        self.latency = 3
+        self.a_shape = a_shape
+        self.b_shape = b_shape
+        self.accumulate = accumulate
+        self.product_width = len(Signal(a_shape)) + len(Signal(b_shape))
+        self.result_width = self.product_width + guard_bits
+
+        request_spec = mac_request_spec(a_shape, b_shape, accumulate)
+        result_spec = mac_result_spec(self.result_width)
+        self.requests = [request_spec.outlet() for _ in range(users)]
+        self._fifos = [
+            PipeFIFO(result_spec, depth=self.latency) for _ in range(users)
+        ]
+        for fifo in self._fifos:
+            fifo.fifo_in.leave_unconnected()    # driven by the pipeline
+        self.results = [fifo.fifo_out for fifo in self._fifos]
+        self.busy_clocks = Signal(range(self.period + 1))
+
+    def max_products(self):
+        """Most products each user can get in one sample period."""
+        # A grant's place is free again one clock after its result
+        # leaves, so a user gets at most `latency` grants in any
+        # latency + 1 clocks.
+        counts = [0] * self.users
+        in_flight = [[] for _ in range(self.users)]     # free clocks
+        for clock in range(self.period):
+            user = self.schedule[clock % len(self.schedule)]
+            flight = [c for c in in_flight[user] if c > clock]
+            if len(flight) < self.latency:
+                counts[user] += 1
+                flight.append(clock + self.latency + 1)
+            in_flight[user] = flight
+        return counts
+
+    def utilization(self):
+        """Largest fraction of clocks the multiplier can be busy."""
+        return sum(self.max_products()) / self.period
+
+    def describe(self):
+        print(f'SharedMultiplier:')
+        print(f'    period    = {self.period:,} clocks')
+        print(f'    schedule  = {self.schedule}')
+        print(f'    latency   = {self.latency}')
+        print(f'    results   = {self.result_width} bits'
+              f'{", accumulated" if self.accumulate else ""}')
+        for (user, count) in enumerate(self.max_products()):
+            slots = self.schedule.count(user)
+            print(f'    user {user:<4} = {slots} slots, '
+                  f'{count:,} products/sample')
+        print(f'    max utilization = {self.utilization():.1%}')
+        print()
+
+    def elaborate(self, platform):
+        n_slots = len(self.schedule)
+
+        m = Module()
+        m.submodules += self._fifos
+
+        # `slot` steps through the schedule.
+        slot = Signal(range(n_slots))
+        owner = Signal(range(self.users))
+        m.d.sync += slot.eq(slot + 1)
+        with m.If(slot == n_slots - 1):
+            m.d.sync += slot.eq(0)
+        m.d.comb += owner.eq(Array(Const(u) for u in self.schedule)[slot])
+
+        # Grant a request in its owner's slot if the owner has room
+        # for another product.  `ready` only depends on registers.
+        # `in_flight` counts products granted and not yet taken, so
+        # the owner's FIFO never overflows.
+        in_flight = [Signal(range(self.latency + 1), name=f'in_flight{u}')
+                     for u in range(self.users)]
+        room = Signal(self.users)
+        grant = Signal()
+        for (u, (req, res)) in enumerate(zip(self.requests, self.results)):
+            m.d.comb += [
+                room[u].eq(in_flight[u] != self.latency),
+                req.o_ready.eq((owner == u) & room[u]),
+            ]
+            m.d.sync += in_flight[u].eq(
+                in_flight[u] + req.received() - res.sent()
+            )
+        m.d.comb += grant.eq(
+            Array(req.i_valid for req in self.requests)[owner]
+            & room.bit_select(owner, 1)
+        )
+
+        # Stage 1: operand registers.
+        a = Signal(self.a_shape)
+        b = Signal(self.b_shape)
+        valid1 = Signal()
+        acc1 = Signal()
+        user1 = Signal.like(owner)
+        m.d.sync += [
+            valid1.eq(grant),
+            user1.eq(owner),
+            a.eq(Array(req.i_data.a for req in self.requests)[owner]),
+            b.eq(Array(req.i_data.b for req in self.requests)[owner]),
+        ]
+        if self.accumulate:
+            m.d.sync += acc1.eq(
+                Array(req.i_data.acc for req in self.requests)[owner]
+            )
+
+        # Stage 2: multiply.
+        prod = Signal(signed(self.product_width))
+        valid2 = Signal()
+        acc2 = Signal()
+        user2 = Signal.like(owner)
+        m.d.sync += [
+            valid2.eq(valid1),
+            acc2.eq(acc1),
+            user2.eq(user1),
+            prod.eq(a * b),
+        ]
+
+        # Stage 3: add the user's last result if asked, and queue
+        # the result for the user.
+        result = Signal(signed(self.result_width))
+        if self.accumulate:
+            sums = Array(Signal(signed(self.result_width), name=f'sum{u}')
+                         for u in range(self.users))
+            m.d.comb += result.eq(prod + Mux(acc2, sums[user2], 0))
+            with m.If(valid2):
+                m.d.sync += sums[user2].eq(result)
+        else:
+            m.d.comb += result.eq(prod)
+        for (u, fifo) in enumerate(self._fifos):
+            m.d.comb += [
+                fifo.fifo_in.i_valid.eq(valid2 & (user2 == u)),
+                fifo.fifo_in.i_data.eq(result),
+            ]
+
+        # Count busy clocks each sample period.
+        period_max = self.period - 2
+        period_cnt = Signal(range(-1, period_max + 1), reset=period_max)
+        busy_cnt = Signal.like(self.busy_clocks)
+        with m.If(period_cnt[-1]):
+            m.d.sync += [
+                period_cnt.eq(period_max),
+                self.busy_clocks.eq(busy_cnt + grant),
+                busy_cnt.eq(0),
+            ]
+        with m.Else():
+            m.d.sync += [
+                period_cnt.eq(period_cnt - 1),
+                busy_cnt.eq(busy_cnt + grant),
+            ]
+
+        return m
+
+
+if __name__ == '__main__':
+    design = SharedMultiplier(1_000_000, 20_000, users=3,
+                              schedule=[0, 1, 0, 2])
+    design.describe()
+    # User 0 owns every other clock, so it can use all its slots.
+    assert design.max_products() == [25, 13, 12]
+    for end in design.requests + design.results:
+        end.leave_unconnected()
+
+    # Two users sum dot products on an accumulating multiplier.
+    dot = SharedMultiplier(1_000_000, 20_000, users=2,
+                           accumulate=True, guard_bits=4)
+    for end in dot.requests + dot.results:
+        end.leave_unconnected()
+
+    # Work around nMigen issue #280
+    m = Module()
+    m.submodules.design = design
+    m.submodules.dot = dot
+    i_valid = [Signal(name=f'i_valid{u}') for u in range(3)]
+    i_a = [Signal(signed(16), name=f'i_a{u}') for u in range(3)]
+    i_b = [Signal(signed(16), name=f'i_b{u}') for u in range(3)]
+    i_ready = [Signal(name=f'i_ready{u}') for u in range(3)]
+    for u in range(3):
+        m.d.comb += [
+            design.requests[u].i_valid.eq(i_valid[u]),
+            design.requests[u].i_data.a.eq(i_a[u]),
+            design.requests[u].i_data.b.eq(i_b[u]),
+            design.results[u].i_ready.eq(i_ready[u]),
+        ]
+
+    # User 0 is greedy, user 1 is slow to take results, and user 2
+    # only wants a few products.
+    operands = [
+        [(i * 1234 - 20000, 32767 - i * 999) for i in range(40)],
+        [(-32768, -32768), (-32768, 32767)] + [(i, -i) for i in range(20)],
+        [(7, 11), (-3, 5), (100, 100)],
+    ]
+    expected = [[a * b for (a, b) in ops] for ops in operands]
+    grant_clocks = [[] for _ in range(3)]
+
+    dot_ports = [
+        {
+            'valid': Signal(name=f'dot_valid{u}'),
+            'a': Signal(signed(16), name=f'dot_a{u}'),
+            'b': Signal(signed(16), name=f'dot_b{u}'),
+            'acc': Signal(name=f'dot_acc{u}'),
+        }
+        for u in range(2)
+    ]
+    for (u, p) in enumerate(dot_ports):
+        m.d.comb += [
+            dot.requests[u].i_valid.eq(p['valid']),
+            dot.requests[u].i_data.a.eq(p['a']),
+            dot.requests[u].i_data.b.eq(p['b']),
+            dot.requests[u].i_data.acc.eq(p['acc']),
+            dot.results[u].i_ready.eq(True),
+        ]
+
+    # Each term is (a, b, acc).  The full scale terms need the
+    # guard bits.
+    dot_terms = [
+        [(-32768, -32768, i != 0) for i in range(10)]
+        + [(3, 4, False), (5, 6, True), (-7, 8, True)],
+        [(i * 2500, 1000 - i * 500, i % 4 != 0) for i in range(12)],
+    ]
+    dot_expected = []
+    for terms in dot_terms:
+        sums = []
+        for (a, b, acc) in terms:
+            sums.append(a * b + (sums[-1] if acc else 0))
+        dot_expected.append(sums)
+    assert max(dot_expected[0]) >= 2**31, 'test needs the guard bits'
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+
+        def requester(u):
+            def process():
+                clock = 1           # sync processes start at clock 1
+                for (a, b) in operands[u]:
+                    yield i_a[u].eq(a)
+                    yield i_b[u].eq(b)
+                    yield i_valid[u].eq(True)
+                    yield Settle()
+                    while not (yield design.requests[u].received()):
+                        yield
+                        yield Settle()
+                        clock += 1
+                    sched = design.schedule
+                    assert sched[clock % len(sched)] == u, (
+                        f'user {u} granted in slot {clock % len(sched)}'
+                    )
+                    grant_clocks[u].append(clock)
+                    yield
+                    clock += 1
+                    yield i_valid[u].eq(False)
+                    if u == 2:
+                        yield from delay(30)
+                        clock += 30
+            return process
+
+        def receiver(u):
+            def process():
+                n = 0
+                while expected[u]:
+                    yield i_ready[u].eq(u != 1 or n % 5 == 4)
+                    yield Settle()
+                    n += 1
+                    if (yield design.results[u].sent()):
+                        actual = yield design.results[u].o_data
+                        exp = expected[u].pop(0)
+                        assert actual == exp, (
+                            f'user {u}: expected {exp}, got {actual}'
+                        )
+                    yield
+            return process
+
+        @sim.sync_process
+        def check_busy_clocks():
+            # busy_clocks counts the grants in the first period.
+            yield from delay(design.period + 1)
+            busy = yield design.busy_clocks
+            first = [[c for c in clocks if c < design.period]
+                     for clocks in grant_clocks]
+            n_first = sum(len(f) for f in first)
+            assert busy == n_first, f'busy {busy}, granted {n_first}'
+            assert busy <= sum(design.max_products())
+            # User 0 always has a request and takes its products at
+            # once, so it has several in flight and gets every slot
+            # from its first request on.
+            gaps = {b - a for (a, b) in zip(first[0], first[0][1:])}
+            assert gaps == {2}, first[0]
+
+        def dot_requester(u):
+            def process():
+                p = dot_ports[u]
+                for (a, b, acc) in dot_terms[u]:
+                    yield p['a'].eq(a)
+                    yield p['b'].eq(b)
+                    yield p['acc'].eq(acc)
+                    yield p['valid'].eq(True)
+                    yield Settle()
+                    while not (yield dot.requests[u].received()):
+                        yield
+                        yield Settle()
+                    yield
+                    if u == 0:
+                        # Idle slots must not touch the sum.
+                        yield p['valid'].eq(False)
+                        yield from delay(5)
+                yield p['valid'].eq(False)
+            return process
+
+        def dot_receiver(u):
+            def process():
+                n = 0
+                while dot_expected[u]:
+                    assert n < 1_000, f'dot user {u} stuck'
+                    n += 1
+                    yield Settle()
+                    if (yield dot.results[u].sent()):
+                        actual = yield dot.results[u].o_data
+                        exp = dot_expected[u].pop(0)
+                        assert actual == exp, (
+                            f'dot user {u}: expected {exp}, got {actual}'
+                        )
+                    yield
+            return process
+
+        for u in range(3):
+            sim.sync_process(requester(u))
+            sim.sync_process(receiver(u))
+        for u in range(2):
+            sim.sync_process(dot_requester(u))
+            sim.sync_process(dot_receiver(u))
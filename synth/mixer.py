@@ -0,0 +1,329 @@
+#!/usr/bin/env nmigen
+
+from math import ceil, cos, log2, pi, sin
+
+from nmigen import Elaboratable, Memory, Module, Mux, Signal
+from nmigen import signed, unsigned
+from nmigen.back.pysim import Settle
+
+from nmigen_lib.pipe import PipeSpec, START_STOP
+from nmigen_lib.util import Main
+
+from synth.i2s import stereo_sample_spec
+
+
+COEFF_WIDTH = 16
+PAN_BITS = 8
+
+def voice_sample_spec(width=16):
+    """Time-multiplexed voice samples.  `start` marks voice 0."""
+    return PipeSpec(signed(width), flags=START_STOP)
+
+def mix_control_spec(voices):
+    """Set one voice's gain and pan.  Pan 0 is left, 255 is right."""
+    return PipeSpec((
+        ('voice', unsigned(max(1, (voices - 1).bit_length()))),
+        ('gain', unsigned(16)),
+        ('pan', unsigned(PAN_BITS)),
+    ))
+
+
+def pan_table():
+    """Constant power pan law, as (left, right) pairs."""
+    n = 2**PAN_BITS
+    full = 2**(COEFF_WIDTH - 1) - 1
+    return [
+        (round(full * cos(pi / 2 * i / (n - 1))),
+         round(full * sin(pi / 2 * i / (n - 1))))
+        for i in range(n)
+    ]
+
+
+def pan_coeffs(gain, pan):
+    """Bit-exact model of a voice's (left, right) coefficients."""
+    return tuple(g * (gain >> 1) >> (COEFF_WIDTH - 1)
+                 for g in pan_table()[pan])
+
+
+class Mixer(Elaboratable):
+
+    """Mix `voices` voices down to stereo.
+
+       Voice samples arrive on `samples_in`, time-multiplexed:
+       voice 0 with `start` set, then 1, 2, ...  A frame ends after
+       `voices` samples or at a sample with `stop` set.  For each
+       frame, one stereo sample is sent out `samples_out`.
+
+       Each voice has a gain and a pan, set through `control_in`.
+       They are kept as a pair of left and right coefficients in RAM.
+       Initially, every voice is at full gain, panned center.
+
+       Each sample is multiplied by its voice's coefficients and
+       summed into wide accumulators, so the sum never overflows.
+       The sums are shifted right by `headroom` bits and saturate
+       to the output width.
+
+       Two multipliers.  One voice sample per clock.  A control
+       message takes one sample's clock.
+    """
+
+    def __init__(self, voices, sample_width=16, out_width=16, headroom=0):
+        self.voices = voices
+        self.sample_width = sample_width
+        self.out_width = out_width
+        self.headroom = headroom
+        self.acc_width = (sample_width + COEFF_WIDTH
+                          + ceil(log2(max(voices, 2))))
+        self.shift = COEFF_WIDTH - 1 + headroom + sample_width - out_width
+        assert sample_width <= 16, 'Mixer: samples must fit in SB_MAC16'
+
+        self.samples_in = voice_sample_spec(sample_width).outlet()
+        self.control_in = mix_control_spec(voices).outlet()
+        self.samples_out = stereo_sample_spec(out_width).inlet()
+
+    def elaborate(self, platform):
+        s_in = self.samples_in
+        ctl = self.control_in
+        s_out = self.samples_out
+        voices = self.voices
+        width = self.sample_width
+
+        m = Module()
+
+        # Coefficient RAMs.
+        center = pan_coeffs(0xFFFF, 2**(PAN_BITS - 1))
+        coeff_RAMs = [
+            Memory(width=COEFF_WIDTH, depth=voices, init=[c] * voices)
+            for c in center
+        ]
+        pan_ROMs = [
+            Memory(width=COEFF_WIDTH, depth=2**PAN_BITS,
+                   init=[p[i] for p in pan_table()])
+            for i in range(2)
+        ]
+        cr_ports = [ram.read_port() for ram in coeff_RAMs]
+        cw_ports = [ram.write_port() for ram in coeff_RAMs]
+        pr_ports = [rom.read_port() for rom in pan_ROMs]
+        m.submodules += cr_ports + cw_ports + pr_ports
+
+        # The whole pipeline moves when the output is free.
+        advance = Signal()
+        m.d.comb += advance.eq(~s_out.o_valid | s_out.i_ready)
+
+        # Stage 0: accept a sample or a control message.  Control
+        # messages go first.
+        voice = Signal(range(voices))
+        in_voice = Signal.like(voice)
+        in_last = Signal()
+        m.d.comb += [
+            ctl.o_ready.eq(advance),
+            s_in.o_ready.eq(advance & ~ctl.i_valid),
+            in_voice.eq(Mux(s_in.i_start, 0, voice)),
+            in_last.eq(s_in.i_stop | (in_voice == voices - 1)),
+        ]
+        with m.If(s_in.received()):
+            m.d.sync += voice.eq(Mux(in_last, 0, in_voice + 1))
+
+        # Stage 1: multiply.  RAM addresses are held while stalled.
+        valid1 = Signal()
+        is_ctl1 = Signal()
+        voice1 = Signal.like(voice)
+        first1 = Signal()
+        last1 = Signal()
+        sample1 = Signal(signed(width))
+        gain1 = Signal(16)
+        pan1 = Signal(PAN_BITS)
+        with m.If(advance):
+            m.d.sync += [
+                valid1.eq(s_in.received() | ctl.received()),
+                is_ctl1.eq(ctl.i_valid),
+                voice1.eq(Mux(ctl.i_valid, ctl.i_data.voice, in_voice)),
+                first1.eq(in_voice == 0),
+                last1.eq(in_last),
+                sample1.eq(s_in.i_data),
+                gain1.eq(ctl.i_data.gain),
+                pan1.eq(ctl.i_data.pan),
+            ]
+        for port in cr_ports:
+            m.d.comb += port.addr.eq(Mux(advance, in_voice, voice1))
+        for port in pr_ports:
+            m.d.comb += port.addr.eq(Mux(advance, ctl.i_data.pan, pan1))
+
+        a = Signal(signed(COEFF_WIDTH))
+        prods = [Signal(signed(width + COEFF_WIDTH), name=f'prod_{lr}')
+                 for lr in 'lr']
+        valid2 = Signal()
+        is_ctl2 = Signal()
+        voice2 = Signal.like(voice)
+        first2 = Signal()
+        last2 = Signal()
+        # A control message writes its voice's coefficients a clock
+        # after a following sample reads them.  So a sample right after
+        # a control for the same voice takes them from stage 2.
+        forward = Signal()
+        m.d.comb += [
+            a.eq(Mux(is_ctl1, gain1[1:], sample1)),
+            forward.eq(valid2 & is_ctl2 & (voice2 == voice1)),
+        ]
+        with m.If(advance):
+            m.d.sync += [
+                valid2.eq(valid1),
+                is_ctl2.eq(is_ctl1),
+                voice2.eq(voice1),
+                first2.eq(first1),
+                last2.eq(last1),
+            ]
+            for (prod, cr, pr) in zip(prods, cr_ports, pr_ports):
+                new = prod[COEFF_WIDTH - 1:2 * COEFF_WIDTH - 1]
+                coeff = Mux(forward, new, cr.data)
+                b = Mux(is_ctl1, pr.data, coeff).as_signed()
+                m.d.sync += prod.eq(a * b)
+
+        # Stage 2: accumulate, or store new coefficients.
+        accs = [Signal(signed(self.acc_width), name=f'acc_{lr}')
+                for lr in 'lr']
+        done3 = Signal()
+        for (cw, prod) in zip(cw_ports, prods):
+            m.d.comb += [
+                cw.addr.eq(voice2),
+                cw.data.eq(prod[COEFF_WIDTH - 1:]),
+                cw.en.eq(advance & valid2 & is_ctl2),
+            ]
+        with m.If(advance):
+            m.d.sync += done3.eq(valid2 & ~is_ctl2 & last2)
+            with m.If(valid2 & ~is_ctl2):
+                for (acc, prod) in zip(accs, prods):
+                    m.d.sync += acc.eq(Mux(first2, prod, acc + prod))
+
+        # Stage 3: saturate and send.
+        hi = 2**(self.out_width - 1) - 1
+        lo = -2**(self.out_width - 1)
+        with m.If(advance & done3):
+            for (acc, out) in zip(accs, (s_out.o_data.left,
+                                         s_out.o_data.right)):
+                scaled = acc >> self.shift
+                m.d.sync += out.eq(
+                    Mux(scaled > hi, hi, Mux(scaled < lo, lo, scaled))
+                )
+            m.d.sync += s_out.o_valid.eq(True)
+        with m.Elif(s_out.sent()):
+            m.d.sync += s_out.o_valid.eq(False)
+
+        return m
+
+
+if __name__ == '__main__':
+    voices = 4
+    design = Mixer(voices)
+    design.samples_in.leave_unconnected()
+    design.control_in.leave_unconnected()
+    design.samples_out.leave_unconnected()
+
+    # Work around nMigen issue #280
+    m = Module()
+    m.submodules.design = design
+    i_valid = Signal()
+    i_data = Signal(signed(16))
+    i_start = Signal()
+    i_stop = Signal()
+    c_valid = Signal()
+    c_voice = Signal(2)
+    c_gain = Signal(16)
+    c_pan = Signal(8)
+    o_ready = Signal()
+    m.d.comb += [
+        design.samples_in.i_valid.eq(i_valid),
+        design.samples_in.i_data.eq(i_data),
+        design.samples_in.i_start.eq(i_start),
+        design.samples_in.i_stop.eq(i_stop),
+        design.control_in.i_valid.eq(c_valid),
+        design.control_in.i_data.voice.eq(c_voice),
+        design.control_in.i_data.gain.eq(c_gain),
+        design.control_in.i_data.pan.eq(c_pan),
+        design.samples_out.i_ready.eq(o_ready),
+    ]
+
+    # A script of frames and control messages.  Frames are lists of
+    # voice samples.  Controls are (voice, gain, pan).
+    script = [
+        [1000, -2000, 3000, -4000],
+        [32767, 32767, 32767, 32767],           # saturates
+        (0, 0xFFFF, 0),                         # hard left
+        (1, 0x8000, 255),                       # half, hard right
+        [10000, 10000, -5000, 7],
+        (3, 0, 128),                            # muted
+        [-32768, -32768, -32768, -32768],       # saturates negative
+        [123, 456],                             # short frame: stop
+        (2, 0x4000, 64),
+        [i * 1111 - 20000 for i in range(4)],
+        (0, 0x6000, 200),                       # then voice 0 at once
+        [5000, -6000, 7000, 8000],
+    ] + [[(f * 37 + v * 5003) % 65536 - 32768 for v in range(voices)]
+         for f in range(6)]
+
+    def expected_outputs():
+        coeffs = [pan_coeffs(0xFFFF, 128)] * voices
+        hi, lo = 32767, -32768
+        for item in script:
+            if isinstance(item, tuple):
+                (v, gain, pan) = item
+                coeffs[v] = pan_coeffs(gain, pan)
+            else:
+                out = []
+                for lr in range(2):
+                    acc = sum(s * coeffs[v][lr] for (v, s) in enumerate(item))
+                    out.append(min(hi, max(lo, acc >> design.shift)))
+                yield tuple(out)
+    expected = list(expected_outputs())
+    n_samples = sum(len(f) for f in script if isinstance(f, list))
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+
+        @sim.sync_process
+        def source():
+            for item in script:
+                if isinstance(item, tuple):
+                    yield c_voice.eq(item[0])
+                    yield c_gain.eq(item[1])
+                    yield c_pan.eq(item[2])
+                    yield c_valid.eq(True)
+                    yield Settle()
+                    while not (yield design.control_in.received()):
+                        yield
+                        yield Settle()
+                    yield
+                    yield c_valid.eq(False)
+                    continue
+                for (v, sample) in enumerate(item):
+                    yield i_data.eq(sample)
+                    yield i_start.eq(v == 0)
+                    yield i_stop.eq(v == len(item) - 1)
+                    yield i_valid.eq(True)
+                    yield Settle()
+                    while not (yield design.samples_in.received()):
+                        yield
+                        yield Settle()
+                    yield
+                yield i_valid.eq(False)
+
+        @sim.sync_process
+        def sink():
+            clock = 0
+            n_controls = sum(isinstance(item, tuple) for item in script)
+            while expected:
+                # Stall once in a while, but not enough to slow the input.
+                yield o_ready.eq(clock % 5 != 2)
+                yield Settle()
+                if (yield design.samples_out.sent()):
+                    actual = (
+                        (yield design.samples_out.o_data.left),
+                        (yield design.samples_out.o_data.right),
+                    )
+                    exp = expected.pop(0)
+                    assert actual == exp, f'expected {exp}, got {actual}'
+                yield
+                clock += 1
+            # One sample or control per clock, plus pipeline latency.
+            budget = n_samples + 2 * n_controls + 5
+            assert clock <= budget, f'took {clock} clocks, budget {budget}'
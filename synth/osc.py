@@ -7,10 +7,11 @@ from nmigen import Array, Cat, Const, Elaboratable, Module, Mux, Signal
 from nmigen import signed, unsigned
 from nmigen.back.pysim import Passive
 
-from nmigen_lib.pipe import PipeSpec
+from nmigen_lib.pipe import PipeSpec, StageTiming
 from nmigen_lib.util import Main, delay
 
 from synth.config import SynthConfig
+from synth.loader import bulk_write_spec
 from synth.priority import voice_note_spec
 from synth.util import MIDI_note_to_freq
 
@@ -41,6 +42,12 @@ def mul12(n):
 
 assert all(mul12(n) == 12 * n for n in range(OCTAVES))
 
+# The tuning table holds each step's 16 bit base increment, low byte
+# first, so step k is at bytes 2k and 2k + 1.  Load it with the
+# control port.
+TUNING_TABLE = 0
+TUNING_BYTES = 2 * STEPS
+
 
 class FSM(Enum):
     START    = auto()
@@ -57,7 +64,19 @@ class Oscillator(Elaboratable):
 
     def __init__(self, config):
         self.divisor = config.osc_divisor
+        # The FSM takes seven clocks per sample, START through EMIT.
+        # But the phase increments are for the oscillator rate, so
+        # it must not run faster than one sample per `divisor` clocks.
+        self.pipe_timing = StageTiming(
+            interval=max(7, self.divisor),
+            latency=7,
+            ratio=0,
+        )
         self._calc_params(config)
+        assert self.inc_depth <= 16, (
+            f'Oscillator: {self.inc_depth} bit increments do not fit '
+            f'the tuning table'
+        )
 
         self.sync_in = Signal()
         # self.note_in = Signal(range(MIDI_NOTES))
@@ -67,6 +86,7 @@ class Oscillator(Elaboratable):
         self.note_in = voice_note_spec.outlet()
         self.pulse_out = mono_sample_spec(config.osc_depth).inlet()
         self.saw_out = mono_sample_spec(config.osc_depth).inlet()
+        self.tune_in = bulk_write_spec.outlet()     # table is ignored
 
     def _calc_params(self, config):
 
@@ -156,6 +176,20 @@ class Oscillator(Elaboratable):
         saw_sample = Signal.like(self.saw_out.o_data)
 
         m = Module()
+
+        # A step's increment changes when its high byte is written.
+        tune = self.tune_in
+        tune_addr = tune.i_data.addr
+        tune_lo = Signal(8)
+        m.d.comb += tune.o_ready.eq(True)
+        with m.If(tune.received()):
+            with m.If(~tune_addr[0]):
+                m.d.sync += tune_lo.eq(tune.i_data.data)
+            with m.Elif(tune_addr < TUNING_BYTES):
+                m.d.sync += step_incs[tune_addr[1:]].eq(
+                    Cat(tune_lo, tune.i_data.data)
+                )
+
         with m.If(self.sync_in):
             m.d.sync += [
                 phase.eq(0),
@@ -267,6 +301,7 @@ if __name__ == '__main__':
     design.note_in.leave_unconnected()
     design.pulse_out.leave_unconnected()
     design.saw_out.leave_unconnected()
+    design.tune_in.leave_unconnected()
 
     with Main(design).sim as sim:
         @sim.sync_process
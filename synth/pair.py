@@ -1,9 +1,9 @@
 #!/usr/bin/env nmigen
 
 from nmigen import Elaboratable, Module
-from nmigen.asserts import Assume
 from nmigen.back.pysim import Delay
 
+from nmigen_lib.pipe import Zip
 from nmigen_lib.util import Main
 
 from .i2s import stereo_sample_spec
@@ -12,22 +12,25 @@ from .osc import mono_sample_spec
 
 class ChannelPair(Elaboratable):
 
+    """Join left and right mono samples into stereo samples.
+
+       A Zip: a stereo sample goes out when both a left and a right
+       sample are valid.
+    """
+
     def __init__(self, sample_width):
-        self.left_in = mono_sample_spec(sample_width).outlet()
-        self.right_in = mono_sample_spec(sample_width).outlet()
-        self.stereo_out = stereo_sample_spec(sample_width).inlet()
+        self._zip = Zip((
+            ('left', mono_sample_spec(sample_width)),
+            ('right', mono_sample_spec(sample_width)),
+        ))
+        assert self._zip.out_spec == stereo_sample_spec(sample_width)
+        self.left_in = self._zip.left_in
+        self.right_in = self._zip.right_in
+        self.stereo_out = self._zip.data_out
 
     def elaborate(self, platform):
         m = Module()
-        m.d.comb += [
-            # Assume(self.left_in.i_valid == self.right_in.i_valid),
-            self.stereo_out.o_valid.eq(self.left_in.i_valid),
-            self.stereo_out.o_data.left.eq(self.left_in.i_data),
-            self.stereo_out.o_data.right.eq(self.right_in.i_data),
-            self.left_in.o_ready.eq(self.stereo_out.i_ready),
-            self.right_in.o_ready.eq(self.stereo_out.i_ready),
-        ]
-        m.d.sync += []
+        m.submodules.zip = self._zip
         return m
 
 
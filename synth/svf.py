@@ -0,0 +1,389 @@
+#!/usr/bin/env nmigen
+
+from math import pi, sin
+
+import numpy as np
+
+from nmigen import Cat, Elaboratable, Memory, Module, Mux, Signal
+from nmigen import signed, unsigned
+from nmigen.back.pysim import Settle
+
+from nmigen_lib.pipe import PipeSpec
+from nmigen_lib.util import Main
+
+from synth.mixer import voice_sample_spec
+
+
+# The Chamberlin state variable filter.  See
+# http://www.earlevel.com/main/2003/03/02/the-digital-state-variable-filter/
+# and experiments/self-osc.c.
+#
+#     low  += f * band
+#     high  = in - low - q * band
+#     band += f * high
+#
+# f = 2 sin(pi Fc / Fs) is Q1.15, and must be under 1.0 (Fc < Fs / 6).
+# q = 1 / Q is Q2.14.  q = 0 self-oscillates.
+#
+# The state has FRAC_BITS fraction bits below the sample's LSB and
+# HEADROOM bits above its MSB, and it saturates.  The multiplier only
+# sees the state's top 16 bits.
+
+F_FRAC = 15
+Q_FRAC = 14
+FRAC_BITS = 6
+HEADROOM = 2
+MODES = ('low', 'band', 'high', 'notch')
+
+
+def svf_control_spec(voices):
+    """Set one voice's f and q coefficients."""
+    return PipeSpec((
+        ('voice', unsigned(max(1, (voices - 1).bit_length()))),
+        ('f', unsigned(F_FRAC)),
+        ('q', unsigned(15)),
+    ))
+
+
+def svf_coeffs(cutoff, Q, sample_rate):
+    """Integer (f, q) for a cutoff frequency and resonance."""
+    f = round(2 * sin(pi * cutoff / sample_rate) * 2**F_FRAC)
+    q = round(2**Q_FRAC / Q)
+    assert 0 < f < 2**F_FRAC, f'SVF: cutoff {cutoff:,} Hz is too high'
+    assert 0 <= q < 2**15, f'SVF: Q = {Q} is too low'
+    return (f, q)
+
+
+def svf_model(f, q, samples, mode='low', sample_width=16):
+    """Bit-exact NumPy model of an SVFilter bank.
+
+       `f` and `q` have one coefficient per voice, and `samples` has
+       one row per sample period and one column per voice.  Returns
+       the output samples in the same layout.
+    """
+    f = np.asarray(f, dtype=np.int64)
+    q = np.asarray(q, dtype=np.int64)
+    x = np.asarray(samples, dtype=np.int64)
+    width = sample_width + FRAC_BITS + HEADROOM
+    s_max = 2**(width - 1) - 1
+    s_min = -2**(width - 1)
+    o_max = 2**(sample_width - 1) - 1
+    o_min = -2**(sample_width - 1)
+    m_shift = width - 16
+    low = np.zeros(x.shape[1], dtype=np.int64)
+    band = np.zeros(x.shape[1], dtype=np.int64)
+    out = np.empty_like(x)
+    for (n, xn) in enumerate(x):
+        p = f * (band >> m_shift)
+        low = np.clip(low + (p >> (F_FRAC - m_shift)), s_min, s_max)
+        p = q * (band >> m_shift)
+        high = (xn << FRAC_BITS) - low - (p >> (Q_FRAC - m_shift))
+        high = np.clip(high, s_min, s_max)
+        p = f * (high >> m_shift)
+        band = np.clip(band + (p >> (F_FRAC - m_shift)), s_min, s_max)
+        y = {
+            'low': low,
+            'band': band,
+            'high': high,
+            'notch': np.clip(low + high, s_min, s_max),
+        }[mode]
+        out[n] = np.clip(y >> FRAC_BITS, o_min, o_max)
+    return out
+
+
+class SVFilter(Elaboratable):
+
+    """A bank of state variable filters, one per voice.
+
+       Voice samples arrive on `samples_in` and leave on
+       `samples_out`, time-multiplexed with `start` on voice 0, as
+       for `Mixer`.  Each voice's f and q are set through
+       `control_in`; see `svf_coeffs`.  The filter's `mode` is one
+       of 'low', 'band', 'high' or 'notch'.
+
+       One multiplier does the filter's three multiplications, one
+       after another.  Each sample takes six clocks.  The voices'
+       state and coefficients are kept in RAM.  `svf_model` is a
+       bit-exact model.
+    """
+
+    def __init__(self, voices, sample_width=16, mode='low',
+                 f=2**F_FRAC // 4, q=2**Q_FRAC):
+        assert mode in MODES, f'SVF: mode must be one of {MODES}'
+        assert sample_width <= 16
+        self.voices = voices
+        self.sample_width = sample_width
+        self.mode = mode
+        self.init_f = f
+        self.init_q = q
+        self.state_width = sample_width + FRAC_BITS + HEADROOM
+
+        self.samples_in = voice_sample_spec(sample_width).outlet()
+        self.control_in = svf_control_spec(voices).outlet()
+        self.samples_out = voice_sample_spec(sample_width).inlet()
+
+    def elaborate(self, platform):
+        s_in = self.samples_in
+        s_out = self.samples_out
+        ctl = self.control_in
+        voices = self.voices
+        width = self.state_width
+        m_shift = width - 16
+        s_max = 2**(width - 1) - 1
+        s_min = -2**(width - 1)
+
+        def saturate(value, lo=s_min, hi=s_max):
+            return Mux(value > hi, hi, Mux(value < lo, lo, value))
+
+        m = Module()
+
+        state_RAM = Memory(width=2 * width, depth=voices)
+        coeff_RAM = Memory(width=2 * 15, depth=voices,
+                           init=[self.init_q << 15 | self.init_f] * voices)
+        m.submodules.sr_port = sr_port = state_RAM.read_port()
+        m.submodules.sw_port = sw_port = state_RAM.write_port()
+        m.submodules.cr_port = cr_port = coeff_RAM.read_port()
+        m.submodules.cw_port = cw_port = coeff_RAM.write_port()
+        m.d.comb += [
+            ctl.o_ready.eq(True),
+            cw_port.addr.eq(ctl.i_data.voice),
+            cw_port.data.eq(Cat(ctl.i_data.f, ctl.i_data.q)),
+            cw_port.en.eq(ctl.received()),
+        ]
+
+        # The multiplier.  Its operands are chosen by the FSM state,
+        # and `prod` is its output register.  By default, it
+        # calculates f * high.
+        mul_a = Signal(signed(16))
+        mul_b = Signal(signed(16))
+        prod = Signal(signed(32))
+        m.d.sync += prod.eq(mul_a * mul_b)
+
+        # Sample framing.
+        voice = Signal(range(voices))
+        next_voice = Signal.like(voice)
+        in_voice = Signal.like(voice)
+        x = Signal(signed(self.sample_width))
+        start = Signal()
+        stop = Signal()
+        m.d.comb += [
+            in_voice.eq(Mux(s_in.i_start, 0, next_voice)),
+            sr_port.addr.eq(in_voice),
+            cr_port.addr.eq(in_voice),
+            sw_port.addr.eq(voice),
+        ]
+
+        # Filter state.
+        f = Signal(signed(16))
+        q = Signal(signed(16))
+        low = Signal(signed(width))
+        band = Signal(signed(width))
+        high = Signal(signed(width))
+        new_band = Signal(signed(width))
+        m.d.comb += [
+            new_band.eq(saturate(band + (prod >> (F_FRAC - m_shift)))),
+            mul_a.eq(f),
+            mul_b.eq(high >> m_shift),
+        ]
+
+        y = {
+            'low': low,
+            'band': new_band,
+            'high': high,
+            'notch': saturate(low + high),
+        }[self.mode]
+        o_max = 2**(self.sample_width - 1) - 1
+        o_min = -2**(self.sample_width - 1)
+
+        with m.FSM():
+
+            with m.State('IDLE'):
+                m.d.comb += s_in.o_ready.eq(True)
+                with m.If(s_in.received()):
+                    m.d.sync += [
+                        x.eq(s_in.i_data),
+                        start.eq(s_in.i_start),
+                        stop.eq(s_in.i_stop),
+                        voice.eq(in_voice),
+                        next_voice.eq(
+                            Mux(in_voice == voices - 1, 0, in_voice + 1)
+                        ),
+                    ]
+                    m.next = 'LOW'
+
+            with m.State('LOW'):
+                # RAM data is ready.  Start f * band.
+                band_in = sr_port.data[width:].as_signed()
+                f_in = cr_port.data[:15]
+                m.d.comb += [
+                    mul_a.eq(f_in),
+                    mul_b.eq(band_in >> m_shift),
+                ]
+                m.d.sync += [
+                    low.eq(sr_port.data[:width]),
+                    band.eq(band_in),
+                    f.eq(f_in),
+                    q.eq(cr_port.data[15:]),
+                ]
+                m.next = 'Q_BAND'
+
+            with m.State('Q_BAND'):
+                m.d.comb += [
+                    mul_a.eq(q),
+                    mul_b.eq(band >> m_shift),
+                ]
+                m.d.sync += [
+                    low.eq(saturate(low + (prod >> (F_FRAC - m_shift)))),
+                ]
+                m.next = 'HIGH'
+
+            with m.State('HIGH'):
+                m.d.sync += high.eq(saturate(
+                    (x << FRAC_BITS) - low - (prod >> (Q_FRAC - m_shift))
+                ))
+                m.next = 'F_HIGH'
+
+            with m.State('F_HIGH'):
+                m.next = 'BAND'
+
+            with m.State('BAND'):
+                with m.If(~s_out.full()):
+                    m.d.comb += [
+                        sw_port.data.eq(Cat(low, new_band)),
+                        sw_port.en.eq(True),
+                    ]
+                    m.d.sync += [
+                        s_out.o_valid.eq(True),
+                        s_out.o_data.eq(saturate(y >> FRAC_BITS,
+                                                 o_min, o_max)),
+                        s_out.o_start.eq(start),
+                        s_out.o_stop.eq(stop),
+                    ]
+                    m.next = 'IDLE'
+
+        with m.If(s_out.sent()):
+            m.d.sync += s_out.o_valid.eq(False)
+
+        return m
+
+
+if __name__ == '__main__':
+    Fs = 46875
+    voices = 3
+    coeffs = [
+        svf_coeffs(1000, 0.707, Fs),
+        svf_coeffs(5000, 20, Fs),
+        (2**F_FRAC // 4, 2**Q_FRAC),            # the default
+    ]
+    f = [c[0] for c in coeffs]
+    q = [c[1] for c in coeffs]
+
+    # Offline: high resonance rings down, and q = 0 self-oscillates
+    # without blowing up.
+    impulse = np.zeros((20_000, 1), dtype=np.int64)
+    impulse[0] = 32767
+    for (Q, decays) in ((100, True), (None, False)):
+        (fi, qi) = svf_coeffs(2000, Q or 1, Fs)
+        qi = qi if Q else 0
+        y = svf_model([fi], [qi], impulse, mode='band')[:, 0]
+        early = np.abs(y[:1000]).max()
+        late = np.abs(y[-1000:]).max()
+        assert early > 1000, f'Q = {Q}: no ring'
+        assert (late < early / 100) == decays, (
+            f'Q = {Q}: early {early}, late {late}'
+        )
+
+    # Square waves with different periods, one per voice.
+    n = 120
+    samples = [[20000 if (i // (5 + 3 * v)) % 2 else -20000
+                for v in range(voices)]
+               for i in range(n)]
+
+    designs = [SVFilter(voices, mode=mode) for mode in MODES]
+    expected = [svf_model(f, q, samples, mode=mode).tolist()
+                for mode in MODES]
+
+    # Work around nMigen issue #280
+    m = Module()
+    ports = []
+    for (i, design) in enumerate(designs):
+        design.samples_in.leave_unconnected()
+        design.control_in.leave_unconnected()
+        design.samples_out.leave_unconnected()
+        m.submodules[design.mode] = design
+        p = {
+            name: Signal(shape, name=f'{design.mode}_{name}')
+            for (name, shape) in (
+                ('i_valid', 1), ('i_data', signed(16)), ('i_start', 1),
+                ('i_stop', 1), ('c_valid', 1), ('c_voice', 2),
+                ('c_f', 15), ('c_q', 15), ('o_ready', 1),
+            )
+        }
+        m.d.comb += [
+            design.samples_in.i_valid.eq(p['i_valid']),
+            design.samples_in.i_data.eq(p['i_data']),
+            design.samples_in.i_start.eq(p['i_start']),
+            design.samples_in.i_stop.eq(p['i_stop']),
+            design.control_in.i_valid.eq(p['c_valid']),
+            design.control_in.i_data.voice.eq(p['c_voice']),
+            design.control_in.i_data.f.eq(p['c_f']),
+            design.control_in.i_data.q.eq(p['c_q']),
+            design.samples_out.i_ready.eq(p['o_ready']),
+        ]
+        ports.append(p)
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+
+        def source(design, p):
+            def process():
+                # Voice 2 keeps the default coefficients.
+                for (v, (fv, qv)) in enumerate(coeffs[:2]):
+                    yield p['c_voice'].eq(v)
+                    yield p['c_f'].eq(fv)
+                    yield p['c_q'].eq(qv)
+                    yield p['c_valid'].eq(True)
+                    yield
+                yield p['c_valid'].eq(False)
+                for frame in samples:
+                    for (v, x) in enumerate(frame):
+                        yield p['i_data'].eq(x)
+                        yield p['i_start'].eq(v == 0)
+                        yield p['i_stop'].eq(v == voices - 1)
+                        yield p['i_valid'].eq(True)
+                        yield Settle()
+                        while not (yield design.samples_in.received()):
+                            yield
+                            yield Settle()
+                        yield
+                    yield p['i_valid'].eq(False)
+            return process
+
+        def sink(design, p, expected):
+            def process():
+                clock = 0
+                for (i, frame) in enumerate(expected):
+                    for (v, exp) in enumerate(frame):
+                        while True:
+                            yield p['o_ready'].eq(clock % 11 != 4)
+                            yield Settle()
+                            clock += 1
+                            if (yield design.samples_out.sent()):
+                                break
+                            yield
+                        actual = (
+                            (yield design.samples_out.o_data),
+                            (yield design.samples_out.o_start),
+                            (yield design.samples_out.o_stop),
+                        )
+                        exp = (exp, v == 0, v == voices - 1)
+                        assert actual == exp, (
+                            f'{design.mode} sample {i} voice {v}: '
+                            f'expected {exp}, got {actual}'
+                        )
+                        yield
+            return process
+
+        for (design, p, exp) in zip(designs, ports, expected):
+            sim.sync_process(source(design, p))
+            sim.sync_process(sink(design, p, exp))
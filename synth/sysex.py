@@ -0,0 +1,279 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Cat, Elaboratable, Module, Signal
+from nmigen.back.pysim import Passive, Settle
+
+from nmigen_lib.pipe import PipeSpec, START_STOP
+from nmigen_lib.util import Main, delay
+
+
+SYSEX_START = 0xF0
+SYSEX_END = 0xF7
+NON_COMMERCIAL_ID = 0x7D    # MIDI ID reserved for non-commercial use
+
+sysex_data_spec = PipeSpec(8, flags=START_STOP)
+
+
+def sysex_pack(payload, manufacturer_id=NON_COMMERCIAL_ID):
+    """Pack 8 bit payload bytes into a complete SysEx message.
+
+       Each group of up to seven payload bytes is preceded by one
+       byte holding their MSBs, first byte's MSB in bit 0.
+    """
+    msg = [SYSEX_START, manufacturer_id]
+    for i in range(0, len(payload), 7):
+        group = payload[i:i + 7]
+        msg.append(sum((b >> 7) << j for (j, b) in enumerate(group)))
+        msg.extend(b & 0x7F for b in group)
+    msg.append(SYSEX_END)
+    return msg
+
+
+class SysExDecoder(Elaboratable):
+
+    """Extract bulk data from MIDI System Exclusive messages.
+
+       SysEx data addressed to `manufacturer_id` is unpacked from
+       7 bit MIDI bytes into 8 bit words (see `sysex_pack`) and sent
+       out `sysex_out`.  The first word of a message is flagged with
+       `start` and the last with `stop`.
+
+       Every other byte, including the SysEx start and end status
+       bytes, passes through to `serial_out`.  So this module goes
+       in front of a MIDIDecoder, and the decoder still sees running
+       status cancelled by SysEx.
+
+       Any status byte except a real-time one (0xF8-0xFF) ends a
+       SysEx message, as if 0xF7 had come first.  Real-time bytes may
+       come in the middle of a message.
+    """
+
+    def __init__(self, manufacturer_id=NON_COMMERCIAL_ID):
+        self.manufacturer_id = manufacturer_id
+        self.serial_in = PipeSpec(8).outlet()
+        self.serial_out = PipeSpec(8).inlet()
+        self.sysex_out = sysex_data_spec.inlet()
+
+    def elaborate(self, platform):
+        i_data = self.serial_in.i_data
+        o_sysex = self.sysex_out
+
+        msbs = Signal(7)            # MSBs of current group
+        group_index = Signal(3)     # 0 means next byte is MSBs
+        word = Signal(8)            # unpacked from current byte
+        ends_sysex = Signal()       # status, not real-time
+        pending = Signal(8)         # held until we know if it's last
+        pending_valid = Signal()
+        first = Signal()            # no word sent yet in this message
+
+        def emit_pending(stop):
+            return [
+                o_sysex.o_valid.eq(True),
+                o_sysex.o_data.eq(pending),
+                o_sysex.o_start.eq(first),
+                o_sysex.o_stop.eq(stop),
+                first.eq(False),
+            ]
+
+        def pass_through():
+            return [
+                self.serial_out.o_valid.eq(True),
+                self.serial_out.o_data.eq(i_data),
+            ]
+
+        m = Module()
+        m.d.comb += [
+            self.serial_in.o_ready.eq(
+                ~self.sysex_out.full() & ~self.serial_out.full()
+            ),
+            word.eq(Cat(i_data[:7], msbs[0])),
+            ends_sysex.eq(i_data[7] & (i_data[3:8] != 0b11111)),
+        ]
+        with m.If(self.serial_out.sent()):
+            m.d.sync += [
+                self.serial_out.o_valid.eq(False),
+            ]
+        with m.If(self.sysex_out.sent()):
+            m.d.sync += [
+                o_sysex.o_valid.eq(False),
+            ]
+
+        with m.FSM():
+
+            with m.State('IDLE'):
+                with m.If(self.serial_in.received()):
+                    m.d.sync += pass_through()
+                    with m.If(i_data == SYSEX_START):
+                        m.next = 'ID'
+
+            with m.State('ID'):
+                with m.If(self.serial_in.received()):
+                    with m.If(i_data[7]):
+                        m.d.sync += pass_through()
+                        with m.If(ends_sysex):
+                            m.next = 'IDLE'
+                            with m.If(i_data == SYSEX_START):
+                                m.next = 'ID'
+                    with m.Elif(i_data == self.manufacturer_id):
+                        m.d.sync += [
+                            group_index.eq(0),
+                            pending_valid.eq(False),
+                            first.eq(True),
+                        ]
+                        m.next = 'DATA'
+                    with m.Else():
+                        m.next = 'SKIP'
+
+            with m.State('DATA'):
+                with m.If(self.serial_in.received()):
+                    with m.If(i_data[7]):
+                        m.d.sync += pass_through()
+                        with m.If(ends_sysex):
+                            with m.If(pending_valid):
+                                m.d.sync += emit_pending(stop=True)
+                            m.d.sync += pending_valid.eq(False)
+                            m.next = 'IDLE'
+                            with m.If(i_data == SYSEX_START):
+                                m.next = 'ID'
+                        # else real-time message interleaved with SysEx.
+                    with m.Elif(group_index == 0):
+                        m.d.sync += [
+                            msbs.eq(i_data),
+                            group_index.eq(1),
+                        ]
+                    with m.Else():
+                        with m.If(pending_valid):
+                            m.d.sync += emit_pending(stop=False)
+                        m.d.sync += [
+                            pending.eq(word),
+                            pending_valid.eq(True),
+                            msbs.eq(msbs[1:]),
+                            group_index.eq(group_index + 1),
+                        ]
+
+            with m.State('SKIP'):
+                with m.If(self.serial_in.received() & i_data[7]):
+                    m.d.sync += pass_through()
+                    with m.If(ends_sysex):
+                        m.next = 'IDLE'
+                        with m.If(i_data == SYSEX_START):
+                            m.next = 'ID'
+
+        return m
+
+
+if __name__ == '__main__':
+    design = SysExDecoder()
+    design.serial_in.leave_unconnected()
+    design.serial_out.leave_unconnected()
+    design.sysex_out.leave_unconnected()
+
+    # Workaround nMigen issue #280
+    m = Module()
+    m.submodules.design = design
+    i_valid = Signal()
+    i_data = Signal(8)
+    i_serial_ready = Signal()
+    i_sysex_ready = Signal()
+    m.d.comb += [
+        design.serial_in.i_valid.eq(i_valid),
+        design.serial_in.i_data.eq(i_data),
+        design.serial_out.i_ready.eq(i_serial_ready),
+        design.sysex_out.i_ready.eq(i_sysex_ready),
+    ]
+
+    payload = [0x00, 0x81, 0x7F, 0xFF, 0x12, 0x34, 0x56, 0x78, 0x9A]
+    other_sysex = [SYSEX_START, 0x41, 0x10, 0x42, SYSEX_END]
+    note_on = [0x93, 60, 64]
+    data = (
+        note_on
+        + other_sysex
+        + sysex_pack(payload[:4])
+        + sysex_pack(payload)
+        + note_on
+    )
+    data.insert(-8, 0xF8)           # real-time messages interrupt SysEx.
+    data.insert(-6, 0xFE)
+    expected_serial = [
+        b
+        for b in data
+        if b not in other_sysex[1:-1]
+        and not (b < 0x80 and b not in note_on)
+    ]
+    expected_sysex = [
+        (b, i == 0, i == len(payload[:4]) - 1)
+        for (i, b) in enumerate(payload[:4])
+    ] + [
+        (b, i == 0, i == len(payload) - 1)
+        for (i, b) in enumerate(payload)
+    ]
+
+    # A channel message ends SysEx wherever it comes, and its data
+    # bytes get through.  (bytes, serial bytes expected) for each.
+    cut_dump = sysex_pack([0x11, 0x92, 0x33])[:5]   # stops after 0x92
+    interrupted = [
+        ([SYSEX_START, 0x90, 61, 100],                      # in ID
+         [SYSEX_START, 0x90, 61, 100]),
+        ([SYSEX_START, 0x41, 0x10, 0x80, 61, 0],            # in SKIP
+         [SYSEX_START, 0x80, 61, 0]),
+        (cut_dump + [0x93, 62, 64],                         # in DATA
+         [SYSEX_START, 0x93, 62, 64]),
+        ([SYSEX_START, 0x41] + sysex_pack([0x55]),          # new SysEx
+         [SYSEX_START, SYSEX_START, SYSEX_END]),
+        (note_on, note_on),
+    ]
+    for (sent, passed) in interrupted:
+        data += sent
+        expected_serial += passed
+    expected_sysex += [(0x11, True, False), (0x92, False, True)]
+    expected_sysex += [(0x55, True, True)]
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+        @sim.sync_process
+        def data_source():
+            for (i, d) in enumerate(data):
+                yield i_data.eq(d)
+                yield i_valid.eq(True)
+                yield
+                while not (yield design.serial_in.o_ready):
+                    yield
+                yield i_valid.eq(False)
+                yield from delay(i % 2)
+            yield from delay(10)
+            assert not expected_serial, f'missing bytes {expected_serial}'
+            assert not expected_sysex, f'missing words {expected_sysex}'
+
+        @sim.sync_process
+        def serial_sink():
+            yield Passive()
+            yield i_serial_ready.eq(True)
+            while True:
+                yield
+                if (yield design.serial_out.o_valid):
+                    actual = yield design.serial_out.o_data
+                    expected = expected_serial.pop(0)
+                    assert actual == expected, (
+                        f'serial: expected {expected:#x}, got {actual:#x}'
+                    )
+
+        @sim.sync_process
+        def sysex_sink():
+            yield Passive()
+            n = 0
+            while True:
+                # Exercise back pressure.
+                yield i_sysex_ready.eq(n % 3 != 0)
+                yield Settle()
+                n += 1
+                if (yield design.sysex_out.sent()):
+                    actual = (
+                        (yield design.sysex_out.o_data),
+                        bool((yield design.sysex_out.o_start)),
+                        bool((yield design.sysex_out.o_stop)),
+                    )
+                    expected = expected_sysex.pop(0)
+                    assert actual == expected, (
+                        f'sysex: expected {expected}, got {actual}'
+                    )
+                yield
@@ -0,0 +1,211 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Elaboratable, Module, Mux, Signal, signed
+from nmigen.back.pysim import Settle
+
+from nmigen_lib.pipe import PipeSpec, START_STOP
+from nmigen_lib.util import Main
+
+from synth.i2s import I2STxRecord
+
+
+def tdm_sample_spec(width=16):
+    """Interleaved samples, one per slot.  `start` marks slot 0."""
+    return PipeSpec(signed(width), flags=START_STOP)
+
+
+class TDMTx(Elaboratable):
+
+    """TDM transmit side.  Send `slots` channels on one data line.
+
+       Uses the same four pins as I2STx.  `lrck` is the frame sync:
+       it is high for the first bit of each frame, the MSB of slot 0.
+       (This is the "DSP mode B" or left-justified TDM format.)  Data
+       changes on the falling edge of `sck`.
+
+       Slots are exactly `tx_depth` bits wide, so SCK runs at
+       tx_rate * slots * tx_depth, with no padding bits.  MCLK is
+       `mclk_ratio` * tx_rate.  Both must divide clk_freq into an
+       even number of clocks.
+
+       Samples arrive interleaved on `sample_outlet`, slot 0 first.
+       A sample with `start` set waits for slot 0, so the channels
+       stay aligned even if the source drops a sample.  Slots with no
+       sample ready are sent as zero.
+    """
+
+    def __init__(self, clk_freq, tx_rate, slots, tx_depth=16, mclk_ratio=256):
+        assert 4 <= slots <= 16, f'TDMTx: slots = {slots} must be 4 to 16.'
+        sck_freq = tx_rate * slots * tx_depth
+        mclk_freq = tx_rate * mclk_ratio
+        for (name, freq) in (('sck', sck_freq), ('mclk', mclk_freq)):
+            divisor = clk_freq / freq
+            assert divisor >= 2 and divisor % 2 == 0, (
+                f'TDMTx: 2 * {name}_freq = {2 * freq:,} must divide '
+                f'clk_freq = {clk_freq:,}'
+            )
+        self.clk_freq = clk_freq
+        self.tx_rate = tx_rate
+        self.slots = slots
+        self.tx_depth = tx_depth
+        self.sck_divisor = int(clk_freq // sck_freq)
+        self.mclk_divisor = int(clk_freq // mclk_freq)
+
+        self.sample_outlet = tdm_sample_spec(tx_depth).outlet()
+        self.tx_tdm = I2STxRecord()
+        self.underrun = Signal()
+
+    def elaborate(self, platform):
+        outlet = self.sample_outlet
+        tx_tdm = self.tx_tdm
+        depth = self.tx_depth
+
+        next_sample = Signal(signed(depth))
+        next_start = Signal()
+        next_valid = Signal()
+        shift = Signal(depth)
+
+        m = Module()
+
+        # Hold one sample until its slot comes around.
+        m.d.comb += outlet.o_ready.eq(~next_valid)
+        with m.If(outlet.received()):
+            m.d.sync += [
+                next_sample.eq(outlet.i_data),
+                next_start.eq(outlet.i_start),
+                next_valid.eq(True),
+            ]
+
+        # `mclk_cnt` underflows twice per MCLK period.
+        mclk_max = self.mclk_divisor // 2 - 2
+        mclk_cnt = Signal(range(-1, mclk_max + 1))
+        with m.If(mclk_cnt[-1]):
+            m.d.sync += [
+                mclk_cnt.eq(mclk_max),
+                tx_tdm.mclk.eq(~tx_tdm.mclk),
+            ]
+        with m.Else():
+            m.d.sync += mclk_cnt.eq(mclk_cnt - 1)
+
+        # `sck_cnt` underflows twice per SCK period.  `bit_cnt`
+        # underflows at the end of each slot, and `slot` counts slots.
+        sck_max = self.sck_divisor // 2 - 2
+        sck_cnt = Signal(range(-1, sck_max + 1))
+        bit_max = depth - 2
+        bit_cnt = Signal(range(-1, bit_max + 1), reset=-1)
+        slot = Signal(range(self.slots), reset=self.slots - 1)
+        next_slot = Signal.like(slot)
+        m.d.comb += next_slot.eq(Mux(slot == self.slots - 1, 0, slot + 1))
+
+        m.d.sync += self.underrun.eq(False)
+        with m.If(sck_cnt[-1]):
+            m.d.sync += [
+                sck_cnt.eq(sck_max),
+                tx_tdm.sck.eq(~tx_tdm.sck),
+            ]
+            with m.If(tx_tdm.sck):
+                # Falling edge: send next bit.
+                with m.If(bit_cnt[-1]):
+                    m.d.sync += [
+                        bit_cnt.eq(bit_max),
+                        slot.eq(next_slot),
+                        tx_tdm.lrck.eq(next_slot == 0),
+                    ]
+                    take = next_valid & (~next_start | (next_slot == 0))
+                    with m.If(take):
+                        m.d.sync += [
+                            tx_tdm.sd.eq(next_sample[-1]),
+                            shift.eq(next_sample << 1),
+                            next_valid.eq(False),
+                        ]
+                    with m.Else():
+                        m.d.sync += [
+                            tx_tdm.sd.eq(0),
+                            shift.eq(0),
+                            self.underrun.eq(True),
+                        ]
+                with m.Else():
+                    m.d.sync += [
+                        bit_cnt.eq(bit_cnt - 1),
+                        tx_tdm.lrck.eq(False),
+                        tx_tdm.sd.eq(shift[-1]),
+                        shift.eq(shift << 1),
+                    ]
+        with m.Else():
+            m.d.sync += sck_cnt.eq(sck_cnt - 1)
+
+        return m
+
+
+if __name__ == '__main__':
+    slots = 4
+    depth = 16
+    design = TDMTx(4_096_000, 8_000, slots=slots, tx_depth=depth)
+    design.sample_outlet.leave_unconnected()
+
+    # Work around nMigen issue #280
+    m = Module()
+    m.submodules.design = design
+    i_valid = Signal()
+    i_data = Signal(signed(depth))
+    i_start = Signal()
+    m.d.comb += [
+        design.sample_outlet.i_valid.eq(i_valid),
+        design.sample_outlet.i_data.eq(i_data),
+        design.sample_outlet.i_start.eq(i_start),
+    ]
+
+    # Two stray samples, then five aligned frames.
+    frames = [[(f + 1) * 1000 - s * 4321 for s in range(slots)]
+              for f in range(5)]
+    stream = [(111, False), (-222, False)] + [
+        (sample, s == 0)
+        for frame in frames
+        for (s, sample) in enumerate(frame)
+    ]
+    expected = [[111, -222, 0, 0]] + frames
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+        sim.add_clock(1 / design.clk_freq, domain='sync')
+
+        @sim.sync_process
+        def source():
+            for (sample, start) in stream:
+                yield i_data.eq(sample)
+                yield i_start.eq(start)
+                yield i_valid.eq(True)
+                yield Settle()
+                while not (yield design.sample_outlet.received()):
+                    yield
+                    yield Settle()
+                yield
+                yield i_valid.eq(False)
+
+        @sim.sync_process
+        def sink():
+            # Sample SD on rising SCK edges.  Start a frame at LRCK.
+            tdm = design.tx_tdm
+            prev_sck = 0
+            bits = None
+            while expected:
+                yield
+                sck = yield tdm.sck
+                if sck and not prev_sck:
+                    if (yield tdm.lrck):
+                        assert bits is None or len(bits) == slots * depth, (
+                            f'frame has {len(bits)} bits'
+                        )
+                        bits = []
+                    if bits is not None:
+                        bits.append((yield tdm.sd))
+                    if bits is not None and len(bits) == slots * depth:
+                        actual = []
+                        for s in range(slots):
+                            word = bits[s * depth:(s + 1) * depth]
+                            value = int(''.join(map(str, word)), 2)
+                            value -= (value >> depth - 1) << depth
+                            actual.append(value)
+                        exp = expected.pop(0)
+                        assert actual == exp, f'expected {exp}, got {actual}'
+                prev_sck = sck
@@ -0,0 +1,390 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Cat, Elaboratable, Memory, Module, Mux, Shape, Signal
+from nmigen import signed, unsigned
+from nmigen.back.pysim import Settle
+
+from nmigen_lib.pipe import PipeSpec
+from nmigen_lib.util import Main, delay
+
+from synth.priority import voice_gate_spec
+
+
+LEVEL_WIDTH = 16
+
+def voice_level_spec(voices=1):
+    """Set one voice's level.  0xFFFF is full scale."""
+    return PipeSpec((
+        ('voice', unsigned(max(1, (voices - 1).bit_length()))),
+        ('level', unsigned(LEVEL_WIDTH)),
+    ))
+
+
+class GateToLevel(Elaboratable):
+
+    """Convert gate and velocity to a level for the VCA.
+
+       Velocity 127 is full scale.  Gate off is zero.
+    """
+
+    def __init__(self, voices=1):
+        self.gate_outlet = voice_gate_spec.outlet()
+        self.level_inlet = voice_level_spec(voices).inlet()
+
+    def elaborate(self, platform):
+        gate = self.gate_outlet.i_data.gate
+        velocity = self.gate_outlet.i_data.velocity
+
+        m = Module()
+        m.d.comb += [
+            self.gate_outlet.o_ready.eq(~self.level_inlet.full()),
+        ]
+        with m.If(self.gate_outlet.received()):
+            # Replicate velocity's bits to fill the level.
+            m.d.sync += [
+                self.level_inlet.o_valid.eq(True),
+                self.level_inlet.o_data.level.eq(
+                    Mux(gate, Cat(velocity[5:], velocity, velocity), 0)
+                ),
+            ]
+        with m.If(self.level_inlet.sent()):
+            m.d.sync += [
+                self.level_inlet.o_valid.eq(False),
+            ]
+        return m
+
+
+class VCA(Elaboratable):
+
+    """Voltage controlled amplifier.  Multiply samples by levels.
+
+       `signal_spec`'s data is either a signed sample or a record of
+       signed samples (lanes), like `stereo_sample_spec`.  Each lane
+       is multiplied by the level of the transfer's voice.  Levels
+       are set through `level_outlet`.
+
+       With `voices` > 1, the voices are interleaved: transfers are
+       for voice 0, 1, ..., voices - 1, 0, ...  If `signal_spec` has
+       START_STOP, `start` marks voice 0.
+
+       One multiplier is shared by all voices and lanes, and it
+       handles one lane per clock.  So mono samples pass at one per
+       clock, but stereo samples only pass at one per two clocks:
+       half rate.  Full rate stereo would need a second DSP.
+
+       This is a registered pipeline, not a passthrough.  A transfer
+       is held while its lanes are multiplied, and comes out four
+       clocks after it is taken, plus a clock for each extra lane.
+       `signal_outlet` is ready when the hold register is free or is
+       passing on its last lane.
+    """
+
+    def __init__(self, signal_spec, voices=1):
+        dsol = signal_spec.dsol
+        if isinstance(dsol, Shape):
+            self.lane_names = None
+            lane_shapes = [dsol]
+        else:
+            self.lane_names = [name for (name, _, _) in dsol]
+            lane_shapes = [shape for (_, shape, _) in dsol]
+        self.sample_width = lane_shapes[0].width
+        assert all(s == signed(self.sample_width) for s in lane_shapes), (
+            f'VCA: lanes must all be signed({self.sample_width})'
+        )
+        assert self.sample_width <= 16, 'VCA: samples must fit in SB_MAC16'
+        self.lanes = len(lane_shapes)
+        self.voices = voices
+        self.start_stop = signal_spec.start_stop
+
+        self.level_outlet = voice_level_spec(voices).outlet()
+        self.signal_outlet = signal_spec.outlet()
+        self.signal_inlet = signal_spec.inlet()
+
+    def _lane_signals(self, data):
+        if self.lane_names is None:
+            return [data]
+        return [data[name] for name in self.lane_names]
+
+    def elaborate(self, platform):
+        s_in = self.signal_outlet
+        s_out = self.signal_inlet
+        lanes = self.lanes
+        width = self.sample_width
+        in_lanes = self._lane_signals(s_in.i_data)
+        out_lanes = self._lane_signals(s_out.o_data)
+
+        m = Module()
+
+        # Levels are kept in a small RAM, one per voice.
+        level_RAM = Memory(width=LEVEL_WIDTH, depth=self.voices)
+        m.submodules.lw_port = lw_port = level_RAM.write_port()
+        m.submodules.lr_port = lr_port = level_RAM.read_port(
+            transparent=False
+        )
+        m.d.comb += [
+            self.level_outlet.o_ready.eq(True),
+            lw_port.addr.eq(self.level_outlet.i_data.voice),
+            lw_port.data.eq(self.level_outlet.i_data.level),
+            lw_port.en.eq(self.level_outlet.received()),
+        ]
+
+        # The whole pipeline moves when the output is free.
+        advance = Signal()
+        m.d.comb += advance.eq(~s_out.o_valid | s_out.i_ready)
+
+        # Stage 0: hold a transfer while its lanes go through the
+        # multiplier, one per clock.
+        hold = Signal(lanes * width)
+        hold_valid = Signal()
+        hold_start = Signal()
+        hold_stop = Signal()
+        lane = Signal(range(lanes))
+        last_lane = Signal()
+        voice = Signal(range(self.voices), reset=self.voices - 1)
+        next_voice = Signal.like(voice)
+        m.d.comb += [
+            last_lane.eq(lane == lanes - 1),
+            s_in.o_ready.eq(~hold_valid | (advance & last_lane)),
+            lr_port.addr.eq(voice),
+            lr_port.en.eq(advance),
+        ]
+        if self.start_stop:
+            m.d.comb += next_voice.eq(
+                Mux(s_in.i_start | (voice == self.voices - 1), 0, voice + 1)
+            )
+        else:
+            m.d.comb += next_voice.eq(
+                Mux(voice == self.voices - 1, 0, voice + 1)
+            )
+        with m.If(advance & hold_valid):
+            m.d.sync += [
+                hold.eq(hold >> width),
+                lane.eq(lane + 1),
+            ]
+            with m.If(last_lane):
+                m.d.sync += [
+                    hold_valid.eq(False),
+                    lane.eq(0),
+                ]
+        with m.If(s_in.received()):
+            m.d.sync += [
+                hold.eq(Cat(*in_lanes)),
+                hold_valid.eq(True),
+                lane.eq(0),
+            ]
+            if self.voices > 1:
+                m.d.sync += voice.eq(next_voice)
+            if self.start_stop:
+                m.d.sync += [
+                    hold_start.eq(s_in.i_start),
+                    hold_stop.eq(s_in.i_stop),
+                ]
+
+        # Stage 1: one lane's sample and its voice's level.
+        sample = Signal(signed(width))
+        valid1 = Signal()
+        last1 = Signal()
+        start1 = Signal()
+        stop1 = Signal()
+        with m.If(advance):
+            m.d.sync += [
+                sample.eq(hold[:width]),
+                valid1.eq(hold_valid),
+                last1.eq(last_lane),
+                start1.eq(hold_start),
+                stop1.eq(hold_stop),
+            ]
+
+        # Stage 2: multiply.  The level's MSB is dropped so both
+        # operands are 16 bit signed.
+        prod = Signal(signed(width + LEVEL_WIDTH))
+        valid2 = Signal()
+        last2 = Signal()
+        start2 = Signal()
+        stop2 = Signal()
+        level = Signal(signed(LEVEL_WIDTH))
+        m.d.comb += level.eq(lr_port.data[1:])
+        with m.If(advance):
+            m.d.sync += [
+                prod.eq(sample * level),
+                valid2.eq(valid1),
+                last2.eq(last1),
+                start2.eq(start1),
+                stop2.eq(stop1),
+            ]
+
+        # Stage 3: collect the lanes and send.
+        scaled = prod[LEVEL_WIDTH - 1:][:width]
+        if lanes > 1:
+            done = Signal((lanes - 1) * width)
+            with m.If(advance & valid2):
+                m.d.sync += done.eq(Cat(done[width:], scaled))
+            result = Cat(done, scaled)
+        else:
+            result = scaled
+        with m.If(advance & valid2):
+            with m.If(last2):
+                m.d.sync += [
+                    Cat(*out_lanes).eq(result),
+                    s_out.o_valid.eq(True),
+                ]
+                if self.start_stop:
+                    m.d.sync += [
+                        s_out.o_start.eq(start2),
+                        s_out.o_stop.eq(stop2),
+                    ]
+        with m.If(s_out.sent() & ~(valid2 & last2)):
+            m.d.sync += s_out.o_valid.eq(False)
+
+        return m
+
+
+if __name__ == '__main__':
+    from nmigen_lib.pipe import START_STOP
+
+    # A mono VCA and a 3 voice stereo VCA.
+    mono = VCA(PipeSpec(signed(16)))
+    stereo_spec = PipeSpec((
+        ('left', signed(16)),
+        ('right', signed(16)),
+    ), flags=START_STOP)
+    poly = VCA(stereo_spec, voices=3)
+    for design in (mono, poly):
+        design.level_outlet.leave_unconnected()
+        design.signal_outlet.leave_unconnected()
+        design.signal_inlet.leave_unconnected()
+
+    # Work around nMigen issue #280
+    m = Module()
+    m.submodules.mono = mono
+    m.submodules.poly = poly
+    ports = {}
+    for (name, design) in (('mono', mono), ('poly', poly)):
+        p = ports[name] = {
+            'l_valid': Signal(name=f'{name}_l_valid'),
+            'l_voice': Signal(2, name=f'{name}_l_voice'),
+            'l_level': Signal(16, name=f'{name}_l_level'),
+            's_valid': Signal(name=f'{name}_s_valid'),
+            's_data': Signal(32, name=f'{name}_s_data'),
+            's_start': Signal(name=f'{name}_s_start'),
+            'ready': Signal(name=f'{name}_ready'),
+        }
+        m.d.comb += [
+            design.level_outlet.i_valid.eq(p['l_valid']),
+            design.level_outlet.i_data.voice.eq(p['l_voice']),
+            design.level_outlet.i_data.level.eq(p['l_level']),
+            design.signal_outlet.i_valid.eq(p['s_valid']),
+            design.signal_outlet.i_data.eq(p['s_data']),
+            design.signal_inlet.i_ready.eq(p['ready']),
+        ]
+    m.d.comb += poly.signal_outlet.i_start.eq(ports['poly']['s_start'])
+
+    def vca(sample, level):
+        return sample * (level >> 1) >> 15
+
+    mono_levels = [0xFFFF]
+    mono_samples = [-32768, 32767, 0, 1, -1, 12345, -23456, 5] * 4
+    mono_expected = [vca(s, 0xFFFF) for s in mono_samples]
+
+    poly_levels = [0xFFFF, 0x8000, 0x0123]
+    poly_frames = [
+        [(i * 1000 - v * 7777, v * 3333 - i * 2000) for v in range(3)]
+        for i in range(6)
+    ]
+    # A stray transfer, then whole frames with `start` on voice 0.
+    poly_stream = [((-1, -1), False)] + [
+        (pair, v == 0)
+        for frame in poly_frames
+        for (v, pair) in enumerate(frame)
+    ]
+    # The stray transfer is voice 0, and the first frame restarts.
+    poly_expected = [(vca(-1, poly_levels[0]), vca(-1, poly_levels[0]))] + [
+        (vca(l, poly_levels[v]), vca(r, poly_levels[v]))
+        for frame in poly_frames
+        for (v, (l, r)) in enumerate(frame)
+    ]
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+
+        def level_source(name, levels):
+            def process():
+                p = ports[name]
+                for (v, level) in enumerate(levels):
+                    yield p['l_voice'].eq(v)
+                    yield p['l_level'].eq(level)
+                    yield p['l_valid'].eq(True)
+                    yield
+                yield p['l_valid'].eq(False)
+            return process
+
+        def sample_source(name, design, stream):
+            def process():
+                p = ports[name]
+                yield from delay(4)
+                for (data, start) in stream:
+                    if isinstance(data, tuple):
+                        data = data[0] & 0xFFFF | (data[1] & 0xFFFF) << 16
+                    yield p['s_data'].eq(data)
+                    yield p['s_start'].eq(start)
+                    yield p['s_valid'].eq(True)
+                    yield Settle()
+                    while not (yield design.signal_outlet.received()):
+                        yield
+                        yield Settle()
+                    yield
+                yield p['s_valid'].eq(False)
+            return process
+
+        def sample_sink(name, design, expected, stall):
+            def process():
+                p = ports[name]
+                clock = first = 0
+                while expected:
+                    yield p['ready'].eq(not stall(clock))
+                    yield Settle()
+                    if (yield design.signal_inlet.sent()):
+                        first = first or clock
+                        if design.lanes == 1:
+                            actual = yield design.signal_inlet.o_data
+                        else:
+                            actual = (
+                                (yield design.signal_inlet.o_data.left),
+                                (yield design.signal_inlet.o_data.right),
+                            )
+                        exp = expected.pop(0)
+                        assert actual == exp, f'expected {exp}, got {actual}'
+                    yield
+                    clock += 1
+                return (first, clock)
+            return process
+
+        # The mono VCA runs at one sample per clock.
+        n_mono = len(mono_expected)
+        def mono_sink():
+            first, last = yield from sample_sink(
+                'mono', mono, mono_expected, lambda c: False)()
+            assert last - first == n_mono, (
+                f'{n_mono} samples took {last - first} clocks'
+            )
+
+        # The stereo VCA runs at one sample per two clocks, less a
+        # clock per output stall at most.
+        n_poly = len(poly_expected)
+        def poly_stall(clock):
+            return clock % 7 == 3
+        def poly_sink():
+            first, last = yield from sample_sink(
+                'poly', poly, poly_expected, poly_stall)()
+            stalls = sum(poly_stall(c) for c in range(first, last))
+            assert 2 * n_poly - 1 <= last - first <= 2 * n_poly - 1 + stalls, (
+                f'{n_poly} samples took {last - first} clocks'
+            )
+
+        sim.sync_process(level_source('mono', mono_levels))
+        sim.sync_process(sample_source('mono', mono,
+                                       [(s, False) for s in mono_samples]))
+        sim.sync_process(mono_sink)
+        sim.sync_process(level_source('poly', poly_levels))
+        sim.sync_process(sample_source('poly', poly, poly_stream))
+        sim.sync_process(poly_sink)
@@ -0,0 +1,198 @@
+#!/usr/bin/env nmigen
+
+import numpy as np
+
+from nmigen import Elaboratable, Module, Mux, Signal, signed
+from nmigen.back.pysim import Settle
+
+from nmigen_lib.pipe import StageTiming
+from nmigen_lib.util import Main
+
+from synth.osc import mono_sample_spec
+
+
+MAX_DRIVE = 3
+
+
+def fold(samples, drive, width=16):
+    """Bit-exact NumPy model of a Wavefolder.
+
+       Ported from `fold()` in experiments/wavefold.c.  Full scale is
+       1.0.  The input is multiplied by 2**drive, then reflected back
+       into range each time it crosses full scale.
+    """
+    one = 2**(width - 1)
+    y = np.asarray(samples, dtype=np.int64) << drive
+    sign = y < 0
+    a = np.abs(y)
+    b = (a >> (width - 1)) & 3
+    c = a & (one - 1)
+    d = np.choose(b, [c, one - c, -c, c - one])
+    return np.clip(np.where(sign, -d, d), -one, one - 1)
+
+
+class Wavefolder(Elaboratable):
+
+    """Fold a waveform back on itself.
+
+       Each sample is multiplied by 2**`drive`, then folded: where it
+       would go past full scale, it turns around.  Drive 0 passes a
+       signal unchanged; each step up adds more folds and brighter
+       harmonics.  So it should run at the oscillator's oversampled
+       rate, ahead of the Decimator.
+
+       No multipliers.  One sample per clock, three clocks of latency.
+       Flow control passes straight through.
+    """
+
+    pipe_timing = StageTiming(interval=1, latency=3)
+
+    def __init__(self, sample_width=16):
+        self.sample_width = sample_width
+        self.drive = Signal(range(MAX_DRIVE + 1))
+        self.samples_in = mono_sample_spec(sample_width).outlet()
+        self.samples_out = mono_sample_spec(sample_width).inlet()
+
+    def elaborate(self, platform):
+        s_in = self.samples_in
+        s_out = self.samples_out
+        width = self.sample_width
+        one = 2**(width - 1)
+
+        m = Module()
+
+        # The whole pipeline moves when the output is free.
+        advance = Signal()
+        m.d.comb += [
+            advance.eq(~s_out.o_valid | s_out.i_ready),
+            s_in.o_ready.eq(advance),
+        ]
+
+        # Stage 1: apply drive, take absolute value.
+        y = Signal(signed(width + MAX_DRIVE))
+        a = Signal(width + MAX_DRIVE)
+        sign1 = Signal()
+        valid1 = Signal()
+        m.d.comb += y.eq(s_in.i_data << self.drive)
+        with m.If(advance):
+            m.d.sync += [
+                a.eq(Mux(y < 0, -y, y)),
+                sign1.eq(y < 0),
+                valid1.eq(s_in.received()),
+            ]
+
+        # Stage 2: fold by the integer part's two LSBs.
+        b = a[width - 1:width + 1]
+        c = a[:width - 1]
+        d = Signal(signed(width + 1))
+        sign2 = Signal()
+        valid2 = Signal()
+        with m.If(advance):
+            with m.Switch(b):
+                with m.Case(0):
+                    m.d.sync += d.eq(c)
+                with m.Case(1):
+                    m.d.sync += d.eq(one - c)
+                with m.Case(2):
+                    m.d.sync += d.eq(-c)
+                with m.Case(3):
+                    m.d.sync += d.eq(c - one)
+            m.d.sync += [
+                sign2.eq(sign1),
+                valid2.eq(valid1),
+            ]
+
+        # Stage 3: restore the sign and clip +1.0 to the largest sample.
+        e = Signal(signed(width + 1))
+        m.d.comb += e.eq(Mux(sign2, -d, d))
+        with m.If(advance):
+            m.d.sync += [
+                s_out.o_valid.eq(valid2),
+                s_out.o_data.eq(Mux(e >= one, one - 1, e)),
+            ]
+
+        return m
+
+
+if __name__ == '__main__':
+    design = Wavefolder()
+    design.samples_in.leave_unconnected()
+    design.samples_out.leave_unconnected()
+
+    # The model matches experiments/wavefold.c's fold() to within
+    # rounding.
+    def c_fold(y):
+        sign = np.where(y < 0, -1, +1)
+        a = np.abs(y)
+        b = np.floor(a)
+        c = a - b
+        d = np.choose(b.astype(int) % 4, [c, 1 - c, -c, c - 1])
+        return sign * d
+    ramp = np.arange(-32768, 32768, 7)
+    for drive in range(MAX_DRIVE + 1):
+        exact = c_fold(ramp * 2**drive / 32768) * 32768
+        assert np.all(np.abs(fold(ramp, drive) - exact) <= 1), drive
+
+    # Work around nMigen issue #280
+    m = Module()
+    m.submodules.design = design
+    i_valid = Signal()
+    i_data = Signal(signed(16))
+    i_drive = Signal(range(MAX_DRIVE + 1))
+    o_ready = Signal()
+    m.d.comb += [
+        design.samples_in.i_valid.eq(i_valid),
+        design.samples_in.i_data.eq(i_data),
+        design.drive.eq(i_drive),
+        design.samples_out.i_ready.eq(o_ready),
+    ]
+
+    # A fast full-scale triangle at each drive.
+    tri = np.concatenate([np.arange(-32768, 32767, 1500),
+                          np.arange(32767, -32768, -1300)])
+    tri = np.concatenate([tri, [-32768, -1, 0, 1, 32767]])
+    runs = [(drive, tri, fold(tri, drive)) for drive in range(4)]
+
+    #280 with Main(design).sim as sim:
+    with Main(m).sim as sim:
+
+        @sim.sync_process
+        def source():
+            for (drive, samples, _) in runs:
+                yield i_drive.eq(drive)
+                for x in samples:
+                    yield i_data.eq(int(x))
+                    yield i_valid.eq(True)
+                    yield Settle()
+                    while not (yield design.samples_in.received()):
+                        yield
+                        yield Settle()
+                    yield
+                yield i_valid.eq(False)
+                yield from [None] * 4               # drain the pipeline
+
+        @sim.sync_process
+        def sink():
+            for (drive, samples, expected) in runs:
+                clock = 0
+                first = None
+                for exp in expected:
+                    while True:
+                        # Full speed for drive 0, with stalls after.
+                        yield o_ready.eq(drive == 0 or clock % 6 != 1)
+                        yield Settle()
+                        clock += 1
+                        if (yield design.samples_out.sent()):
+                            break
+                        yield
+                    first = clock if first is None else first
+                    actual = yield design.samples_out.o_data
+                    assert actual == exp, (
+                        f'drive {drive}: expected {exp}, got {actual}'
+                    )
+                    yield
+                if drive == 0:
+                    n = len(expected)
+                    assert clock - first == n - 1, (
+                        f'{n} samples took {clock - first + 1} clocks'
+                    )